@@ -0,0 +1,168 @@
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from eda_loader import DATA_DIR, load_churn
+
+logger = logging.getLogger("churn_cube")
+
+# Configuration
+DIMENSIONS = ("date_id", "service_class_elem_group_name", "reason", "service_name", "kateg_po_prich")
+CUBE_FILE = os.path.join(DATA_DIR, "churn_cube.npz")
+MAX_DENSE_CELLS = 50_000_000  # build() refuses larger dense cuboids; drop a dimension instead
+
+
+class ChurnCube:
+    """
+    Precomputed churn counts over integer-coded dimensions.
+
+    The base cuboid is built once with np.bincount over the mixed-radix cell
+    index of every row. Queries never touch the raw rows: slice/dice pick
+    index ranges of the dense array and roll-up sums over axes. Roll-ups are
+    memoized per set of kept dimensions, so repeated group-bys are a lookup.
+    """
+
+    def __init__(self, dimensions, labels, counts):
+        self.dimensions = tuple(dimensions)
+        self.labels = {dim: list(values) for dim, values in labels.items()}
+        self.counts = counts
+        self._label_index = {dim: {label: i for i, label in enumerate(values)} for dim, values in self.labels.items()}
+        self._rollups = {}
+
+    @classmethod
+    def build(cls, df, dimensions=DIMENSIONS):
+        """Build the cube from raw rows (one churn event per row)"""
+        shape = []
+        labels = {}
+        cell = np.zeros(len(df), dtype=np.int64)
+        for dim in dimensions:
+            codes, uniques = pd.factorize(df[dim], sort=True, use_na_sentinel=False)
+            labels[dim] = [None if pd.isna(value) else (value.item() if hasattr(value, "item") else value) for value in uniques]
+            shape.append(len(uniques))
+            cell = cell * len(uniques) + codes
+        size = int(np.prod(shape)) if shape else 1
+        if size > MAX_DENSE_CELLS:
+            raise ValueError(f"Cube would have {size} cells, reduce the dimensions")
+        counts = np.bincount(cell, minlength=size).reshape(shape).astype(np.int32)
+        return cls(dimensions, labels, counts)
+
+    def _codes(self, dim, values):
+        if not isinstance(values, (list, tuple, set, np.ndarray)):
+            values = [values]
+        index = self._label_index[dim]
+        missing = [value for value in values if value not in index]
+        if missing:
+            raise KeyError(f"Unknown {dim} value(s): {missing}")
+        return sorted(index[value] for value in values)
+
+    def rollup(self, keep=()):
+        """Counts aggregated over every dimension not in `keep` (memoized)"""
+        keep = tuple(dim for dim in self.dimensions if dim in keep)
+        result = self._rollups.get(keep)
+        if result is None:
+            axes = tuple(i for i, dim in enumerate(self.dimensions) if dim not in keep)
+            result = self.counts.sum(axis=axes, dtype=np.int64) if axes else self.counts
+            self._rollups[keep] = result
+        return result
+
+    def query(self, by=(), **filters):
+        """
+        Slice / dice / roll-up in one call.
+
+        `filters` fix dimensions to one value (slice) or a list of values (dice);
+        `by` lists the dimensions to group by. Returns a Series indexed by the
+        `by` labels, or a scalar total when `by` is empty.
+
+            cube.query(by=["reason"], date_id=5)
+            cube.query(by=["date_id", "service_class_elem_group_name"], reason=["Наряд", "ДЗ"])
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        unknown = [dim for dim in list(by) + list(filters) if dim not in self.dimensions]
+        if unknown:
+            raise KeyError(f"Unknown dimension(s): {unknown}")
+
+        # Start from the smallest memoized roll-up that still has every needed dimension
+        kept = [dim for dim in self.dimensions if dim in by or dim in filters]
+        cube = self.rollup(kept)
+        selectors = []
+        for dim in kept:
+            selectors.append(self._codes(dim, filters[dim]) if dim in filters else slice(None))
+        cube = cube[np.ix_(*[
+            np.arange(cube.shape[i])[selector] if isinstance(selector, slice) else np.asarray(selector)
+            for i, selector in enumerate(selectors)
+        ])] if kept else cube
+
+        # Sum the filtered-only dimensions away
+        axes = tuple(i for i, dim in enumerate(kept) if dim not in by)
+        if axes:
+            cube = cube.sum(axis=axes)
+        if not by:
+            return int(cube)
+
+        by_kept = [dim for dim in kept if dim in by]
+        levels = []
+        for dim in by_kept:
+            codes = self._codes(dim, filters[dim]) if dim in filters else range(len(self.labels[dim]))
+            levels.append([self.labels[dim][code] for code in codes])
+        index = pd.MultiIndex.from_product(levels, names=by_kept) if len(by_kept) > 1 else pd.Index(levels[0], name=by_kept[0])
+        series = pd.Series(cube.reshape(-1), index=index, name="count")
+        if list(by) != by_kept:
+            series = series.reorder_levels(by)
+        return series
+
+    def save(self, path=CUBE_FILE):
+        arrays = {"counts": self.counts}
+        for i, dim in enumerate(self.dimensions):
+            arrays[f"labels_{i}"] = np.array(["" if value is None else str(value) for value in self.labels[dim]])
+        np.savez_compressed(path, dimensions=np.array(self.dimensions), **arrays)
+
+    @classmethod
+    def load(cls, path=CUBE_FILE):
+        with np.load(path) as data:
+            dimensions = [str(dim) for dim in data["dimensions"]]
+            labels = {}
+            for i, dim in enumerate(dimensions):
+                values = data[f"labels_{i}"].tolist()
+                labels[dim] = [int(value) if dim == "date_id" and value else (value or None) for value in values]
+            return cls(dimensions, labels, data["counts"])
+
+
+def main():
+    setup_logging()
+    metrics = RunMetrics("churn_cube").start()
+    try:
+        with metrics.stage("load") as stage:
+            churn = load_churn()
+            stage.add_rows(len(churn))
+        with metrics.stage("build") as stage:
+            cube = ChurnCube.build(churn)
+            stage.add_rows(len(churn))
+        cube.save()
+        logger.info(f"Cube shape {cube.counts.shape} ({cube.counts.nbytes / 1024:.0f} KiB) saved to {CUBE_FILE}")
+
+        # Warm the common roll-ups, then time a few typical queries
+        examples = [
+            {"by": ["reason"]},
+            {"by": ["date_id", "service_class_elem_group_name"]},
+            {"by": ["kateg_po_prich"], "date_id": cube.labels["date_id"][0]},
+        ]
+        for example in examples:
+            cube.query(**example)
+        with metrics.stage("query") as stage:
+            for example in examples:
+                started = time.perf_counter()
+                result = cube.query(**example)
+                metrics.observe("cube_query", time.perf_counter() - started)
+                stage.add_rows()
+                logger.debug(f"{example}:\n{result}")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import codecs
+import csv
+import json
+import logging
+import os
+import shutil
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+
+logger = logging.getLogger("eda_loader")
+
+# Configuration
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+CHURN_CSV = os.path.join(DATA_DIR, "abon_sales_churn.csv")
+RFM_CSV = os.path.join(DATA_DIR, "rfm.csv")
+CACHE_DIR = os.path.join(DATA_DIR, ".eda_cache")
+CHUNK_ROWS = 100_000
+SNIFF_BYTES = 64 * 1024
+CANDIDATE_ENCODINGS = ("utf-8", "cp1251")
+CANDIDATE_DELIMITERS = ";,\t|"
+CACHE_VERSION = 2  # bump when a schema changes so old caches are rebuilt
+
+# Column dtypes. "category" columns are read as strings and unified across chunks;
+# integers are nullable so a missing or malformed value stays <NA> instead of becoming 0,
+# free text ("comments", mostly unique) is kept as plain strings.
+CHURN_SCHEMA = {
+    "date_id": "Int8",
+    "consumer_id": "Int32",
+    "service_class_elem_group_name": "category",
+    "flg": "category",
+    "reason": "category",
+    "comments": "string",
+    "service_name": "category",
+    "kateg_po_prich": "category",
+    "proch": "category",
+}
+RFM_SCHEMA = {
+    "consumer_id": "Int32",
+    "devices_count": "Int16",
+    "frequency": "float32",
+    "recency": "float32",
+    "monetary": "float32",
+}
+
+
+def detect_format(path, sniff_bytes=SNIFF_BYTES):
+    """Detect (encoding, delimiter) of a CSV file from its first bytes"""
+    with open(path, "rb") as f:
+        sample = f.read(sniff_bytes)
+
+    encoding = None
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    else:
+        for candidate in CANDIDATE_ENCODINGS:
+            try:
+                # A multi-byte character may be cut at the end of the sample
+                codecs.getincrementaldecoder(candidate)().decode(sample, final=False)
+                encoding = candidate
+                break
+            except UnicodeDecodeError:
+                continue
+    if encoding is None:
+        raise ValueError(f"Could not detect encoding of {path}")
+
+    text = sample.decode(encoding, errors="ignore")
+    header = text.splitlines()[0] if text else ""
+    try:
+        delimiter = csv.Sniffer().sniff(header, delimiters=CANDIDATE_DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = max(CANDIDATE_DELIMITERS, key=header.count)
+    return encoding, delimiter
+
+
+def read_typed(path, schema, chunksize=CHUNK_ROWS):
+    """
+    Stream a CSV in chunks and cast every chunk to the compact schema right away,
+    so peak memory is one raw chunk plus the typed result.
+    """
+    encoding, delimiter = detect_format(path)
+    logger.info(f"Reading {os.path.basename(path)} ({encoding}, delimiter {delimiter!r})")
+
+    # Quoted numbers ("05", "9.25") are parsed per column below
+    read_dtypes = {col: "float64" if dtype.startswith("float") else "string" for col, dtype in schema.items()}
+    chunks = []
+    for chunk in pd.read_csv(path, sep=delimiter, encoding=encoding, dtype=read_dtypes,
+                             usecols=list(schema), chunksize=chunksize):
+        typed = {}
+        for col, dtype in schema.items():
+            if dtype == "category":
+                typed[col] = chunk[col].str.strip().astype("category")
+            elif dtype.startswith("Int"):
+                typed[col] = pd.to_numeric(chunk[col], errors="coerce").astype(dtype)
+            elif dtype == "string":
+                typed[col] = chunk[col].str.strip()
+            else:
+                typed[col] = chunk[col].astype(dtype)
+        chunks.append(pd.DataFrame(typed))
+
+    if not chunks:
+        return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in schema.items()})
+    result = pd.concat(chunks, ignore_index=True)
+    for col, dtype in schema.items():
+        if dtype == "category" and len(chunks) > 1:
+            # concat falls back to object when chunk categories differ
+            result[col] = pd.api.types.union_categoricals([chunk[col] for chunk in chunks])
+    return result
+
+
+def _source_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "version": CACHE_VERSION}
+
+
+def save_columnar(df, cache_path, signature=None):
+    """
+    Write one .npy file per column: categoricals as codes + categories in meta.json,
+    nullable integers as values + a .mask.npy, strings as UTF-8 bytes + .offsets.npy.
+    """
+    tmp_path = f"{cache_path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    meta = {"signature": signature, "rows": len(df), "columns": []}
+    for col in df.columns:
+        values = df[col]
+        entry = {"name": col}
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            entry["categories"] = [str(value) for value in values.cat.categories]
+            np.save(os.path.join(tmp_path, f"{col}.npy"), values.cat.codes.to_numpy())
+        elif isinstance(values.dtype, pd.StringDtype):
+            entry["dtype"] = "string"
+            missing = values.isna().to_numpy()
+            encoded = [text.encode("utf-8") for text in values.fillna("")]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(data) for data in encoded], out=offsets[1:])
+            np.save(os.path.join(tmp_path, f"{col}.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            np.save(os.path.join(tmp_path, f"{col}.offsets.npy"), offsets)
+            np.save(os.path.join(tmp_path, f"{col}.mask.npy"), missing)
+        elif isinstance(values.dtype, pd.api.extensions.ExtensionDtype):
+            # Nullable integers: raw values plus the missing mask
+            entry["dtype"] = str(values.dtype)
+            array = values.array
+            np.save(os.path.join(tmp_path, f"{col}.npy"), array.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0))
+            np.save(os.path.join(tmp_path, f"{col}.mask.npy"), array.isna())
+        else:
+            np.save(os.path.join(tmp_path, f"{col}.npy"), values.to_numpy())
+        meta["columns"].append(entry)
+    with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    shutil.rmtree(cache_path, ignore_errors=True)
+    os.replace(tmp_path, cache_path)
+
+
+def load_columnar(cache_path, mmap=True):
+    """Load a cache written by save_columnar(); plain numeric columns are memory-mapped"""
+    with open(os.path.join(cache_path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    mmap_mode = "r" if mmap else None
+    data = {}
+    for entry in meta["columns"]:
+        base = os.path.join(cache_path, entry["name"])
+        values = np.load(f"{base}.npy", mmap_mode=mmap_mode)
+        if "categories" in entry:
+            values = pd.Categorical.from_codes(np.asarray(values), categories=entry["categories"])
+        elif entry.get("dtype") == "string":
+            raw = np.asarray(values).tobytes()
+            offsets = np.load(f"{base}.offsets.npy")
+            texts = [raw[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+            values = pd.array(texts, dtype="string")
+            values[np.load(f"{base}.mask.npy")] = pd.NA
+        elif "dtype" in entry:
+            values = pd.arrays.IntegerArray(np.asarray(values), np.load(f"{base}.mask.npy"))
+        data[entry["name"]] = values
+    return pd.DataFrame(data, copy=False), meta
+
+
+def load_dataset(path, schema, use_cache=True, cache_dir=CACHE_DIR):
+    """Typed DataFrame for a CSV, served from the columnar cache while the source is unchanged"""
+    cache_path = os.path.join(cache_dir, os.path.splitext(os.path.basename(path))[0])
+    signature = _source_signature(path)
+    if use_cache and os.path.exists(os.path.join(cache_path, "meta.json")):
+        df, meta = load_columnar(cache_path)
+        if meta.get("signature") == signature:
+            logger.debug(f"Loaded {os.path.basename(path)} from cache {cache_path}")
+            return df
+        logger.info(f"Cache for {os.path.basename(path)} is stale, rebuilding")
+
+    df = read_typed(path, schema)
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        save_columnar(df, cache_path, signature)
+    return df
+
+
+def load_churn(path=CHURN_CSV, use_cache=True):
+    return load_dataset(path, CHURN_SCHEMA, use_cache)
+
+
+def load_rfm(path=RFM_CSV, use_cache=True):
+    return load_dataset(path, RFM_SCHEMA, use_cache)
+
+
+def main():
+    setup_logging()
+    metrics = RunMetrics("eda_loader").start()
+    try:
+        for name, loader in (("churn", load_churn), ("rfm", load_rfm)):
+            with metrics.stage(name) as stage:
+                df = loader()
+                stage.add_rows(len(df))
+            logger.info(f"{name}: {len(df)} rows, {df.memory_usage(deep=True).sum() / 1024:.0f} KiB in memory")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from eda_loader import DATA_DIR, load_churn, load_rfm
+from rfm_scoring import fit_frame
+
+logger = logging.getLogger("feature_store")
+
+# Configuration
+STORE_DIR = os.path.join(DATA_DIR, "consumer_features")
+RFM_FEATURES = ("devices_count", "recency", "frequency", "monetary")
+SCORE_FEATURES = ("r_score", "f_score", "m_score")
+CHURN_COUNT_DIMENSIONS = {
+    "service": "service_class_elem_group_name",
+    "reason": "reason",
+}
+
+
+def _count_matrix(rows, codes, n_rows, n_codes):
+    """Per-row event counts by category, as one bincount over row * n_codes + code"""
+    valid = codes >= 0
+    flat = rows[valid].astype(np.int64) * n_codes + codes[valid]
+    return np.bincount(flat, minlength=n_rows * n_codes).reshape(n_rows, n_codes)
+
+
+def build_store(rfm, churn, store_dir=STORE_DIR):
+    """
+    Build the feature store: a sorted int32 consumer_id index and a float32
+    feature matrix written straight into a .npy memmap, plus features.json
+    with the column names. Consumers present in only one source get NaN
+    (RFM) or zero (churn counts) features.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    rfm = rfm[rfm["consumer_id"].notna()]
+    churn = churn[churn["consumer_id"].notna()]
+    model = fit_frame(rfm)  # dedupes rfm rows per consumer (last wins) and scores them
+    rfm_last = rfm.drop_duplicates("consumer_id", keep="last").set_index("consumer_id")
+
+    churn_ids = churn["consumer_id"].to_numpy(dtype=np.int32)
+    ids = np.union1d(model.ids, churn_ids).astype(np.int32)
+    n = len(ids)
+
+    names = ["has_rfm", *RFM_FEATURES, *SCORE_FEATURES, "churn_events"]
+    churn_codes = {}
+    for prefix, column in CHURN_COUNT_DIMENSIONS.items():
+        codes, uniques = pd.factorize(churn[column], sort=True)
+        if len(uniques) == 0:
+            continue  # no churn events (or none with this column set): no columns for the dimension
+        churn_codes[prefix] = (codes, uniques)
+        names.extend(f"churn_{prefix}_{value}" for value in uniques)
+
+    matrix = np.lib.format.open_memmap(
+        os.path.join(store_dir, "features.npy"), mode="w+", dtype=np.float32, shape=(n, len(names))
+    )
+    matrix[:] = 0
+    col = {name: i for i, name in enumerate(names)}
+
+    # RFM block: scatter the model's sorted arrays into the joint index
+    rfm_rows = np.searchsorted(ids, model.ids)
+    matrix[rfm_rows, col["has_rfm"]] = 1
+    for name in RFM_FEATURES:
+        matrix[:, col[name]] = np.nan
+        if name == "devices_count":
+            matrix[rfm_rows, col[name]] = rfm_last.loc[model.ids, name].to_numpy(dtype=np.float32)
+        else:
+            matrix[rfm_rows, col[name]] = model.values[name]
+    for name, metric in zip(SCORE_FEATURES, model.METRICS):
+        matrix[:, col[name]] = np.nan
+        matrix[rfm_rows, col[name]] = model.scores[metric]
+
+    # Churn block: event counts per consumer, total and by service / reason
+    churn_rows = np.searchsorted(ids, churn_ids)
+    matrix[:, col["churn_events"]] = np.bincount(churn_rows, minlength=n)
+    for prefix, (codes, uniques) in churn_codes.items():
+        first = col[f"churn_{prefix}_{uniques[0]}"]
+        matrix[:, first:first + len(uniques)] = _count_matrix(churn_rows, codes, n, len(uniques))
+
+    matrix.flush()
+    del matrix
+    np.save(os.path.join(store_dir, "consumer_ids.npy"), ids)
+    with open(os.path.join(store_dir, "features.json"), "w", encoding="utf-8") as f:
+        json.dump({"features": names, "consumers": n}, f, ensure_ascii=False, indent=2)
+    logger.info(f"Feature store: {n} consumers x {len(names)} features in {store_dir}")
+    return FeatureStore(store_dir)
+
+
+class FeatureStore:
+    """
+    Read side of the feature store. Both arrays are opened with mmap_mode='r',
+    so every process that opens the store shares the same page-cache pages and
+    row lookups return views without copying the matrix.
+    """
+
+    def __init__(self, store_dir=STORE_DIR):
+        self.store_dir = store_dir
+        self.ids = np.load(os.path.join(store_dir, "consumer_ids.npy"), mmap_mode="r")
+        self.matrix = np.load(os.path.join(store_dir, "features.npy"), mmap_mode="r")
+        with open(os.path.join(store_dir, "features.json"), encoding="utf-8") as f:
+            self.features = json.load(f)["features"]
+        self.columns = {name: i for i, name in enumerate(self.features)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows(self, consumer_ids):
+        """Row positions of consumer ids; -1 for unknown consumers"""
+        consumer_ids = np.asarray(consumer_ids, dtype=np.int32)
+        if len(self.ids) == 0:
+            return np.full(consumer_ids.shape, -1, dtype=np.intp)
+        pos = np.searchsorted(self.ids, consumer_ids)
+        pos = np.minimum(pos, len(self.ids) - 1)
+        return np.where(self.ids[pos] == consumer_ids, pos, -1)
+
+    def vector(self, consumer_id):
+        """Feature vector of one consumer as a read-only view into the memmap"""
+        pos = int(self.rows([consumer_id])[0])
+        if pos < 0:
+            raise KeyError(consumer_id)
+        return self.matrix[pos]
+
+    def batch(self, consumer_ids, features=None):
+        """Feature rows for many consumers (unknown consumers come back as NaN rows)"""
+        pos = self.rows(consumer_ids)
+        cols = [self.columns[name] for name in features] if features else slice(None)
+        if len(self.ids) == 0:
+            n_cols = len(cols) if features else len(self.features)
+            return np.full((len(pos), n_cols), np.nan, dtype=self.matrix.dtype)
+        result = self.matrix[np.maximum(pos, 0)][:, cols]
+        result[pos < 0] = np.nan
+        return result
+
+    def frame(self, features=None):
+        names = list(features) if features else self.features
+        cols = [self.columns[name] for name in names]
+        return pd.DataFrame(self.matrix[:, cols], index=pd.Index(self.ids, name="consumer_id"), columns=names)
+
+
+def main():
+    setup_logging()
+    metrics = RunMetrics("feature_store").start()
+    try:
+        with metrics.stage("load") as stage:
+            rfm = load_rfm()
+            churn = load_churn()
+            stage.add_rows(len(rfm) + len(churn))
+        with metrics.stage("build") as stage:
+            store = build_store(rfm, churn)
+            stage.add_rows(len(store))
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from eda_loader import DATA_DIR, load_rfm
+
+logger = logging.getLogger("rfm_scoring")
+
+# Configuration
+N_BINS = 5  # scores 1..5
+SEGMENTS_CSV = os.path.join(DATA_DIR, "rfm_segments.csv")
+BENCHMARK_ROWS = 10_000_000
+
+# Segment by recency score (rows) and the rounded mean of frequency/monetary scores (columns)
+SEGMENT_NAMES = np.array([
+    "Lost", "Hibernating", "About to Sleep", "Need Attention", "Promising",
+    "New Customers", "Potential Loyalists", "Loyal", "At Risk", "Can't Lose Them", "Champions",
+])
+SEGMENT_GRID = np.array([
+    # FM: 1   2   3   4   5
+    [0, 0, 1, 8, 9],   # R = 1
+    [0, 1, 1, 8, 8],   # R = 2
+    [2, 2, 3, 7, 7],   # R = 3
+    [4, 4, 6, 6, 7],   # R = 4
+    [5, 4, 6, 10, 10], # R = 5
+], dtype=np.int8)
+
+
+def score(values, edges, higher_is_better=True):
+    """Vectorized 1..N_BINS score of values against inner quantile edges"""
+    scores = np.searchsorted(edges, values, side="right").astype(np.int8) + 1
+    return scores if higher_is_better else (N_BINS + 1 - scores).astype(np.int8)
+
+
+def assign_segments(r_score, f_score, m_score):
+    """Segment codes from the R score and the rounded mean FM score"""
+    fm = ((f_score.astype(np.int16) + m_score + 1) // 2).astype(np.int8)
+    return SEGMENT_GRID[r_score - 1, fm - 1]
+
+
+class RFMModel:
+    """
+    Quantile-binned RFM scores and segments for a set of consumers.
+
+    State is kept as sorted struct-of-arrays keyed by consumer_id, so update()
+    can upsert a batch of new or changed consumers with searchsorted instead
+    of deduping and sorting the whole population again. update() is still
+    O(n) per batch, not incremental: np.insert copies the arrays, the quantile
+    edges are recomputed over all values and the consumers between an old and
+    a new edge are found with full scans. Only the batch and those consumers
+    are rescored, which gives exactly the scores of a full refit.
+    """
+
+    METRICS = ("recency", "frequency", "monetary")
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.values = {name: np.zeros(0, dtype=np.float32) for name in self.METRICS}
+        self.scores = {name: np.zeros(0, dtype=np.int8) for name in self.METRICS}
+        self.segments = np.zeros(0, dtype=np.int8)
+        self.edges = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _quantile_edges(self):
+        qs = np.arange(1, N_BINS) / N_BINS
+        return {
+            name: np.quantile(self.values[name], qs) if len(self.ids) else np.zeros(N_BINS - 1)
+            for name in self.METRICS
+        }
+
+    def _score_rows(self, index):
+        for name in self.METRICS:
+            self.scores[name][index] = score(self.values[name][index], self.edges[name], name != "recency")
+        self.segments[index] = assign_segments(
+            self.scores["recency"][index], self.scores["frequency"][index], self.scores["monetary"][index]
+        )
+
+    def fit(self, consumer_id, recency, frequency, monetary):
+        """Score a full population (later duplicates of a consumer_id win)"""
+        consumer_id = np.asarray(consumer_id, dtype=np.int32)
+        # Keep the last row of every consumer, then sort by id
+        reversed_ids = consumer_id[::-1]
+        _, last = np.unique(reversed_ids, return_index=True)
+        keep = len(consumer_id) - 1 - last
+        self.ids = consumer_id[keep]
+        raw = {"recency": recency, "frequency": frequency, "monetary": monetary}
+        for name in self.METRICS:
+            self.values[name] = np.asarray(raw[name], dtype=np.float32)[keep]
+            self.scores[name] = np.zeros(len(keep), dtype=np.int8)
+        self.segments = np.zeros(len(self.ids), dtype=np.int8)
+        self.edges = self._quantile_edges()
+        self._score_rows(slice(None))
+        return self
+
+    def update(self, consumer_id, recency, frequency, monetary):
+        """
+        Upsert a batch of consumers and rescore the batch plus the consumers
+        an edge moved across. Costs O(n) in the population size, see the class
+        docstring. Returns the number of rows rescored.
+        """
+        consumer_id = np.asarray(consumer_id, dtype=np.int32)
+        _, last = np.unique(consumer_id[::-1], return_index=True)
+        keep = len(consumer_id) - 1 - last
+        batch_ids = consumer_id[keep]
+        raw = {"recency": recency, "frequency": frequency, "monetary": monetary}
+        batch = {name: np.asarray(raw[name], dtype=np.float32)[keep] for name in self.METRICS}
+
+        pos = np.searchsorted(self.ids, batch_ids)
+        exists = pos < len(self.ids)
+        exists[exists] = self.ids[pos[exists]] == batch_ids[exists]
+
+        # Changed consumers are overwritten in place
+        changed_pos = pos[exists]
+        for name in self.METRICS:
+            self.values[name][changed_pos] = batch[name][exists]
+
+        # New consumers: insert at their sorted positions
+        new = ~exists
+        insert_at = pos[new]
+        if new.any():
+            self.ids = np.insert(self.ids, insert_at, batch_ids[new])
+            for name in self.METRICS:
+                self.values[name] = np.insert(self.values[name], insert_at, batch[name][new])
+                self.scores[name] = np.insert(self.scores[name], insert_at, 0)
+            self.segments = np.insert(self.segments, insert_at, 0)
+
+        old_edges = self.edges
+        self.edges = self._quantile_edges()
+        affected = np.zeros(len(self.ids), dtype=bool)
+        affected[np.searchsorted(self.ids, batch_ids)] = True
+        for name in self.METRICS:
+            moved = old_edges[name] != self.edges[name]
+            for old, new in zip(old_edges[name][moved], self.edges[name][moved]):
+                values = self.values[name]
+                affected |= (values >= min(old, new)) & (values <= max(old, new))
+        index = np.flatnonzero(affected)
+        self._score_rows(index)
+        return len(index)
+
+    def to_frame(self):
+        return pd.DataFrame({
+            "consumer_id": self.ids,
+            "recency": self.values["recency"],
+            "frequency": self.values["frequency"],
+            "monetary": self.values["monetary"],
+            "r_score": self.scores["recency"],
+            "f_score": self.scores["frequency"],
+            "m_score": self.scores["monetary"],
+            "segment": pd.Categorical.from_codes(self.segments, categories=SEGMENT_NAMES),
+        })
+
+
+def fit_frame(rfm):
+    """RFMModel fitted on a frame with consumer_id/recency/frequency/monetary columns"""
+    rfm = rfm[rfm["consumer_id"].notna()]
+    return RFMModel().fit(rfm["consumer_id"], rfm["recency"], rfm["frequency"], rfm["monetary"])
+
+
+def synthetic_rfm(n, seed=0):
+    """Synthetic consumers with skewed RFM distributions similar to EDA/rfm.csv"""
+    rng = np.random.default_rng(seed)
+    return {
+        "consumer_id": rng.permutation(n).astype(np.int32) + 10_000_000,
+        "recency": rng.exponential(7.0, n).astype(np.float32),
+        "frequency": rng.uniform(1, 90, n).astype(np.float32),
+        "monetary": rng.lognormal(7.7, 0.5, n).astype(np.float32),
+    }
+
+
+def benchmark(n=BENCHMARK_ROWS, update_fraction=0.01, seed=0):
+    """Time fit + one batch update on n synthetic consumers and record peak traced memory"""
+    data = synthetic_rfm(n, seed)
+    tracemalloc.start()
+    started = time.perf_counter()
+    model = RFMModel().fit(data["consumer_id"], data["recency"], data["frequency"], data["monetary"])
+    fit_seconds = time.perf_counter() - started
+    fit_peak = tracemalloc.get_traced_memory()[1]
+
+    rng = np.random.default_rng(seed + 1)
+    batch_size = max(1, int(n * update_fraction))
+    # Half of the batch are existing consumers with new values, half are new consumers
+    batch_ids = np.concatenate([
+        rng.choice(data["consumer_id"], batch_size // 2, replace=False),
+        np.arange(batch_size - batch_size // 2, dtype=np.int32) + 10_000_000 + n,
+    ])
+    batch = synthetic_rfm(batch_size, seed + 2)
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    rescored_rows = model.update(batch_ids, batch["recency"], batch["frequency"], batch["monetary"])
+    update_seconds = time.perf_counter() - started
+    update_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "consumers": n,
+        "fit_seconds": round(fit_seconds, 3),
+        "fit_rows_per_sec": round(n / fit_seconds),
+        "fit_peak_mib": round(fit_peak / 2**20, 1),
+        "update_rows": batch_size,
+        "update_seconds": round(update_seconds, 3),
+        "update_rows_per_sec": round(batch_size / update_seconds),
+        "update_peak_mib": round(update_peak / 2**20, 1),
+        "update_rescored_rows": rescored_rows,
+    }
+
+
+def main():
+    setup_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else BENCHMARK_ROWS
+        for key, value in benchmark(n).items():
+            logger.info(f"{key}: {value}")
+        return
+
+    metrics = RunMetrics("rfm_scoring").start()
+    try:
+        with metrics.stage("load") as stage:
+            rfm = load_rfm()
+            stage.add_rows(len(rfm))
+        with metrics.stage("score") as stage:
+            segments = fit_frame(rfm).to_frame()
+            stage.add_rows(len(segments))
+        segments.to_csv(SEGMENTS_CSV, index=False)
+        logger.info(f"Segments: {segments['segment'].value_counts().to_dict()}")
+        logger.info(f"Saved {len(segments)} scored consumers to {SEGMENTS_CSV}")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
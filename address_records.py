@@ -0,0 +1,374 @@
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from run_metrics import setup_logging
+
+logger = logging.getLogger("address_records")
+
+# Column kinds: "int" -> int64 (INT_NA for missing), "float" -> float64 (NaN), "str" -> interned int32 code (-1)
+INT_NA = np.iinfo(np.int64).min
+INITIAL_CAPACITY = 1024
+ITER_BLOCK_ROWS = 65_536
+BENCHMARK_ROWS = 1_000_000
+
+
+def _missing(value):
+    """None, NaN, pd.NA or an empty string (cheap checks first, this runs per field)"""
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value == ""
+    if isinstance(value, float):
+        return value != value
+    return value is pd.NA or value is pd.NaT
+
+
+class Record:
+    """
+    Base for the slotted record types. Subclasses list their fields in SCHEMA
+    and use them as __slots__, so an instance has no per-object __dict__ and
+    does not repeat the key strings of a dict.
+    """
+
+    __slots__ = ()
+    SCHEMA = {}
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+        for name in self.__slots__[len(args):]:
+            setattr(self, name, kwargs.get(name))
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**{name: values.get(name) for name in cls.__slots__})
+
+    def get(self, name, default=None):
+        """dict.get() lookalike so code written against row dicts keeps working"""
+        value = getattr(self, name, default)
+        return default if value is None else value
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class AddressRecord(Record):
+    """A geocoded FTTH address (the beeline / combined CSV schema)"""
+
+    SCHEMA = {
+        "street_id": "int", "street_name": "str", "house": "str", "sub_house": "str", "is_available": "int",
+        "full_address": "str", "latitude": "float", "longitude": "float", "gis_full_name": "str", "provider": "str",
+    }
+    __slots__ = tuple(SCHEMA)
+
+
+# read_csv converters for AddressRecord CSVs: an empty sub_house means "no корпус" and is
+# read back as '' (the default NA handling would turn it into NaN / None)
+ADDRESS_CSV_CONVERTERS = {"sub_house": str}
+
+
+class LocationRecord(Record):
+    """A node of the Telecom region > district > town > street hierarchy"""
+
+    SCHEMA = {
+        "id": "int", "parent_id": "int", "type": "str", "name": "str", "original_id": "int",
+        "full_address": "str", "coordX": "float", "coordY": "float",
+    }
+    __slots__ = tuple(SCHEMA)
+
+
+class StringPool:
+    """Interns strings to int32 codes; every distinct value is stored once"""
+
+    def __init__(self):
+        self.values = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        if not isinstance(value, str) and _missing(value):
+            return -1
+        value = str(value)
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def codes(self, values):
+        """Vectorized code() for a column (factorizes first, so each distinct value is looked up once)"""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        mapping = np.array([self.code(value) for value in uniques], dtype=np.int32)
+        result = np.full(len(codes), -1, dtype=np.int32)
+        valid = codes >= 0
+        result[valid] = mapping[codes[valid]]
+        return result
+
+    def decode(self, codes):
+        """Object array of strings for codes (None for -1)"""
+        lookup = np.empty(len(self.values) + 1, dtype=object)
+        lookup[:-1] = self.values
+        return lookup[np.asarray(codes)]
+
+
+class RecordTable:
+    """
+    Struct-of-arrays container for one record type: a NumPy array per field
+    (int64 / float64, strings as int32 codes into a shared StringPool), grown
+    by doubling. Rows are materialized as slotted records only when iterated.
+    """
+
+    def __init__(self, record_type, capacity=INITIAL_CAPACITY, strings=None):
+        self.record_type = record_type
+        self.schema = record_type.SCHEMA
+        self.strings = strings if strings is not None else StringPool()
+        self._length = 0
+        self._capacity = capacity
+        self._columns = {name: self._empty(kind, capacity) for name, kind in self.schema.items()}
+
+    @staticmethod
+    def _empty(kind, capacity):
+        if kind == "int":
+            return np.full(capacity, INT_NA, dtype=np.int64)
+        if kind == "float":
+            return np.full(capacity, np.nan, dtype=np.float64)
+        return np.full(capacity, -1, dtype=np.int32)
+
+    def __len__(self):
+        return self._length
+
+    def _reserve(self, extra):
+        needed = self._length + extra
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, 2 * self._capacity)
+        for name, kind in self.schema.items():
+            grown = self._empty(kind, capacity)
+            grown[:self._length] = self._columns[name][:self._length]
+            self._columns[name] = grown
+        self._capacity = capacity
+
+    def _encode(self, kind, value):
+        if kind == "str":
+            return self.strings.code(value)
+        if _missing(value):
+            return INT_NA if kind == "int" else np.nan
+        try:
+            return int(float(value)) if kind == "int" else float(value)
+        except (TypeError, ValueError, OverflowError):
+            # A malformed field is stored as missing instead of failing the whole table
+            return INT_NA if kind == "int" else np.nan
+
+    def append(self, record):
+        """Append a record instance or a dict (keys outside the schema are ignored)"""
+        self._reserve(1)
+        get = record.get
+        i = self._length
+        for name, kind in self.schema.items():
+            self._columns[name][i] = self._encode(kind, get(name))
+        self._length += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def extend_frame(self, df):
+        """Append the rows of a DataFrame column by column"""
+        n = len(df)
+        self._reserve(n)
+        start, end = self._length, self._length + n
+        for name, kind in self.schema.items():
+            if name not in df.columns:
+                continue
+            if kind == "str":
+                self._columns[name][start:end] = self.strings.codes(df[name].to_numpy(dtype=object))
+            elif kind == "float":
+                self._columns[name][start:end] = pd.to_numeric(df[name], errors="coerce").to_numpy(dtype=np.float64)
+            else:
+                values = pd.to_numeric(df[name], errors="coerce")
+                ints = values.fillna(0).to_numpy().astype(np.int64)
+                ints[values.isna().to_numpy()] = INT_NA
+                self._columns[name][start:end] = ints
+        self._length = end
+
+    @classmethod
+    def from_frame(cls, record_type, df):
+        table = cls(record_type, capacity=max(len(df), 1))
+        table.extend_frame(df)
+        return table
+
+    def column(self, name):
+        """Raw column (a view; int64 with INT_NA, float64 with NaN or int32 string codes)"""
+        return self._columns[name][:self._length]
+
+    def values(self, name):
+        """Column decoded to Python-facing values (strings for str columns)"""
+        column = self.column(name)
+        if self.schema[name] == "str":
+            return self.strings.decode(column)
+        return column
+
+    def set_column(self, name, values):
+        if self.schema[name] == "str":
+            values = self.strings.codes(values)
+        self._columns[name][:self._length] = values
+
+    def _python_values(self, name, start, stop):
+        """Column slice as a list of Python values (None for missing)"""
+        column = self._columns[name][start:stop]
+        kind = self.schema[name]
+        if kind == "str":
+            return self.strings.decode(column).tolist()
+        if kind == "int":
+            return [None if value == INT_NA else value for value in column.tolist()]
+        return [None if value != value else value for value in column.tolist()]
+
+    def row(self, i):
+        if not -self._length <= i < self._length:
+            raise IndexError(i)
+        i %= self._length
+        return self.record_type(*(self._python_values(name, i, i + 1)[0] for name in self.schema))
+
+    def __getitem__(self, i):
+        return self.row(i)
+
+    def __iter__(self, block=ITER_BLOCK_ROWS):
+        # Decode a block of rows per column at once instead of indexing NumPy scalars row by row
+        for start in range(0, self._length, block):
+            stop = min(start + block, self._length)
+            columns = [self._python_values(name, start, stop) for name in self.schema]
+            for values in zip(*columns):
+                yield self.record_type(*values)
+
+    def to_frame(self):
+        """DataFrame with nullable Int64 ints, float columns and object strings"""
+        data = {}
+        for name, kind in self.schema.items():
+            column = self.column(name)
+            if kind == "str":
+                data[name] = self.strings.decode(column)
+            elif kind == "int":
+                missing = column == INT_NA
+                data[name] = pd.arrays.IntegerArray(np.where(missing, 0, column), missing)
+            else:
+                data[name] = column.copy()
+        return pd.DataFrame(data)
+
+    def json_items(self, keys=None, convert=None):
+        """
+        Rows as JSON-ready dicts, one at a time. `keys` optionally maps field
+        names to output keys and selects the fields, `convert` maps field names
+        to functions applied to their values.
+        """
+        keys = keys or {name: name for name in self.schema}
+        convert = convert or {}
+        for record in self:
+            item = {}
+            for name, key in keys.items():
+                value = getattr(record, name)
+                item[key] = convert[name](value) if name in convert else value
+            yield item
+
+    def write_json(self, path, keys=None, convert=None, indent=2):
+        """Stream the rows to a JSON array (same layout as json.dump(list, indent=2))"""
+        return write_json_array(path, self.json_items(keys, convert), indent)
+
+    def memory_bytes(self):
+        """Bytes held by the used part of the columns plus the interned strings"""
+        columns = sum(column[:self._length].nbytes for column in self._columns.values())
+        return columns + sum(sys.getsizeof(value) for value in self.strings.values)
+
+
+def write_json_array(path, items, indent=2):
+    """Write an iterable of dicts as a JSON array without building the list; returns the item count"""
+    pad = " " * indent
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for item in items:
+            text = json.dumps(item, ensure_ascii=False, indent=indent)
+            f.write(("," if count else "") + "\n" + pad + text.replace("\n", "\n" + pad))
+            count += 1
+        f.write("\n]" if count else "]")
+    return count
+
+
+def _synthetic_addresses(n, seed=0):
+    """
+    Address dicts shaped like rows read from the geocoding CSV: few streets,
+    many houses, and every row holding its own copy of each string.
+    """
+    rng = np.random.default_rng(seed)
+    street_ids = rng.integers(0, max(1, n // 200), n)
+    houses = rng.integers(1, 400, n)
+    lats = 43.2 + rng.random(n) * 0.2
+    lons = 76.8 + rng.random(n) * 0.2
+    for i in range(n):
+        street = f"улица Синтетическая {street_ids[i]}"
+        yield {
+            "street_id": int(street_ids[i]),
+            "street_name": street,
+            "house": str(houses[i]),
+            "sub_house": "",
+            "is_available": 1,
+            "full_address": f"Алматы г., {street}, {houses[i]}",
+            "latitude": float(lats[i]),
+            "longitude": float(lons[i]),
+            "gis_full_name": f"Алматы, {street}, {houses[i]}",
+            "provider": "beeline",
+        }
+
+
+def _build_table(rows):
+    table = RecordTable(AddressRecord)
+    table.extend(rows)
+    return table
+
+
+def benchmark(n=BENCHMARK_ROWS):
+    """Traced memory retained by n addresses as dicts, slotted records and a RecordTable"""
+    builders = {
+        "dicts": list,
+        "slotted_records": lambda rows: [AddressRecord.from_dict(row) for row in rows],
+        "record_table": _build_table,
+    }
+    results = {"rows": n}
+    for name, build in builders.items():
+        tracemalloc.start()
+        started = time.perf_counter()
+        container = build(_synthetic_addresses(n))
+        seconds = time.perf_counter() - started
+        retained = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del container
+        results[name] = {
+            "seconds": round(seconds, 2),
+            "retained_mib": round(retained / 2**20, 1),
+            "bytes_per_record": round(retained / n, 1),
+        }
+    return results
+
+
+def main():
+    setup_logging()
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else BENCHMARK_ROWS
+    for name, value in benchmark(n).items():
+        logger.info(f"{name}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+# Latin letters that are typed instead of their Cyrillic look-alikes ("27A", "8B")
+LATIN_TO_CYRILLIC = str.maketrans("abcehkmoptxy", "авсенкмортху")
+
+# Cyrillic alphabet order, used to turn the house letter into a small integer
+LETTERS = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+
+# number [letter] [/fraction] [letter] [к|корп|корпус|блок|бл korpus] [/fraction]
+# e.g. 32, 32/2, 46А, 66/1А, 66А/1, 1а/2б, 1А/21, 140к7, 3860/1к2, 145к5/1, 287 блок С
+HOUSE_RE = (
+    r"^(?P<number>\d+)"
+    r"(?P<letter1>[а-яё])?"
+    r"(?:/(?P<fraction1>\d+))?"
+    r"(?P<letter2>[а-яё])?"
+    r"(?:(?:корпус|корп|блок|бл|к)\.?(?P<korpus>\d+|[а-яё]))?"
+    r"(?:/(?P<fraction2>\d+))?$"
+)
+
+# Widths of the packed sort key: number | fraction | letter | fraction letter | korpus | korpus letter | order
+# The letter before the fraction (66а/1) and the one after it (66/1а) get separate slots;
+# the last digit is 1 when the fraction follows the korpus (145к5/1 vs 145/1к5)
+FRACTION_BASE = 10**4
+LETTER_BASE = 10**2
+FRACTION_LETTER_BASE = 10**2
+KORPUS_BASE = 10**3
+KORPUS_LETTER_BASE = 10**2
+ORDER_BASE = 2
+
+HOUSE_COLUMNS = [
+    "house_number", "house_fraction", "house_letter", "house_fraction_letter", "house_korpus", "house_korpus_letter",
+    "house_key", "house_canonical",
+]
+
+
+def normalize_houses(values):
+    """Lowercase, drop spaces, brackets and float artifacts ('57.0'), map Latin look-alikes to Cyrillic"""
+    s = pd.Series(values, copy=False).astype("string").str.lower()
+    s = s.str.replace(r"[\s()_]+|литер", "", regex=True).str.replace(r"\.0$", "", regex=True)
+    return s.str.translate(LATIN_TO_CYRILLIC)
+
+
+def _letter_codes(letters):
+    codes = np.zeros(len(letters), dtype=np.int64)
+    present = letters.notna().to_numpy()
+    if present.any():
+        codes[present] = [LETTERS.find(ch) + 1 for ch in letters[present]]
+    return codes
+
+
+def parse_houses(values):
+    """
+    Parse a column of free-form house strings into structured parts.
+
+    Returns a DataFrame aligned with the input with
+      house_number          - leading number (Int32, <NA> if the string can't be parsed)
+      house_fraction        - number after '/', 0 if absent
+      house_letter          - letter right after the number ('66а/1' -> 'а') or <NA>
+      house_fraction_letter - letter after the fraction ('66/1а' -> 'а', '1а/2б' -> 'б') or <NA>
+      house_korpus          - корпус/блок number, 0 if absent or lettered
+      house_korpus_letter   - lettered корпус/блок ('287 блок А' -> 'а') or <NA>
+      house_key             - int64 key that sorts like the address does; -1 if unparsed
+      house_canonical       - normalized string ('32/2 А к2' -> '32/2ак2') usable as a join key;
+                              letters and the fraction stay on their side ('66а/1' vs '66/1а', '145к5/1'),
+                              unparsed strings are returned unchanged
+    """
+    index = values.index if isinstance(values, pd.Series) else None
+    original = pd.Series(values, copy=False).astype("string")
+    normalized = normalize_houses(values)
+    parts = normalized.str.extract(HOUSE_RE)
+
+    number = pd.to_numeric(parts["number"], errors="coerce")
+    parsed = number.notna().to_numpy()
+    fraction_raw = parts["fraction1"].fillna(parts["fraction2"])
+    fraction = pd.to_numeric(fraction_raw, errors="coerce").fillna(0)
+    fraction_after_korpus = (parts["fraction1"].isna() & parts["fraction2"].notna()).to_numpy()
+    letter = parts["letter1"]
+    fraction_letter = parts["letter2"]
+
+    korpus_raw = parts["korpus"]
+    korpus = pd.to_numeric(korpus_raw, errors="coerce")
+    korpus_letter = korpus_raw.where(korpus.isna() & korpus_raw.notna())
+    korpus_values = korpus.fillna(0).to_numpy(dtype=np.int64)
+
+    number_values = number.fillna(0).to_numpy(dtype=np.int64)
+    fraction_values = fraction.to_numpy(dtype=np.int64)
+    key = (
+        ((number_values * FRACTION_BASE + fraction_values) * LETTER_BASE + _letter_codes(letter))
+        * FRACTION_LETTER_BASE + _letter_codes(fraction_letter)
+    )
+    key = key * KORPUS_BASE + korpus_values
+    key = (key * KORPUS_LETTER_BASE + _letter_codes(korpus_letter)) * ORDER_BASE + fraction_after_korpus
+    key[~parsed] = -1
+
+    fraction_part = ("/" + fraction_raw).fillna("")
+    korpus_part = ("к" + korpus_raw).fillna("")
+    canonical = parts["number"] + letter.fillna("")
+    canonical = canonical + fraction_part.where(~fraction_after_korpus, "") + fraction_letter.fillna("") + korpus_part
+    canonical = canonical + fraction_part.where(fraction_after_korpus, "")
+
+    result = pd.DataFrame({
+        "house_number": number.astype("Int32"),
+        "house_fraction": pd.array(fraction_values, dtype="Int32"),
+        "house_letter": letter.astype("string"),
+        "house_fraction_letter": fraction_letter.astype("string"),
+        "house_korpus": pd.array(korpus_values, dtype="Int32"),
+        "house_korpus_letter": korpus_letter.astype("string"),
+        "house_key": key,
+        "house_canonical": canonical.astype("string"),
+    })
+    if index is not None:
+        result.index = index
+    # Unparsed strings are passed through as they came in
+    result.loc[~parsed, ["house_fraction", "house_korpus"]] = pd.NA
+    result.loc[~parsed, "house_canonical"] = original[~parsed].to_numpy()
+    return result
+
+
+def add_house_columns(df, column="house"):
+    """Return df with the parsed house columns appended"""
+    return pd.concat([df, parse_houses(df[column])], axis=1)
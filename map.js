@@ -4,7 +4,9 @@ document.addEventListener('DOMContentLoaded', function() {
     const mapConfig = {
         center: [43.238949, 76.889709], // Almaty coordinates
         zoom: 12,
-        dataUrl: 'addresses.json' // Path to JSON data file
+        dataUrl: 'addresses.json', // Path to JSON data file
+        manifestUrl: 'map_data/manifest.json', // Versions and patches of the data file
+        cacheName: 'ftth-map' // IndexedDB database holding the cached baseline
     };
     
     // Global variables
@@ -65,15 +67,22 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     /**
-     * Load and process map data from JSON file
+     * Load and process map data: bring the cached baseline up to date with the
+     * published patches, or download the full JSON file when that is not possible
      */
     function loadMapData() {
-        fetch(mapConfig.dataUrl)
-            .then(response => {
-                if (!response.ok) {
-                    throw new Error(`HTTP error! Status: ${response.status}`);
+        Promise.all([fetchJson(mapConfig.manifestUrl, { cache: 'no-cache' }).catch(() => null), readCache()])
+            .then(([manifest, cached]) => {
+                if (manifest && cached && cached.version === manifest.version) {
+                    return cached.points;
                 }
-                return response.json();
+                if (manifest && cached) {
+                    return updateBaseline(cached, manifest).catch(error => {
+                        console.warn('Could not apply map data patches, loading the full file:', error);
+                        return loadFullData(manifest);
+                    });
+                }
+                return loadFullData(manifest);
             })
             .then(data => {
                 if (data && data.length > 0) {
@@ -87,6 +96,105 @@ document.addEventListener('DOMContentLoaded', function() {
             });
     }
     
+    function fetchJson(url, options) {
+        return fetch(url, options).then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+            return response.json();
+        });
+    }
+    
+    /**
+     * Download the full data file and keep it as the baseline for later patches
+     */
+    function loadFullData(manifest) {
+        return fetchJson(mapConfig.dataUrl, { cache: 'no-cache' }).then(data => {
+            if (data.length === 0 || data[0].id === undefined) {
+                return data;
+            }
+            // Points sharing an id collapse to the last one, as in the patches and the cache
+            const points = Array.from(new Map(data.map(point => [point.id, point])).values());
+            // Only cache a file that matches the manifest; a stale or newer file would get a wrong version
+            if (manifest) {
+                if (points.length === manifest.count) {
+                    writeCache({ version: manifest.version, points: points });
+                } else {
+                    console.warn(`${mapConfig.dataUrl} has ${points.length} points, manifest expects ${manifest.count}; not caching`);
+                }
+            }
+            return points;
+        });
+    }
+    
+    /**
+     * Apply the chain of patches from the cached version to the manifest version
+     */
+    function updateBaseline(cached, manifest) {
+        const chain = manifest.patches.filter(patch => patch.from >= cached.version);
+        const connected = chain.length > 0 && chain[0].from === cached.version &&
+            chain[chain.length - 1].to === manifest.version &&
+            chain.every((patch, i) => i === 0 || patch.from === chain[i - 1].to);
+        if (!connected) {
+            return Promise.reject(new Error(`no patch path from version ${cached.version} to ${manifest.version}`));
+        }
+        
+        const baseUrl = mapConfig.manifestUrl.replace(/[^/]*$/, '');
+        return Promise.all(chain.map(patch => fetchJson(baseUrl + patch.file)))
+            .then(patches => {
+                const points = new Map(cached.points.map(point => [point.id, point]));
+                patches.forEach(patch => applyPatch(points, patch));
+                if (points.size !== manifest.count) {
+                    throw new Error(`patched data has ${points.size} points, expected ${manifest.count}`);
+                }
+                const data = Array.from(points.values());
+                writeCache({ version: manifest.version, points: data });
+                return data;
+            });
+    }
+    
+    function applyPatch(points, patch) {
+        patch.removed.forEach(id => points.delete(id));
+        patch.added.forEach(point => points.set(point.id, point));
+        patch.changed.forEach(point => points.set(point.id, point));
+    }
+    
+    /**
+     * IndexedDB cache of the last loaded data ({version, points}); every failure resolves to null
+     */
+    function openCache() {
+        return new Promise((resolve) => {
+            if (!window.indexedDB) {
+                resolve(null);
+                return;
+            }
+            const request = indexedDB.open(mapConfig.cacheName, 1);
+            request.onupgradeneeded = () => request.result.createObjectStore('baseline');
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => resolve(null);
+        });
+    }
+    
+    function readCache() {
+        return openCache().then(db => new Promise((resolve) => {
+            if (!db) {
+                resolve(null);
+                return;
+            }
+            const request = db.transaction('baseline', 'readonly').objectStore('baseline').get('current');
+            request.onsuccess = () => resolve(request.result || null);
+            request.onerror = () => resolve(null);
+        }));
+    }
+    
+    function writeCache(baseline) {
+        return openCache().then(db => {
+            if (db) {
+                db.transaction('baseline', 'readwrite').objectStore('baseline').put(baseline, 'current');
+            }
+        }).catch(error => console.warn('Could not cache map data:', error));
+    }
+    
     /**
      * Process the JSON data and initialize the map display
      */
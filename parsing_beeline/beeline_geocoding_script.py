@@ -6,9 +6,20 @@ import random
 import os
 from urllib.parse import quote
 import csv
+import logging
+import sys
 
-# 2GIS API Key 
-API_KEY = "2424cc2b-ef4d-4d88-9dbb-89143fb588c1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from address_records import ADDRESS_CSV_CONVERTERS, AddressRecord, RecordTable
+from geocode_planner import GeocodePlanner, plan_geocoding, summarize_plan
+from geocode_quality import CITY_BBOX, rank_items, retry_low_confidence, validate_geocodes, write_quality_outputs
+
+logger = logging.getLogger("beeline_geocoding")
+metrics = RunMetrics("beeline_geocoding")
+
+# 2GIS API Key, required (never log request URLs, they carry the key)
+API_KEY = os.getenv("GIS_API_KEY")
 GEOCODE_URL = "https://catalog.api.2gis.com/3.0/items/geocode"
 
 # Configuration
@@ -21,6 +32,8 @@ MAX_RETRIES = 3
 INITIAL_DELAY = 1
 MAX_REQUESTS_PER_SECOND = 1  # Conservative rate limit
 CITY_PREFIX = "Алматы г., "  # Prefix to add to all addresses
+RANK_GEOCODE_ITEMS = True  # Pick the best scoring returned item instead of items[0]
+RETRY_LOW_CONFIDENCE = True  # Re-geocode low-confidence rows that only got their parent building's point
 
 def format_address(street_name, house, sub_house=None):
     """Format the address for geocoding"""
@@ -38,10 +51,13 @@ def format_address(street_name, house, sub_house=None):
     else:
         return f"Алматы г., {street_name}, {house}"
 
-def geocode_address(address, max_retries=MAX_RETRIES, initial_delay=INITIAL_DELAY):
+def geocode_address(address, max_retries=MAX_RETRIES, initial_delay=INITIAL_DELAY, run_metrics=None):
     """
-    Send address to 2GIS geocoding API and get coordinates and place type
+    Send address to 2GIS geocoding API and get coordinates and place type.
+    Requests are counted in run_metrics (this script's metrics by default).
     """
+    if run_metrics is None:
+        run_metrics = metrics
     retry_count = 0
     delay = initial_delay
     
@@ -49,17 +65,21 @@ def geocode_address(address, max_retries=MAX_RETRIES, initial_delay=INITIAL_DELA
     encoded_address = quote(address)
     
     url = f"{GEOCODE_URL}?q={encoded_address}&fields=items.point,items.subtype,items.full_name&key={API_KEY}"
-    print(f"Geocoding URL: {url}")
+    logger.debug(f"Geocoding: {address}")
     
     while retry_count <= max_retries:
         try:
-            response = requests.get(url)
+            run_metrics.incr("requests")
+            with run_metrics.timed("geocode_request"):
+                response = requests.get(url)
             
             # If we hit rate limiting, wait and retry
             if response.status_code == 429:
+                run_metrics.incr("rate_limited")
                 retry_count += 1
+                run_metrics.incr("retries")
                 wait_time = delay + random.uniform(1, 3)  # Add some randomness to the delay
-                print(f"Rate limited. Waiting {wait_time:.2f} seconds before retry {retry_count}/{max_retries}")
+                logger.warning(f"Rate limited. Waiting {wait_time:.2f} seconds before retry {retry_count}/{max_retries}")
                 time.sleep(wait_time)
                 delay *= 2  # Exponential backoff
                 continue
@@ -68,41 +88,61 @@ def geocode_address(address, max_retries=MAX_RETRIES, initial_delay=INITIAL_DELA
             
             if response.content:
                 data = response.json()
-                # Debug: Print first part of response
-                print(f"Response received. Status: {response.status_code}")
-                if 'result' in data and 'items' in data['result'] and len(data['result']['items']) > 0:
-                    print(f"Found {len(data['result']['items'])} items in response")
-                    if 'point' in data['result']['items'][0]:
-                        print(f"First item has coordinates: {data['result']['items'][0]['point']}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    items = data.get('result', {}).get('items', [])
+                    logger.debug(f"Response status {response.status_code}, {len(items)} items")
                 return data
             else:
-                print(f"Empty response for address: {address}")
+                logger.warning(f"Empty response for address: {address}")
                 return None
                 
         except requests.exceptions.RequestException as e:
             if retry_count < max_retries and hasattr(e, 'response') and e.response and e.response.status_code == 429:
+                run_metrics.incr("rate_limited")
                 retry_count += 1
+                run_metrics.incr("retries")
                 wait_time = delay + random.uniform(1, 3)
-                print(f"Error: {e}. Waiting {wait_time:.2f} seconds before retry {retry_count}/{max_retries}")
+                logger.warning(f"Error: {e}. Waiting {wait_time:.2f} seconds before retry {retry_count}/{max_retries}")
                 time.sleep(wait_time)
                 delay *= 2  # Exponential backoff
             else:
-                print(f"Error geocoding address '{address}': {e}")
+                run_metrics.incr("errors")
+                # Request exceptions embed the URL, so only log the status / exception type
+                status = e.response.status_code if getattr(e, 'response', None) is not None else type(e).__name__
+                logger.error(f"Error geocoding address '{address}': {status}")
                 return None
                 
         except json.JSONDecodeError as e:
-            print(f"JSON decode error for address '{address}': {e}")
+            run_metrics.incr("errors")
+            logger.error(f"JSON decode error for address '{address}': {e}")
             return None
             
         except Exception as e:
-            print(f"Unexpected error for address '{address}': {e}")
+            run_metrics.incr("errors")
+            logger.error(f"Unexpected error for address '{address}': {e}")
             return None
             
     return None  # If we've exhausted all retries
 
-def extract_geocode_data(geocode_response):
+_last_request_time = 0
+
+def rate_limited_geocode(address, run_metrics=None):
+    """geocode_address() throttled to MAX_REQUESTS_PER_SECOND"""
+    global _last_request_time
+    elapsed = time.time() - _last_request_time
+    sleep_time = max(0, (1.0 / MAX_REQUESTS_PER_SECOND) - elapsed)
+    
+    if sleep_time > 0:
+        time.sleep(sleep_time)
+    
+    _last_request_time = time.time()
+    return geocode_address(address, run_metrics=run_metrics)
+
+def extract_geocode_data(geocode_response, address=None, bbox=CITY_BBOX):
     """
-    Extract relevant data from the geocoding response
+    Extract relevant data from the geocoding response. Items inside bbox rank
+    first; pass the bounding box of the addresses' town, or None to rank on the
+    address match alone.
     """
     if not geocode_response or 'result' not in geocode_response or 'items' not in geocode_response['result']:
         return None
@@ -112,8 +152,12 @@ def extract_geocode_data(geocode_response):
     if not items:
         return None
     
-    # Just take the first result
+    # Take the item that best matches the requested address (falls back to the first result)
     item = items[0]
+    if RANK_GEOCODE_ITEMS and address and len(items) > 1:
+        ranked = rank_items(address, geocode_response, bbox)
+        if ranked:
+            item = ranked[0][1]
     
     result = {
         'gis_full_name': item.get('full_name', ''),
@@ -125,7 +169,6 @@ def extract_geocode_data(geocode_response):
     if 'point' in item:
         result['latitude'] = item['point'].get('lat')
         result['longitude'] = item['point'].get('lon')
-        print(f"Found coordinates: {result['latitude']}, {result['longitude']}")
     
     return result
 
@@ -135,22 +178,22 @@ def prepare_beeline_data():
     """
     # Check if input files exist
     if not os.path.exists(INPUT_CSV_HOUSES):
-        print(f"Error: Input file {INPUT_CSV_HOUSES} not found")
+        logger.error(f"Input file {INPUT_CSV_HOUSES} not found")
         return None
         
     if not os.path.exists(INPUT_CSV_STREETS):
-        print(f"Error: Input file {INPUT_CSV_STREETS} not found")
+        logger.error(f"Input file {INPUT_CSV_STREETS} not found")
         return None
     
     # Load the CSV files
-    print(f"Loading data from {INPUT_CSV_HOUSES} and {INPUT_CSV_STREETS}...")
+    logger.info(f"Loading data from {INPUT_CSV_HOUSES} and {INPUT_CSV_STREETS}...")
     try:
         houses_df = pd.read_csv(INPUT_CSV_HOUSES)
         streets_df = pd.read_csv(INPUT_CSV_STREETS)
         
-        print(f"Loaded {len(houses_df)} houses and {len(streets_df)} streets")
+        logger.info(f"Loaded {len(houses_df)} houses and {len(streets_df)} streets")
     except Exception as e:
-        print(f"Error loading CSV: {e}")
+        logger.error(f"Error loading CSV: {e}")
         return None
     
     # Prepare columns for the merged dataset
@@ -178,18 +221,32 @@ def prepare_beeline_data():
     result_df = merged_df[['street_id', 'full_street_name', 'house', 'sub_house', 'is_available']]
     result_df.rename(columns={'full_street_name': 'street_name'}, inplace=True)
     
-    print(f"Prepared {len(result_df)} addresses for geocoding")
+    logger.info(f"Prepared {len(result_df)} addresses for geocoding")
     return result_df
 
 def process_beeline_results():
     """
     Process Beeline results and add geocoding information
     """
+    if not API_KEY:
+        logger.error("GIS_API_KEY is not set; export it before geocoding")
+        return
+    
     # Prepare the data
-    df = prepare_beeline_data()
+    with metrics.stage("prepare") as stage:
+        df = prepare_beeline_data()
+        if df is not None:
+            stage.add_rows(len(df))
     if df is None:
         return
     
+    # Group sub-house variants under their parent building so each building is geocoded once
+    with metrics.stage("plan") as stage:
+        df = plan_geocoding(df, format_address)
+        stage.add_rows(len(df))
+    rows, distinct, best_case = summarize_plan(df)
+    logger.info(f"Planned {rows} rows: {distinct} distinct addresses, as few as {best_case} geocoding requests")
+    
     # Check for existing progress
     temp_files = [f for f in os.listdir('.') if f.startswith(TEMP_CSV_PREFIX) and f.endswith('.csv')]
     
@@ -198,119 +255,119 @@ def process_beeline_results():
         latest_file = max(temp_files, key=lambda x: int(x.replace(TEMP_CSV_PREFIX, '').replace('.csv', '')) if x.replace(TEMP_CSV_PREFIX, '').replace('.csv', '').isdigit() else 0)
         latest_index = int(latest_file.replace(TEMP_CSV_PREFIX, '').replace('.csv', ''))
         
-        print(f"Found temporary file {latest_file}, resuming from index {latest_index}")
+        logger.info(f"Found temporary file {latest_file}, resuming from index {latest_index}")
         start_index = latest_index
         
         # Load existing results
-        existing_results_df = pd.read_csv(latest_file)
-        existing_results = existing_results_df.to_dict('records')
+        results = RecordTable.from_frame(AddressRecord, pd.read_csv(latest_file, converters=ADDRESS_CSV_CONVERTERS))
     else:
         start_index = 0
-        existing_results = []
-    
-    # Time tracking for rate limiting
-    last_request_time = 0
+        results = RecordTable(AddressRecord)
     
-    # Create a results list
-    results = []
+    planner = GeocodePlanner(rate_limited_geocode, extract_geocode_data, metrics)
+    planner.seed(results)
     
     total_rows = len(df)
     processed = 0
     
     try:
-        # Create output CSV file and write header
-        fieldnames = ['street_id', 'street_name', 'house', 'sub_house', 'is_available', 
-                      'full_address', 'latitude', 'longitude', 'gis_full_name', 'provider']
-        
         # Process each row
-        for index, row in df.iloc[start_index:].iterrows():
-            street_name = row['street_name']
-            house = str(row['house'])
-            sub_house = row['sub_house'] if 'sub_house' in row and not pd.isna(row['sub_house']) else ""
-            
-            # Format the full address
-            full_address = format_address(street_name, house, sub_house)
-            print(f"Processing {index+1}/{total_rows}: {full_address}")
-            
-            # Rate limiting
-            current_time = time.time()
-            elapsed = current_time - last_request_time
-            sleep_time = max(0, (1.0 / MAX_REQUESTS_PER_SECOND) - elapsed)
-            
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-            
-            # Send geocoding request
-            last_request_time = time.time()
-            geocode_response = geocode_address(full_address)
-            
-            # Extract data from response
-            geocode_data = extract_geocode_data(geocode_response)
-            
-            # Create result row
-            result_row = {
-                'street_id': row['street_id'],
-                'street_name': street_name,
-                'house': house,
-                'sub_house': sub_house,
-                'is_available': row['is_available'],
-                'full_address': full_address,
-                'latitude': None,
-                'longitude': None,
-                'gis_full_name': None,
-                'provider': 'beeline'  # Add provider field
-            }
-            
-            # Add geocoding data if available
-            if geocode_data:
-                result_row.update(geocode_data)
+        with metrics.stage("geocode") as stage:
+            for index, row in df.iloc[start_index:].iterrows():
+                street_name = row['street_name']
+                house = str(row['house'])
+                sub_house = row['sub_house'] if 'sub_house' in row and not pd.isna(row['sub_house']) else ""
+                
+                full_address = row['full_address']
+                logger.debug(f"Processing {index+1}/{total_rows}: {full_address}")
+                
+                # Geocode through the planner (reuses the parent building / earlier lookups)
+                geocode_data = planner.resolve(row)
+                
+                # Create result row
+                result_row = AddressRecord(
+                    street_id=row['street_id'],
+                    street_name=street_name,
+                    house=house,
+                    sub_house=sub_house,
+                    is_available=row['is_available'],
+                    full_address=full_address,
+                    provider='beeline'  # Add provider field
+                )
+                
+                # Add geocoding data if available
+                if geocode_data:
+                    result_row.gis_full_name = geocode_data.get('gis_full_name')
+                    result_row.latitude = geocode_data.get('latitude')
+                    result_row.longitude = geocode_data.get('longitude')
+                else:
+                    metrics.incr("not_geocoded")
+                
+                logger.debug(f"Row coordinates: {result_row.latitude}, {result_row.longitude}")
                 
-            # Debug: Print coordinates to ensure they're being captured
-            print(f"Row coordinates: {result_row['latitude']}, {result_row['longitude']}")
+                results.append(result_row)
+                stage.add_rows()
+                
+                # Save progress periodically
+                processed += 1
+                if processed % BATCH_SIZE == 0:
+                    temp_df = results.to_frame()
+                    temp_file = f"{TEMP_CSV_PREFIX}{start_index + processed}.csv"
+                    temp_df.to_csv(temp_file, index=False)
+                    logger.info(f"Saved intermediate results to {temp_file} ({start_index + processed}/{total_rows} processed)")
+        
+        # Collect final results
+        with metrics.stage("collect") as stage:
+            results_df = results.to_frame()
             
-            results.append(result_row)
+            coord_count = results_df[results_df['latitude'].notna()].shape[0]
+            logger.info(f"Number of entries with coordinates: {coord_count} out of {len(results_df)}")
             
-            # Save progress periodically
-            processed += 1
-            if processed % BATCH_SIZE == 0:
-                all_results = existing_results + results
-                temp_df = pd.DataFrame(all_results)
-                temp_file = f"{TEMP_CSV_PREFIX}{start_index + processed}.csv"
-                temp_df.to_csv(temp_file, index=False)
-                print(f"Saved intermediate results to {temp_file} ({processed} processed)")
-        
-        # Save final results
-        all_results = existing_results + results
-        results_df = pd.DataFrame(all_results)
-        
-        # Debug: Check if coordinates exist in the dataframe
-        coord_count = results_df[results_df['latitude'].notna()].shape[0]
-        print(f"Number of entries with coordinates: {coord_count} out of {len(results_df)}")
+            # Ensure the DataFrame has all required columns
+            for col in ['latitude', 'longitude', 'gis_full_name']:
+                if col not in results_df.columns:
+                    results_df[col] = None
+            stage.add_rows(len(results_df))
         
-        # Ensure the DataFrame has all required columns
-        for col in ['latitude', 'longitude', 'gis_full_name']:
-            if col not in results_df.columns:
-                results_df[col] = None
+        # Score gis_full_name against full_address and check the city bounding box
+        with metrics.stage("validate") as stage:
+            validated = validate_geocodes(results_df)
+            if RETRY_LOW_CONFIDENCE:
+                propagated = ~validated['full_address'].isin(planner.address_cache.keys())
+                validated = retry_low_confidence(
+                    validated, rate_limited_geocode, extract_geocode_data, candidates=propagated, metrics=metrics
+                )
+                results_df[['gis_full_name', 'latitude', 'longitude']] = validated[['gis_full_name', 'latitude', 'longitude']]
+            write_quality_outputs(validated)
+            stage.add_rows(len(validated))
         
-        # Save to CSV
-        results_df.to_csv(OUTPUT_CSV, index=False)
-        print(f"Saved {len(results_df)} geocoded locations to {OUTPUT_CSV}")
+        with metrics.stage("save") as stage:
+            # Save to CSV
+            results_df.to_csv(OUTPUT_CSV, index=False)
+            stage.add_rows(len(results_df))
+        logger.info(f"Saved {len(results_df)} geocoded locations to {OUTPUT_CSV}")
         
     except KeyboardInterrupt:
-        print("\nProcess interrupted by user. Saving current progress...")
-        if existing_results or results:
-            all_results = existing_results + results
-            results_df = pd.DataFrame(all_results)
+        logger.warning("Process interrupted by user. Saving current progress...")
+        if len(results):
+            results_df = results.to_frame()
             results_df.to_csv(OUTPUT_CSV, index=False)
-            print(f"Saved {len(results_df)} geocoded locations to {OUTPUT_CSV}")
+            logger.info(f"Saved {len(results_df)} geocoded locations to {OUTPUT_CSV}")
     except Exception as e:
-        print(f"\nUnexpected error: {e}")
-        print("Saving current progress...")
-        if existing_results or results:
-            all_results = existing_results + results
-            results_df = pd.DataFrame(all_results)
+        logger.exception(f"Unexpected error: {e}")
+        logger.info("Saving current progress...")
+        if len(results):
+            results_df = results.to_frame()
             results_df.to_csv(OUTPUT_CSV, index=False)
-            print(f"Saved {len(results_df)} geocoded locations to {OUTPUT_CSV}")
+            logger.info(f"Saved {len(results_df)} geocoded locations to {OUTPUT_CSV}")
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        process_beeline_results()
+    finally:
+        metrics.write_report()
 
 if __name__ == "__main__":
-    process_beeline_results()
\ No newline at end of file
+    main()
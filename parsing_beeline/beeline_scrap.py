@@ -3,8 +3,16 @@ import csv
 import json
 import time
 import os
+import logging
+import sys
 from urllib.parse import quote
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+
+logger = logging.getLogger("beeline_scrap")
+metrics = RunMetrics("beeline_scrap")
+
 class BeelineDataCollector:
     BASE_URL = "https://beeline.kz/restservices/telco"
     
@@ -19,7 +27,9 @@ class BeelineDataCollector:
         """Fetch all streets for the given city"""
         url = f"{self.BASE_URL}/streets?cityId={self.city_id}"
         try:
-            response = requests.get(url, headers=self.headers)
+            metrics.incr("requests")
+            with metrics.timed("streets_request"):
+                response = requests.get(url, headers=self.headers)
             response.raise_for_status()
             streets = response.json()
             
@@ -30,18 +40,23 @@ class BeelineDataCollector:
                 writer.writeheader()
                 writer.writerows(streets)
             
-            print(f"Saved {len(streets)} streets to {streets_file}")
+            logger.info(f"Saved {len(streets)} streets to {streets_file}")
             return streets
         
         except Exception as e:
-            print(f"Error fetching streets: {e}")
+            metrics.incr("errors")
+            logger.error(f"Error fetching streets: {e}")
             return []
     
     def fetch_houses_for_street(self, street_id):
         """Fetch all houses for a specific street"""
         url = f"{self.BASE_URL}/houses?cityId={self.city_id}&streetId={street_id}"
         try:
-            response = requests.get(url, headers=self.headers)
+            metrics.incr("requests")
+            with metrics.timed("houses_request"):
+                response = requests.get(url, headers=self.headers)
+            if response.status_code == 429:
+                metrics.incr("rate_limited")
             response.raise_for_status()
             houses = response.json()
             
@@ -52,7 +67,8 @@ class BeelineDataCollector:
             return houses
         
         except Exception as e:
-            print(f"Error fetching houses for street {street_id}: {e}")
+            metrics.incr("errors")
+            logger.error(f"Error fetching houses for street {street_id}: {e}")
             return []
     
     def collect_all_houses(self, streets=None):
@@ -63,33 +79,46 @@ class BeelineDataCollector:
         all_houses = []
         total_streets = len(streets)
         
-        for index, street in enumerate(streets, 1):
-            street_id = street['street_id']
-            street_name = street['name']
-            
-            print(f"Processing street {index}/{total_streets}: {street_name} (ID: {street_id})")
-            
-            houses = self.fetch_houses_for_street(street_id)
-            all_houses.extend(houses)
-            
-            # Pause to avoid rate limiting
-            time.sleep(0.5)
+        with metrics.stage("collect_houses") as stage:
+            for index, street in enumerate(streets, 1):
+                street_id = street['street_id']
+                street_name = street['name']
+                
+                logger.debug(f"Processing street {index}/{total_streets}: {street_name} (ID: {street_id})")
+                
+                houses = self.fetch_houses_for_street(street_id)
+                all_houses.extend(houses)
+                stage.add_rows(len(houses))
+                
+                if index % 50 == 0:
+                    logger.info(f"Processed {index}/{total_streets} streets, {len(all_houses)} houses so far")
+                
+                # Pause to avoid rate limiting
+                time.sleep(0.5)
         
-        # Save all houses to CSV
+        # Save all houses to CSV; raw API rows are kept as they are, with every field any house had
         houses_file = f"beeline_houses_city_{self.city_id}.csv"
+        fieldnames = list(dict.fromkeys(key for house in all_houses for key in house))
         with open(houses_file, 'w', newline='', encoding='utf-8') as f:
-            if houses:
-                writer = csv.DictWriter(f, fieldnames=houses[0].keys())
+            if all_houses:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
                 writer.writeheader()
                 writer.writerows(all_houses)
         
-        print(f"Saved {len(all_houses)} houses to {houses_file}")
+        logger.info(f"Saved {len(all_houses)} houses to {houses_file}")
         return all_houses
 
 def main():
-    collector = BeelineDataCollector()
-    streets = collector.fetch_streets()
-    collector.collect_all_houses(streets)
+    setup_logging()
+    metrics.start()
+    try:
+        collector = BeelineDataCollector()
+        with metrics.stage("fetch_streets") as stage:
+            streets = collector.fetch_streets()
+            stage.add_rows(len(streets))
+        collector.collect_all_houses(streets)
+    finally:
+        metrics.write_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+
+logger = logging.getLogger("coverage_grid")
+metrics = RunMetrics("coverage_grid")
+
+# Configuration
+# Each provider's own geocoded results: combined_ftth_results.csv already keeps one
+# provider per location, so overlaps can only be counted before that merge
+INPUT_FILES = {
+    "telecom": "ftth_results_with_coordinates.csv",
+    "beeline": "beeline_ftth_with_coordinates.csv",
+}
+COORD_DECIMALS = 5  # same ~1 m rounding combine_data uses to decide two rows are one location
+OUTPUT_DIR = "coverage_layers"
+PRECISIONS = (5, 6, 7)  # geohash cell size: ~4.9 km, ~1.2 km, ~150 m
+PROVIDERS = ("beeline", "telecom")
+
+BASE32 = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+
+
+def _split_bits(precision):
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2  # geohash starts with a longitude bit
+
+
+def geohash_codes(latitude, longitude, precision):
+    """Vectorized integer geohash of every point (5 * precision bits)"""
+    lon_bits, lat_bits = _split_bits(precision)
+    lon_idx = np.floor((np.asarray(longitude, dtype=float) + 180.0) / 360.0 * (1 << lon_bits)).astype(np.int64)
+    lat_idx = np.floor((np.asarray(latitude, dtype=float) + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64)
+    lon_idx = np.clip(lon_idx, 0, (1 << lon_bits) - 1)
+    lat_idx = np.clip(lat_idx, 0, (1 << lat_bits) - 1)
+
+    codes = np.zeros(len(lon_idx), dtype=np.int64)
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            bit = (lon_idx >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_idx >> (lat_bits - 1 - i // 2)) & 1
+        codes = (codes << 1) | bit
+    return codes
+
+
+def geohash_strings(codes, precision):
+    """Base32 strings for integer geohash codes"""
+    codes = np.asarray(codes, dtype=np.int64)
+    result = np.full(len(codes), "", dtype=f"<U{precision}")
+    for i in range(precision):
+        result = np.char.add(result, BASE32[(codes >> (5 * (precision - 1 - i))) & 31])
+    return result
+
+
+def geohash_bounds(codes, precision):
+    """(min_lat, min_lon, max_lat, max_lon) arrays of each cell"""
+    lon_bits, lat_bits = _split_bits(precision)
+    codes = np.asarray(codes, dtype=np.int64)
+    lon_idx = np.zeros(len(codes), dtype=np.int64)
+    lat_idx = np.zeros(len(codes), dtype=np.int64)
+    total = 5 * precision
+    for i in range(total):
+        bit = (codes >> (total - 1 - i)) & 1
+        if i % 2 == 0:
+            lon_idx = (lon_idx << 1) | bit
+        else:
+            lat_idx = (lat_idx << 1) | bit
+    lon_size = 360.0 / (1 << lon_bits)
+    lat_size = 180.0 / (1 << lat_bits)
+    min_lon = lon_idx * lon_size - 180.0
+    min_lat = lat_idx * lat_size - 90.0
+    return min_lat, min_lon, min_lat + lat_size, min_lon + lon_size
+
+
+def read_provider_rows(input_files=INPUT_FILES):
+    """Geocoded rows of every provider with their provider name; missing files are skipped"""
+    frames = []
+    for provider, csv_file in input_files.items():
+        if not os.path.exists(csv_file):
+            logger.warning(f"{csv_file} not found, {provider} is left out of the grid")
+            continue
+        df = pd.read_csv(csv_file, usecols=lambda column: column in ("latitude", "longitude", "is_available"))
+        df["provider"] = provider
+        frames.append(df)
+        logger.info(f"Loaded {len(df)} {provider} rows from {csv_file}")
+    if not frames:
+        return pd.DataFrame(columns=["latitude", "longitude", "is_available", "provider"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_addresses(input_files=INPUT_FILES):
+    """
+    One row per distinct location with its provider set. Locations are matched
+    on rounded coordinates like combine_data does. listed_<provider> is set when
+    the provider has any row at the location, has_<provider> only when one of
+    those rows is available; provider_count counts the providers that offer
+    service there, and a location is available if any of them does.
+    """
+    df = read_provider_rows(input_files)
+    df = df.dropna(subset=["latitude", "longitude"])
+
+    latitude = df["latitude"].round(COORD_DECIMALS)
+    longitude = df["longitude"].round(COORD_DECIMALS)
+    point_codes, _ = pd.factorize(pd.MultiIndex.from_arrays([latitude, longitude]))
+    n_points = int(point_codes.max()) + 1 if len(point_codes) else 0
+    first = ~pd.Series(point_codes).duplicated().to_numpy()
+    row_available = pd.to_numeric(df["is_available"], errors="coerce").to_numpy() == 1
+    addresses = pd.DataFrame({
+        "latitude": latitude.to_numpy()[first],
+        "longitude": longitude.to_numpy()[first],
+    })
+    provider_codes, provider_names = pd.factorize(df["provider"])
+    # providers per point as bitmasks: any row / an available row
+    bits = 1 << provider_codes.astype(np.int64)
+    listed = np.zeros(n_points, dtype=np.int64)
+    np.bitwise_or.at(listed, point_codes, bits)
+    served = np.zeros(n_points, dtype=np.int64)
+    np.bitwise_or.at(served, point_codes, np.where(row_available, bits, 0))
+    for i, name in enumerate(provider_names):
+        addresses[f"listed_{name}"] = (listed >> i) & 1 == 1
+        addresses[f"has_{name}"] = (served >> i) & 1 == 1
+    for name in PROVIDERS:
+        for column in (f"listed_{name}", f"has_{name}"):
+            if column not in addresses:
+                addresses[column] = False
+    provider_count = np.zeros(n_points, dtype=np.int64)
+    for i in range(len(provider_names)):
+        provider_count += (served >> i) & 1
+    addresses["provider_count"] = provider_count
+    addresses["is_available"] = provider_count > 0
+    return addresses
+
+
+def grid_counts(addresses, precision, codes=None):
+    """
+    Per-cell counts at one geohash precision. Provider columns count the
+    locations a provider offers service at (has_<provider>); <provider>_listed
+    counts every location it lists, available or not.
+    """
+    if codes is None:
+        codes = geohash_codes(addresses["latitude"], addresses["longitude"], precision)
+    cells, inverse = np.unique(codes, return_inverse=True)
+    n_cells = len(cells)
+
+    def count(mask):
+        return np.bincount(inverse, weights=np.asarray(mask, dtype=float), minlength=n_cells).astype(np.int64)
+
+    available = addresses["is_available"].to_numpy()
+    single = addresses["provider_count"].to_numpy() == 1
+    result = pd.DataFrame({
+        "geohash": geohash_strings(cells, precision),
+        "total": np.bincount(inverse, minlength=n_cells),
+        "available": count(available),
+        "unavailable": count(~available),
+        "single_provider": count(single),
+        "both_providers": count(addresses["provider_count"].to_numpy() > 1),
+    })
+    for name in PROVIDERS:
+        others = [other for other in PROVIDERS if other != name]
+        only = addresses[f"has_{name}"].to_numpy() & single
+        result[name] = count(addresses[f"has_{name}"])
+        result[f"{name}_listed"] = count(addresses[f"listed_{name}"])
+        result[f"{name}_only"] = count(only)
+        # Share of addresses in the cell only this provider serves, i.e. the other provider(s) don't
+        for other in others:
+            result[f"{other}_missing_share"] = np.round(result[f"{name}_only"] / result["total"], 4)
+    result["available_share"] = np.round(result["available"] / result["total"], 4)
+
+    min_lat, min_lon, max_lat, max_lon = geohash_bounds(cells, precision)
+    result["min_lat"], result["min_lon"], result["max_lat"], result["max_lon"] = min_lat, min_lon, max_lat, max_lon
+    return result
+
+
+def build_layers(addresses, precisions=PRECISIONS):
+    """
+    Grid counts for every precision. The finest geohash is computed once and
+    coarser levels are derived from it by dropping 5 bits per level.
+    """
+    finest = max(precisions)
+    codes = geohash_codes(addresses["latitude"], addresses["longitude"], finest)
+    layers = {}
+    for precision in sorted(precisions, reverse=True):
+        layers[precision] = grid_counts(addresses, precision, codes >> (5 * (finest - precision)))
+    return layers
+
+
+def to_geojson(cells):
+    """GeoJSON FeatureCollection of cell rectangles with their counts as properties"""
+    properties = cells.drop(columns=["min_lat", "min_lon", "max_lat", "max_lon"]).to_dict("records")
+    features = []
+    for props, min_lat, min_lon, max_lat, max_lon in zip(
+        properties, cells["min_lat"], cells["min_lon"], cells["max_lat"], cells["max_lon"]
+    ):
+        ring = [[min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]]
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Polygon", "coordinates": [[[round(x, 6), round(y, 6)] for x, y in ring]]},
+            "properties": props,
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def write_layers(layers, output_dir=OUTPUT_DIR):
+    os.makedirs(output_dir, exist_ok=True)
+    for precision, cells in layers.items():
+        cells.sort_values("geohash").to_csv(os.path.join(output_dir, f"coverage_geohash{precision}.csv"), index=False)
+        with open(os.path.join(output_dir, f"coverage_geohash{precision}.geojson"), "w", encoding="utf-8") as f:
+            json.dump(to_geojson(cells), f, ensure_ascii=False, separators=(",", ":"))
+        logger.info(f"Precision {precision}: {len(cells)} cells written to {output_dir}")
+
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("load") as stage:
+            addresses = load_addresses()
+            stage.add_rows(len(addresses))
+        with metrics.stage("grid") as stage:
+            layers = build_layers(addresses)
+            stage.add_rows(len(addresses))
+        with metrics.stage("write") as stage:
+            write_layers(layers)
+            stage.add_rows(sum(len(cells) for cells in layers.values()))
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import logging
+import os
+import re
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from house_numbers import parse_houses
+
+logger = logging.getLogger("beeline_geocoding.planner")
+
+# Matching items further apart than this (degrees, ~50 m) are treated as different buildings
+PARENT_MAX_SPREAD = 0.0005
+
+# Leading digits, for house strings the structured parser can't handle ("12(ул.Гризодуб.)")
+PARENT_HOUSE_RE = r"^\s*(\d+)"
+
+
+def normalize_house(value):
+    """Lowercase a house string and drop whitespace so '287 блок С' == '287блокс'"""
+    return re.sub(r"\s+", "", str(value)).lower()
+
+
+def plan_geocoding(df, format_address):
+    """
+    Work out which rows share a parent building.
+
+    Adds to a copy of df:
+      full_address   - the address that would be geocoded for the row itself
+      parent_address - the address of the parent building (street + leading number)
+      parent_house   - the leading number of the house ("32" for "32/2")
+      group_size     - number of distinct addresses sharing the parent building
+    """
+    plan = df.copy()
+    house = plan['house'].astype(str).str.strip()
+    sub_house = plan['sub_house'].fillna('').astype(str) if 'sub_house' in plan.columns else ''
+    plan['full_address'] = [
+        format_address(street, h, s) for street, h, s in zip(plan['street_name'], house, sub_house)
+    ]
+    # Parent building is the leading house number: "32/2" -> "32", "140к7" -> "140", "46А" -> "46"
+    parsed = parse_houses(house)
+    fallback = house.str.extract(PARENT_HOUSE_RE, expand=False)
+    plan['parent_house'] = parsed['house_number'].astype('string').fillna(fallback)
+    has_parent = plan['parent_house'].notna()
+    plan['parent_address'] = None
+    plan.loc[has_parent, 'parent_address'] = [
+        format_address(street, h) for street, h in zip(plan.loc[has_parent, 'street_name'], plan.loc[has_parent, 'parent_house'])
+    ]
+    plan['group_size'] = (
+        plan.groupby('parent_address', dropna=False)['full_address'].transform('nunique')
+    )
+    plan.loc[~has_parent, 'group_size'] = 1
+    return plan
+
+
+def summarize_plan(plan):
+    """Return (rows, distinct addresses, requests needed if every parent lookup is unambiguous)"""
+    distinct = plan['full_address'].nunique()
+    grouped = plan['group_size'] > 1
+    best_case = plan.loc[grouped, 'parent_address'].nunique() + plan.loc[~grouped, 'full_address'].nunique()
+    return len(plan), distinct, best_case
+
+
+def matching_items(geocode_response, house):
+    """Items of a 2GIS response whose house part equals the given house number"""
+    if not geocode_response:
+        return []
+    items = geocode_response.get('result', {}).get('items', [])
+    wanted = normalize_house(house)
+    matches = []
+    for item in items:
+        full_name = item.get('full_name', '')
+        if 'point' in item and normalize_house(full_name.rsplit(',', 1)[-1]) == wanted:
+            matches.append(item)
+    return matches
+
+
+def is_single_building(items, max_spread=PARENT_MAX_SPREAD):
+    """True if all item points lie within max_spread degrees of each other"""
+    lats = [item['point'].get('lat') or 0 for item in items]
+    lons = [item['point'].get('lon') or 0 for item in items]
+    return max(lats) - min(lats) <= max_spread and max(lons) - min(lons) <= max_spread
+
+
+class GeocodePlanner:
+    """
+    Geocodes rows through their parent building and reuses the result for siblings.
+
+    lookup(address) returns the raw geocoder response (rate limiting is its job),
+    extract(response, address) turns it into the row fields (gis_full_name, latitude, longitude).
+    The parent lookup is only trusted when the returned items that carry the
+    parent's house number all point at the same spot; otherwise every variant
+    in the group is geocoded on its own.
+    """
+
+    def __init__(self, lookup, extract, metrics=None):
+        self.lookup = lookup
+        self.extract = extract
+        self.metrics = metrics
+        self.address_cache = {}  # full address -> extracted data (or None)
+        self.parent_cache = {}   # parent address -> extracted data, or None if ambiguous
+
+    def _incr(self, name):
+        if self.metrics is not None:
+            self.metrics.incr(name)
+
+    def seed(self, results):
+        """Pre-fill the address cache from rows saved by an earlier (resumed) run"""
+        for row in results:
+            address = row.get('full_address')
+            if address and not pd.isna(row.get('latitude')):
+                self.address_cache[address] = {
+                    'gis_full_name': row.get('gis_full_name'),
+                    'latitude': row.get('latitude'),
+                    'longitude': row.get('longitude'),
+                }
+
+    def _geocode(self, address):
+        if address in self.address_cache:
+            self._incr("cache_hits")
+            return self.address_cache[address]
+        data = self.extract(self.lookup(address), address)
+        self.address_cache[address] = data
+        return data
+
+    def _resolve_parent(self, parent_address, parent_house):
+        if parent_address in self.parent_cache:
+            return self.parent_cache[parent_address]
+        self._incr("parent_geocodes")
+        response = self.lookup(parent_address)
+        matches = matching_items(response, parent_house)
+        if matches and is_single_building(matches):
+            data = self.extract({'result': {'items': matches[:1]}})
+        else:
+            logger.debug(f"Parent lookup for {parent_address} is ambiguous ({len(matches)} matches)")
+            data = None
+        self.parent_cache[parent_address] = data
+        # The plain house is the parent itself, so its own lookup is done as well
+        self.address_cache.setdefault(parent_address, self.extract(response, parent_address))
+        return data
+
+    def resolve(self, row):
+        """Return geocode data for one planned row"""
+        address = row['full_address']
+        if address in self.address_cache or row['group_size'] <= 1 or pd.isna(row['parent_address']):
+            return self._geocode(address)
+
+        parent_data = self._resolve_parent(row['parent_address'], row['parent_house'])
+        if address == row['parent_address']:
+            return self.address_cache[address]
+        if parent_data is not None:
+            self._incr("cache_hits")
+            return dict(parent_data)
+
+        self._incr("variant_fallbacks")
+        return self._geocode(address)
@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from house_numbers import parse_houses
+from run_metrics import RunMetrics, setup_logging
+
+logger = logging.getLogger("geocode_quality")
+
+# Configuration
+INPUT_CSV = "beeline_ftth_with_coordinates.csv"
+LOW_CONFIDENCE_CSV = "beeline_geocode_low_confidence.csv"
+QUALITY_REPORT_JSON = "beeline_geocode_quality_report.json"
+CITY_BBOX = (43.05, 76.65, 43.45, 77.20)  # Almaty: min lat, min lon, max lat, max lon
+LOW_CONFIDENCE_SCORE = 0.7
+STREET_WEIGHT = 0.6  # the rest of the score is the house number match
+QUALITY_COLUMNS = ["street_similarity", "house_match", "quality_score", "in_bbox", "quality_flag"]
+
+# Street type spellings reduced to one short form so "ул." == "улица"
+STREET_TYPES = {
+    "микрорайон": "мкр", "мкр": "мкр", "мкрн": "мкр",
+    "улица": "ул", "ул": "ул",
+    "проспект": "пр", "пр-т": "пр", "пр": "пр",
+    "переулок": "пер", "пер": "пер",
+    "бульвар": "бул", "б-р": "бул",
+    "шоссе": "ш", "площадь": "пл", "квартал": "кв", "тупик": "туп",
+}
+CITY_PREFIX_RE = r"^\s*(?:г\.?\s*)?алматы(?:\s*г\.?)?\s*,\s*"
+
+
+def _street_key(street):
+    """Canonical, order-insensitive token string for a street part"""
+    tokens = {STREET_TYPES.get(token, token) for token in street.split()}
+    return " ".join(sorted(tokens))
+
+
+def split_addresses(addresses):
+    """
+    Split 'City, street..., house' strings into normalized street keys and house parts.
+
+    Corner buildings ('проспект Абая, 59 / улица Кашгарская, 60а') are exploded into
+    one row per alternative; the returned frame keeps the original index.
+    """
+    s = pd.Series(addresses, copy=False).fillna("").astype(str).str.lower().str.replace("ё", "е")
+    s = s.str.split(r"\s+/\s+").explode()
+    s = s.str.replace(CITY_PREFIX_RE, "", regex=True)
+    parts = s.str.rsplit(",", n=1, expand=True).reindex(columns=[0, 1])
+    street = parts[0].fillna("").str.replace(r"[.,]", " ", regex=True)
+    return pd.DataFrame({
+        "street": [_street_key(value) for value in street],
+        "house": parts[1].fillna("").str.strip(),
+    }, index=s.index)
+
+
+def _trigram_codes(strings):
+    """(row, trigram code) pairs for a list of strings, built on a fixed-width code point matrix"""
+    padded = [f" {value} " for value in strings]
+    width = max((len(value) for value in padded), default=3)
+    chars = np.array(padded, dtype=f"<U{width}").view(np.uint32).reshape(len(padded), width).astype(np.uint64)
+    grams = (chars[:, :-2] << np.uint64(42)) | (chars[:, 1:-1] << np.uint64(21)) | chars[:, 2:]
+    valid = chars[:, 2:] != 0
+    rows = np.broadcast_to(np.arange(len(padded))[:, None], grams.shape)
+    return rows[valid], grams[valid]
+
+
+def trigram_similarity(left, right):
+    """
+    Batched character trigram similarity of left[i] vs right[i].
+
+    Returns the mean of the Dice coefficient and the overlap coefficient, so a
+    street that only adds a district ('мкр акбулак ул еспаева' vs 'ул еспаева')
+    still scores high while a different street type / number does not.
+    """
+    n = len(left)
+    if n == 0:
+        return np.zeros(0)
+    left_rows, left_grams = _trigram_codes(list(left))
+    right_rows, right_grams = _trigram_codes(list(right))
+
+    # Dense gram ids so (row, gram) fits in one int64 key
+    _, dense = np.unique(np.concatenate([left_grams, right_grams]), return_inverse=True)
+    n_grams = int(dense.max()) + 1 if len(dense) else 1
+    left_keys = np.unique(left_rows.astype(np.int64) * n_grams + dense[:len(left_grams)])
+    right_keys = np.unique(right_rows.astype(np.int64) * n_grams + dense[len(left_grams):])
+
+    left_size = np.bincount(left_keys // n_grams, minlength=n)
+    right_size = np.bincount(right_keys // n_grams, minlength=n)
+    common = np.intersect1d(left_keys, right_keys, assume_unique=True)
+    inter = np.bincount(common // n_grams, minlength=n)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dice = np.where(left_size + right_size > 0, 2 * inter / (left_size + right_size), 0.0)
+        overlap = np.where(np.minimum(left_size, right_size) > 0, inter / np.minimum(left_size, right_size), 0.0)
+    return (dice + overlap) / 2
+
+
+def _canonical_houses(houses):
+    """Canonical house strings, parsed once per distinct value"""
+    codes, uniques = pd.factorize(houses)
+    canonical = parse_houses(pd.Series(uniques, dtype="string"))["house_canonical"].to_numpy()
+    return canonical[codes]
+
+
+def score_addresses(expected, actual):
+    """
+    Score expected addresses against geocoder names, pairwise and in one batch.
+
+    Returns a DataFrame aligned with `expected` with street_similarity,
+    house_match and quality_score (0..1). For corner buildings the best
+    matching alternative wins. Work is done once per distinct address,
+    street pair and house string, so repeated streets cost nothing extra.
+    """
+    expected_codes, expected_uniques = pd.factorize(pd.Series(expected, copy=False).fillna(""))
+    actual_codes, actual_uniques = pd.factorize(pd.Series(actual, copy=False).fillna(""))
+    left = split_addresses(pd.Series(expected_uniques))
+    right = split_addresses(pd.Series(actual_uniques))
+
+    # Every expected alternative against every actual alternative of the same row
+    rows = pd.DataFrame({"expected": expected_codes, "actual": actual_codes})
+    pairs = (
+        rows.reset_index()
+        .merge(left, left_on="expected", right_index=True)
+        .merge(right, left_on="actual", right_index=True, suffixes=("_expected", "_actual"))
+    )
+
+    street_codes, street_pairs = pd.factorize(pd.MultiIndex.from_arrays([pairs["street_expected"], pairs["street_actual"]]))
+    street_similarity = trigram_similarity(
+        street_pairs.get_level_values(0).to_numpy(), street_pairs.get_level_values(1).to_numpy()
+    )[street_codes]
+    house_match = (
+        (_canonical_houses(pairs["house_expected"]) == _canonical_houses(pairs["house_actual"]))
+        & (pairs["house_expected"] != "").to_numpy()
+    )
+    house_match = np.asarray(pd.array(house_match, dtype="boolean").fillna(False), dtype=bool)
+
+    scored = pd.DataFrame({
+        "row": pairs["index"].to_numpy(),
+        "street_similarity": street_similarity,
+        "house_match": house_match,
+    })
+    scored["quality_score"] = STREET_WEIGHT * scored["street_similarity"] + (1 - STREET_WEIGHT) * scored["house_match"]
+    best = scored.sort_values("quality_score").drop_duplicates("row", keep="last").set_index("row").sort_index()
+    best = best.reindex(range(len(expected_codes)))
+    best.loc[actual_uniques[actual_codes] == "", ["street_similarity", "quality_score"]] = 0.0
+    best.index.name = None
+    return best.fillna({"street_similarity": 0.0, "quality_score": 0.0, "house_match": False})
+
+
+def in_bbox(latitude, longitude, bbox=CITY_BBOX):
+    """Vectorized check that points fall inside the city bounding box"""
+    lat = np.asarray(latitude, dtype=float)
+    lon = np.asarray(longitude, dtype=float)
+    min_lat, min_lon, max_lat, max_lon = bbox
+    return (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+
+
+def validate_geocodes(df, threshold=LOW_CONFIDENCE_SCORE, bbox=CITY_BBOX):
+    """
+    Add quality_score, street_similarity, house_match, in_bbox and quality_flag
+    columns to geocoded rows. quality_flag is one of
+    ok / low_confidence / out_of_bbox / missing.
+    """
+    result = df.copy()
+    scores = score_addresses(result["full_address"], result["gis_full_name"])
+    scores.index = result.index
+    result[["street_similarity", "house_match", "quality_score"]] = scores[["street_similarity", "house_match", "quality_score"]]
+    result["in_bbox"] = in_bbox(result["latitude"], result["longitude"], bbox)
+
+    missing = result["latitude"].isna() | result["longitude"].isna()
+    result["quality_flag"] = np.select(
+        [missing, ~result["in_bbox"], result["quality_score"] < threshold],
+        ["missing", "out_of_bbox", "low_confidence"],
+        default="ok",
+    )
+    return result
+
+
+def rank_items(address, geocode_response, bbox=CITY_BBOX):
+    """All items of a geocoder response with a point, best match first, as (score, item) pairs"""
+    if not geocode_response:
+        return []
+    items = [item for item in geocode_response.get("result", {}).get("items", []) if "point" in item]
+    if not items:
+        return []
+    scores = score_addresses([address] * len(items), [item.get("full_name", "") for item in items])["quality_score"].to_numpy()
+    if bbox is None:
+        inside = np.zeros(len(items))
+    else:
+        inside = in_bbox([item["point"].get("lat") for item in items], [item["point"].get("lon") for item in items], bbox)
+    # Points outside the city always rank below points inside it (bbox=None ranks on the score alone)
+    ranked = sorted(zip(scores + inside, range(len(items))), key=lambda pair: -pair[0])
+    return [(float(score - inside[i]), items[i]) for score, i in ranked]
+
+
+def retry_low_confidence(validated, lookup, extract, candidates=None, threshold=LOW_CONFIDENCE_SCORE, metrics=None):
+    """
+    Re-geocode flagged rows by their own full address and keep the best ranked item
+    when it beats the current score. `candidates` is an optional boolean mask that
+    limits retries (e.g. to rows that only got a propagated parent result).
+    Returns the re-validated frame.
+    """
+    retry = validated["quality_flag"] != "ok"
+    if candidates is not None:
+        retry &= candidates
+    flagged = validated.index[retry]
+    improved = 0
+    for index in flagged:
+        row = validated.loc[index]
+        data = extract(lookup(row["full_address"]), row["full_address"])
+        if not data or data.get("latitude") is None:
+            continue
+        candidate = score_addresses([row["full_address"]], [data["gis_full_name"]])["quality_score"].iloc[0]
+        if candidate > row["quality_score"]:
+            validated.loc[index, ["gis_full_name", "latitude", "longitude"]] = [
+                data["gis_full_name"], data["latitude"], data["longitude"],
+            ]
+            improved += 1
+    if metrics is not None:
+        metrics.incr("quality_retries", len(flagged))
+        metrics.incr("quality_improved", improved)
+    logger.info(f"Retried {len(flagged)} low-confidence rows, improved {improved}")
+    return validate_geocodes(validated.drop(columns=QUALITY_COLUMNS), threshold)
+
+
+def quality_report(validated, worst=20):
+    """Summary of a validated frame: flag counts, score histogram and worst examples"""
+    hist, edges = np.histogram(validated["quality_score"].to_numpy(dtype=float), bins=10, range=(0, 1))
+    worst_rows = validated[validated["quality_flag"] != "missing"].nsmallest(worst, "quality_score")
+    return {
+        "rows": int(len(validated)),
+        "flags": {flag: int(count) for flag, count in validated["quality_flag"].value_counts().items()},
+        "mean_score": round(float(validated["quality_score"].mean()), 4) if len(validated) else None,
+        "house_match_rate": round(float(validated["house_match"].mean()), 4) if len(validated) else None,
+        "score_histogram": {f"{edges[i]:.1f}-{edges[i + 1]:.1f}": int(hist[i]) for i in range(len(hist))},
+        "worst": worst_rows[["full_address", "gis_full_name", "quality_score"]].to_dict("records"),
+    }
+
+
+def write_quality_outputs(validated, report_path=QUALITY_REPORT_JSON, flagged_path=LOW_CONFIDENCE_CSV):
+    report = quality_report(validated)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    validated[validated["quality_flag"] != "ok"].to_csv(flagged_path, index=False)
+    logger.info(f"Quality flags: {report['flags']}, mean score {report['mean_score']}")
+    logger.info(f"Quality report saved to {report_path}, flagged rows to {flagged_path}")
+    return report
+
+
+def main():
+    setup_logging()
+    metrics = RunMetrics("geocode_quality").start()
+    try:
+        with metrics.stage("load") as stage:
+            df = pd.read_csv(INPUT_CSV)
+            stage.add_rows(len(df))
+        with metrics.stage("validate") as stage:
+            validated = validate_geocodes(df)
+            stage.add_rows(len(validated))
+        write_quality_outputs(validated)
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger("combine.patches")
+
+# Configuration
+PATCH_DIR = "map_data"  # published next to the map's addresses.json
+MANIFEST_FILE = "manifest.json"
+SNAPSHOT_FILE = "map_snapshot.json"  # id -> content digest of the last published version, kept outside PATCH_DIR
+MAX_PATCHES = 30  # older clients fall back to a full download
+ID_LENGTH = 16
+DIGEST_LENGTH = 12
+
+
+def address_id(provider, full_address):
+    """Stable id of a map point: the same provider + address always gets the same id"""
+    key = f"{provider or ''}|{' '.join(str(full_address or '').split()).lower()}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:ID_LENGTH]
+
+
+def _digest(point):
+    text = json.dumps(point, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:DIGEST_LENGTH]
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+class PatchWriter:
+    """
+    Builds the delta between the previously published map points and the new ones.
+
+    track() wraps the stream of points written to the full JSON file: it
+    fingerprints every point on the way through and keeps only the ones that
+    differ from the previous version, so the full data set is never held twice.
+    commit() writes patch_vNNNNN.json (added / changed points, removed ids),
+    the manifest the map reads first, and the id -> digest snapshot for the
+    next run. The snapshot is not published, so it lives outside patch_dir.
+    """
+
+    def __init__(self, patch_dir=PATCH_DIR, snapshot_file=SNAPSHOT_FILE, max_patches=MAX_PATCHES):
+        self.patch_dir = patch_dir
+        self.snapshot_file = snapshot_file
+        self.max_patches = max_patches
+        self.manifest = _read_json(os.path.join(patch_dir, MANIFEST_FILE), {"version": 0, "count": 0, "patches": []})
+        self.previous = _read_json(snapshot_file, {})
+        self.snapshot = {}
+        self.pending = {}  # id -> last point when it differs from the previous version
+        self.duplicates = 0
+
+    def track(self, points):
+        for point in points:
+            point_id = point["id"]
+            if point_id in self.snapshot:
+                self.duplicates += 1
+            # The map keeps the last point for an id, so only the final entry decides
+            digest = _digest(point)
+            self.snapshot[point_id] = digest
+            if self.previous.get(point_id) == digest:
+                self.pending.pop(point_id, None)
+            else:
+                self.pending[point_id] = point
+            yield point
+
+    def commit(self):
+        """Write the patch (if anything changed) and the manifest; returns the new version"""
+        os.makedirs(self.patch_dir, exist_ok=True)
+        removed = [point_id for point_id in self.previous if point_id not in self.snapshot]
+        added = [point for point_id, point in self.pending.items() if point_id not in self.previous]
+        changed = [point for point_id, point in self.pending.items() if point_id in self.previous]
+        version = self.manifest["version"]
+        first_run = version == 0
+
+        if first_run or added or changed or removed:
+            version += 1
+            patches = self.manifest["patches"]
+            if not first_run:
+                patch_file = f"patch_v{version:05d}.json"
+                _write_json(os.path.join(self.patch_dir, patch_file), {
+                    "from": version - 1, "to": version,
+                    "added": added, "changed": changed, "removed": removed,
+                })
+                patches.append({
+                    "from": version - 1, "to": version, "file": patch_file,
+                    "added": len(added), "changed": len(changed), "removed": len(removed),
+                })
+            # Drop the oldest patches; clients that far behind download the full file
+            for stale in patches[:-self.max_patches] if len(patches) > self.max_patches else []:
+                stale_path = os.path.join(self.patch_dir, stale["file"])
+                if os.path.exists(stale_path):
+                    os.remove(stale_path)
+            self.manifest = {"version": version, "count": len(self.snapshot), "patches": patches[-self.max_patches:]}
+            _write_json(os.path.join(self.patch_dir, MANIFEST_FILE), self.manifest)
+            _write_json(self.snapshot_file, self.snapshot)
+            logger.info(
+                f"Map data version {version}: {len(added)} added, {len(changed)} changed, "
+                f"{len(removed)} removed ({len(self.snapshot)} points)"
+            )
+        else:
+            logger.info(f"Map data unchanged, staying at version {version}")
+        if self.duplicates:
+            logger.warning(f"{self.duplicates} points share an address id with an earlier point (the last one is kept)")
+        return version
@@ -0,0 +1,429 @@
+import logging
+import os
+import re
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "parsing_telecom"))
+from run_metrics import RunMetrics, setup_logging
+from geocode_quality import STREET_TYPES, _trigram_codes
+from location_tree import LOCATIONS_CSV, TREE_FILE, TYPES, LocationTree
+
+logger = logging.getLogger("street_matcher")
+metrics = RunMetrics("street_matcher")
+
+# Configuration
+BEELINE_STREETS_CSV = "beeline_streets_city_1.csv"
+MAPPING_CSV = "street_mapping.csv"  # manual rows in it survive re-runs
+# Streets are only matched inside one settlement: Beeline city_id -> Telecom settlement name.
+# The name may be a town, a city district or a city-level region ('г.Алматы' is a region node);
+# TELECOM_TOWN overrides it. A city without a settlement or without Telecom streets in it is an error.
+BEELINE_CITY_TOWNS = {1: "г.Алматы"}
+SETTLEMENT_LEVELS = ("town", "district", "region")  # nearest first
+TELECOM_TOWN = os.getenv("TELECOM_TOWN")
+MIN_SCORE = 0.85
+AMBIGUITY_MARGIN = 0.03  # candidates this close to the best one count as ties
+NAME_WEIGHT = 0.8  # the rest of the score compares the full keys (settlement / district prefix included)
+TYPE_MISMATCH_PENALTY = 0.85  # both sides have a street type and they differ ('пр' vs 'ул')
+MAX_GRAM_POSTINGS = 500  # trigrams shared by more Telecom streets than this are not used for blocking
+QUERY_GRAMS = 6  # rarest trigrams of a Beeline street looked up in the index
+TOP_CANDIDATES = 20  # candidates per Beeline street kept after blocking
+BLOCK_BATCH = 20_000  # Beeline streets blocked at once
+SCORE_BATCH = 200_000  # candidate pairs scored at once
+
+ARCHIVE_RE = r"^\s*(?:\d*архив_|\d{3}_)"
+# A street type inside the name: 'кзыл ул. керуен' -> 'ул. керуен'
+INNER_TYPE_RE = re.compile(r"(?:^|\s)(?:ул|улица|пер|переулок|пр|пр-т|проспект|мкр|мкрн|микрорайон|отд)(?:\.|\s)")
+ORDINAL_RE = re.compile(r"(\d+)-?(?:й|я|ый|ой|ая|ий|ое|е)\b")
+NUMBER_KEY_RE = r"^[\d\s]*$"  # '10-й микрорайон' -> '10': too weak to auto-match on
+MAPPING_COLUMNS = [
+    "beeline_street_id", "beeline_name", "telecom_street_id", "telecom_location_id", "telecom_name",
+    "telecom_town", "score", "name_similarity", "ties", "method",
+]
+
+
+def _split_street(name, type_hint=None):
+    """(street type, name key, full key) of one lower-cased street name"""
+    context, _, street = name.rpartition(",")
+    inner = INNER_TYPE_RE.search(street, 1)
+    if inner:
+        context, street = f"{context} {street[:inner.start()]}", street[inner.start():]
+    street_type = STREET_TYPES.get(type_hint) if type_hint else None
+    tokens = []
+    for token in re.sub(r"[^\w\s-]", " ", ORDINAL_RE.sub(r"\1", street)).split():
+        token = token.strip("-")
+        if token in STREET_TYPES:
+            street_type = street_type or STREET_TYPES[token]
+        elif token:
+            tokens.append(token)
+    context_tokens = [token for token in re.sub(r"[^\w\s-]", " ", context).split() if token not in STREET_TYPES]
+    name_key = " ".join(sorted(tokens))
+    return street_type, name_key, " ".join(sorted(set(tokens + context_tokens)))
+
+
+def normalize_streets(names, types=None):
+    """
+    Matching keys for street names of either provider.
+
+    Returns a frame with street_type (short form, None if unknown), name_key
+    (the street's own tokens, sorted), full_key (plus any settlement or
+    district prefix) and archived. Every distinct name is parsed once.
+    """
+    names = pd.Series(names, copy=False).fillna("").astype(str).str.lower().str.replace("ё", "е")
+    types = pd.Series(types if types is not None else [""] * len(names), index=names.index).fillna("").astype(str).str.lower()
+    archived = names.str.contains(ARCHIVE_RE, regex=True).to_numpy()
+    names = names.str.replace(ARCHIVE_RE, "", regex=True).str.replace("_", " ")
+
+    codes, uniques = pd.factorize(pd.MultiIndex.from_arrays([names, types]))
+    parsed = [_split_street(name, type_hint.strip(". "))
+              for name, type_hint in zip(uniques.get_level_values(0), uniques.get_level_values(1))]
+    parsed = pd.DataFrame(parsed, columns=["street_type", "name_key", "full_key"]).iloc[codes].reset_index(drop=True)
+    parsed["archived"] = archived
+    return parsed
+
+
+def _runs(sorted_values):
+    """Start offsets of the runs of equal values in a sorted array"""
+    if not len(sorted_values):
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+
+
+def _expand(ptr, rows):
+    """(position in rows, flat index) of every CSR entry of the given rows"""
+    counts = ptr[rows + 1] - ptr[rows]
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(np.arange(len(rows)), counts), np.repeat(ptr[rows], counts) + within
+
+
+class GramSets:
+    """
+    Distinct character trigrams of a list of keys in CSR form: the trigram
+    ids of key i are ids[ptr[i]:ptr[i + 1]], ids index `vocabulary` (sorted
+    trigram codes shared by both providers). Intersections of candidate
+    pairs are then sort-and-compare on small integers instead of rebuilding
+    the trigrams of every pair.
+    """
+
+    def __init__(self, keys, vocabulary):
+        rows, grams = _trigram_codes(list(keys))
+        ids = np.searchsorted(vocabulary, grams)
+        keys_ = np.sort(rows.astype(np.int64) * len(vocabulary) + ids)
+        keys_ = keys_[np.r_[True, keys_[1:] != keys_[:-1]]] if len(keys_) else keys_
+        rows = keys_ // len(vocabulary)
+        self.ids = keys_ % len(vocabulary)
+        self.ptr = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(keys)), out=self.ptr[1:])
+        self.sizes = np.diff(self.ptr)
+
+    @staticmethod
+    def vocabulary(*key_lists):
+        grams = np.sort(np.concatenate([_trigram_codes(list(keys))[1] for keys in key_lists]))
+        return grams[_runs(grams)]
+
+
+def similarity(left, right, a, b, n_vocabulary):
+    """
+    Trigram similarity of left key a[i] vs right key b[i]: the mean of Dice
+    and overlap coefficients, as geocode_quality.trigram_similarity.
+    """
+    left_pair, left_flat = _expand(left.ptr, a)
+    right_pair, right_flat = _expand(right.ptr, b)
+    keys = np.sort(np.concatenate([left_pair * n_vocabulary + left.ids[left_flat],
+                                   right_pair * n_vocabulary + right.ids[right_flat]]))
+    shared = keys[1:][keys[1:] == keys[:-1]] // n_vocabulary
+    inter = np.bincount(shared, minlength=len(a))
+    left_size, right_size = left.sizes[a], right.sizes[b]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dice = np.where(left_size + right_size > 0, 2 * inter / (left_size + right_size), 0.0)
+        overlap = np.where(np.minimum(left_size, right_size) > 0, inter / np.minimum(left_size, right_size), 0.0)
+    return (dice + overlap) / 2
+
+
+class BlockingIndex:
+    """
+    Inverted index from name-key trigrams to Telecom streets.
+
+    The postings of trigram g are the streets postings[ptr[g]:ptr[g + 1]];
+    trigrams posted by more than MAX_GRAM_POSTINGS streets (' ул', 'ая ')
+    carry no signal and get no postings. candidates() looks up the
+    QUERY_GRAMS rarest trigrams of each query, counts how many of them every
+    street it meets shares and keeps the best TOP_CANDIDATES, so only a
+    handful of pairs per street is ever scored.
+    """
+
+    def __init__(self, grams, n_vocabulary, max_postings=MAX_GRAM_POSTINGS, query_grams=QUERY_GRAMS):
+        self.query_grams = query_grams
+        street_of = np.repeat(np.arange(len(grams.sizes)), grams.sizes)
+        order = np.argsort(grams.ids, kind="stable")
+        counts = np.bincount(grams.ids, minlength=n_vocabulary)
+        counts[counts > max_postings] = 0
+        self.postings = street_of[order][counts[grams.ids[order]] > 0]
+        self.ptr = np.zeros(n_vocabulary + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.ptr[1:])
+        self.size = len(grams.sizes)
+
+    def candidates(self, grams, rows, top=TOP_CANDIDATES):
+        """(query row, street row) arrays of the best candidates of the given query rows"""
+        pair, flat = _expand(grams.ptr, rows)
+        gram_ids = grams.ids[flat]
+        # Only the rarest trigrams of each query are looked up: a street sharing
+        # none of them cannot be similar enough to matter
+        postings = np.diff(self.ptr)[gram_ids]
+        order = np.lexsort((postings, pair))
+        order = order[postings[order] > 0]
+        first = _runs(pair[order])
+        rank = np.arange(len(order)) - np.repeat(first, np.diff(np.r_[first, len(order)]))
+        order = order[rank < self.query_grams]
+        pair, gram_ids = pair[order], gram_ids[order]
+
+        posting, posting_flat = _expand(self.ptr, gram_ids)
+        keys = np.sort(rows[pair[posting]] * self.size + self.postings[posting_flat])
+
+        # Shared trigrams per (query, street) pair, then the best `top` streets per query
+        starts = _runs(keys)
+        shared = np.diff(np.r_[starts, len(keys)])
+        query, street = keys[starts] // self.size, keys[starts] % self.size
+        order = np.lexsort((-shared, query))
+        query, street = query[order], street[order]
+        first = _runs(query)
+        rank = np.arange(len(query)) - np.repeat(first, np.diff(np.r_[first, len(query)]))
+        return query[rank < top], street[rank < top]
+
+
+def score_pairs(left, right, grams, left_rows, right_rows):
+    """
+    Match score (and the name-only similarity) of candidate pairs, in batches.
+    grams maps (side, key column) to the GramSets of that column.
+    """
+    score = np.zeros(len(left_rows))
+    name_similarity = np.zeros(len(left_rows))
+    n_vocabulary = grams["vocabulary"]
+    for start in range(0, len(left_rows), SCORE_BATCH):
+        batch = slice(start, start + SCORE_BATCH)
+        a, b = left_rows[batch], right_rows[batch]
+        name_similarity[batch] = similarity(grams["left", "name_key"], grams["right", "name_key"], a, b, n_vocabulary)
+        full_similarity = similarity(grams["left", "full_key"], grams["right", "full_key"], a, b, n_vocabulary)
+        score[batch] = NAME_WEIGHT * name_similarity[batch] + (1 - NAME_WEIGHT) * full_similarity
+
+    left_type = left["street_type"].to_numpy()[left_rows]
+    right_type = right["street_type"].to_numpy()[right_rows]
+    mismatch = pd.notna(left_type) & pd.notna(right_type) & (left_type != right_type)
+    score = np.where(mismatch, score * TYPE_MISMATCH_PENALTY, score)
+    return np.round(score, 4), np.round(name_similarity, 4)
+
+
+def match_streets(beeline, telecom, min_score=MIN_SCORE):
+    """
+    Best Telecom street for every Beeline street.
+
+    beeline needs street_id / name / street_type_full, telecom the frame of
+    load_telecom_streets() already narrowed to the Beeline streets' town (see
+    match_by_town). Returns one row per Beeline street in MAPPING_COLUMNS
+    order. A street is matched only when its best candidate scores at least
+    min_score, is not archived (archived streets rank below live ones with the
+    same score) and neither name key is just a number; the others keep empty
+    Telecom columns.
+    """
+    if beeline.empty or telecom.empty:
+        return _unmatched(beeline)
+    left = normalize_streets(beeline["name"], beeline.get("street_type_full"))
+    right = normalize_streets(telecom["name"])
+    columns = ("name_key", "full_key")
+    vocabulary = GramSets.vocabulary(*(side[column] for side in (left, right) for column in columns))
+    grams = {"vocabulary": len(vocabulary)}
+    for side, keys in (("left", left), ("right", right)):
+        for column in columns:
+            grams[side, column] = GramSets(keys[column], vocabulary)
+    index = BlockingIndex(grams["right", "name_key"], len(vocabulary))
+
+    query_rows, street_rows = [], []
+    for start in range(0, len(left), BLOCK_BATCH):
+        query, street = index.candidates(grams["left", "name_key"], np.arange(start, min(start + BLOCK_BATCH, len(left))))
+        query_rows.append(query)
+        street_rows.append(street)
+    query = np.concatenate(query_rows) if query_rows else np.zeros(0, dtype=np.int64)
+    street = np.concatenate(street_rows) if street_rows else np.zeros(0, dtype=np.int64)
+    metrics.incr("candidate_pairs", len(query))
+    logger.info(f"Blocking: {len(query)} candidate pairs instead of {len(left) * len(right)}")
+
+    score, name_similarity = score_pairs(left, right, grams, query, street)
+    archived = right["archived"].to_numpy()
+    order = np.lexsort((street, archived[street], -score, query))
+    query, street, score, name_similarity = query[order], street[order], score[order], name_similarity[order]
+    first = np.r_[True, query[1:] != query[:-1]] if len(query) else np.zeros(0, dtype=bool)
+    best_score = np.repeat(score[first], np.diff(np.r_[np.flatnonzero(first), len(query)]))
+    ties = np.bincount(query[score >= best_score - AMBIGUITY_MARGIN], minlength=len(left)) - 1
+
+    best = np.full(len(left), -1, dtype=np.int64)
+    best_score_per_row = np.zeros(len(left))
+    best_name = np.zeros(len(left))
+    best[query[first]] = street[first]
+    best_score_per_row[query[first]] = score[first]
+    best_name[query[first]] = name_similarity[first]
+    pick = np.maximum(best, 0)
+    number_only = (
+        left["name_key"].str.fullmatch(NUMBER_KEY_RE).to_numpy()
+        | right["name_key"].str.fullmatch(NUMBER_KEY_RE).to_numpy()[pick]
+    )
+    eligible = (best >= 0) & ~archived[pick] & ~number_only
+    matched = eligible & (best_score_per_row >= min_score)
+    rejected = (best >= 0) & (best_score_per_row >= min_score) & ~eligible
+    metrics.incr("rejected_archived_or_number", int(rejected.sum()))
+
+    def telecom_column(name, dtype=None):
+        values = telecom[name].to_numpy()[pick]
+        if dtype == "Int64":
+            return pd.arrays.IntegerArray(np.where(matched, values, 0).astype(np.int64), ~matched)
+        return np.where(matched, values, None)
+
+    return pd.DataFrame({
+        "beeline_street_id": beeline["street_id"].to_numpy(),
+        "beeline_name": beeline["name"].to_numpy(),
+        "telecom_street_id": telecom_column("street_id", "Int64"),
+        "telecom_location_id": telecom_column("location_id", "Int64"),
+        "telecom_name": telecom_column("name"),
+        "telecom_town": telecom_column("town"),
+        "score": best_score_per_row,
+        "name_similarity": best_name,
+        "ties": np.where(matched, np.maximum(ties, 0), 0),
+        "method": np.where(matched, "auto", "unmatched"),
+    }, columns=MAPPING_COLUMNS)
+
+
+def _unmatched(beeline):
+    """Mapping rows for Beeline streets without any Telecom candidate"""
+    n = len(beeline)
+    missing = pd.arrays.IntegerArray(np.zeros(n, dtype=np.int64), np.ones(n, dtype=bool))
+    return pd.DataFrame({
+        "beeline_street_id": beeline["street_id"].to_numpy(),
+        "beeline_name": beeline["name"].to_numpy(),
+        "telecom_street_id": missing,
+        "telecom_location_id": missing.copy(),
+        "telecom_name": np.full(n, None),
+        "telecom_town": np.full(n, None),
+        "score": np.zeros(n),
+        "name_similarity": np.zeros(n),
+        "ties": np.zeros(n, dtype=np.int64),
+        "method": "unmatched",
+    }, columns=MAPPING_COLUMNS)
+
+
+def settlement_streets(telecom, settlement):
+    """
+    Rows of load_telecom_streets() inside the settlement: its nearest town,
+    district or region ancestor carries that name. Cities of republican
+    status ('г.Алматы', 'г.Астана') are region nodes with streets right under
+    them, district centres ('г.Караганда') district nodes. The settlement
+    name becomes the rows' town.
+    """
+    inside = np.zeros(len(telecom), dtype=bool)
+    for level in SETTLEMENT_LEVELS:
+        inside |= (telecom[level] == settlement).to_numpy()
+    return telecom[inside].assign(town=settlement).reset_index(drop=True)
+
+
+def match_by_town(beeline, telecom, town=TELECOM_TOWN, city_towns=BEELINE_CITY_TOWNS, min_score=MIN_SCORE):
+    """
+    match_streets() per Beeline city against the streets of its Telecom
+    settlement only, so a street is never matched to a namesake elsewhere.
+    Raises ValueError for a city without a settlement or whose settlement has
+    no Telecom streets: such a mapping would be unmatched by construction.
+    """
+    city = beeline["city_id"] if "city_id" in beeline.columns else pd.Series(np.nan, index=beeline.index)
+    results = []
+    for city_id, streets in beeline.groupby(city, sort=False, dropna=False):
+        city_town = town or city_towns.get(city_id)
+        if city_town is None:
+            raise ValueError(f"Beeline city {city_id} has no Telecom settlement in BEELINE_CITY_TOWNS")
+        candidates = settlement_streets(telecom, city_town)
+        if candidates.empty:
+            raise ValueError(
+                f"No Telecom streets in {city_town} (Beeline city {city_id}, {len(streets)} streets): "
+                f"crawl that settlement first or set TELECOM_TOWN"
+            )
+        logger.info(f"Beeline city {city_id}: {len(streets)} streets against {len(candidates)} in {city_town}")
+        results.append(match_streets(streets.reset_index(drop=True), candidates, min_score))
+    if not results:
+        return _unmatched(beeline)
+    return pd.concat(results, ignore_index=True)
+
+
+def load_telecom_streets(town=None, tree_file=TREE_FILE, locations_csv=LOCATIONS_CSV):
+    """
+    Street nodes of the Telecom tree with their ids and the names of their
+    nearest town, district and region ('' if none); with town, only the
+    streets of that settlement (see settlement_streets).
+    """
+    if os.path.exists(tree_file):
+        tree = LocationTree.load(tree_file)
+    else:
+        tree = LocationTree.from_frame(pd.read_csv(locations_csv))
+    types = np.asarray(tree.types)
+    streets = np.flatnonzero(types == TYPES.index("street"))
+    parent = np.asarray(tree.parent)
+    result = pd.DataFrame({
+        "street_id": np.asarray(tree.original_ids)[streets].astype(np.int64),
+        "location_id": np.asarray(tree.ids)[streets].astype(np.int64),
+        "name": [tree.name(node) for node in streets.tolist()],
+    })
+    # Nearest ancestor of every level (parents precede children in preorder)
+    for level in SETTLEMENT_LEVELS:
+        code = TYPES.index(level)
+        nearest = np.full(len(tree), -1, dtype=np.int64)
+        for i in range(len(tree)):
+            nearest[i] = i if types[i] == code else (nearest[parent[i]] if parent[i] >= 0 else -1)
+        names = {node: tree.name(node) for node in np.unique(nearest[nearest >= 0]).tolist()}
+        result[level] = [names.get(node, "") for node in nearest[streets].tolist()]
+    if town:
+        result = settlement_streets(result, town)
+    return result
+
+
+def merge_manual(mapping, path=MAPPING_CSV):
+    """Keep the rows marked method=manual in an existing mapping file over the computed ones"""
+    if not os.path.exists(path):
+        return mapping
+    existing = pd.read_csv(path, dtype={"method": "string", "telecom_street_id": "Int64", "telecom_location_id": "Int64"})
+    manual = existing[existing["method"] == "manual"]
+    if manual.empty:
+        return mapping
+    logger.info(f"Keeping {len(manual)} manual mappings from {path}")
+    computed = mapping[~mapping["beeline_street_id"].isin(manual["beeline_street_id"])]
+    merged = pd.concat([computed, manual.reindex(columns=MAPPING_COLUMNS)], ignore_index=True)
+    return merged.sort_values("beeline_street_id", ignore_index=True)
+
+
+def save_mapping(mapping, path=MAPPING_CSV):
+    tmp_path = f"{path}.tmp"
+    mapping.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("load") as stage:
+            beeline = pd.read_csv(BEELINE_STREETS_CSV)
+            telecom = load_telecom_streets()
+            stage.add_rows(len(beeline) + len(telecom))
+        with metrics.stage("match") as stage:
+            mapping = match_by_town(beeline, telecom)
+            stage.add_rows(len(mapping))
+        with metrics.stage("save") as stage:
+            mapping = merge_manual(mapping.sort_values("beeline_street_id", ignore_index=True))
+            save_mapping(mapping)
+            stage.add_rows(len(mapping))
+        matched = int(mapping["method"].isin(["auto", "manual"]).sum())
+        metrics.incr("matched", matched)
+        logger.info(f"Matched {matched} of {len(mapping)} Beeline streets to {len(telecom)} Telecom streets, saved to {MAPPING_CSV}")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,68 @@
 import pandas as pd
-import json
 import csv
+import logging
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from address_records import AddressRecord, RecordTable, write_json_array
+from map_patches import PATCH_DIR, SNAPSHOT_FILE, PatchWriter, address_id
+
+logger = logging.getLogger("combine")
+metrics = RunMetrics("combine")
 
 # Configuration
 TELECOM_CSV = "ftth_results_with_coordinates.csv"
 BEELINE_CSV = "beeline_ftth_with_coordinates.csv"
 COMBINED_CSV = "combined_ftth_results.csv"
 COMBINED_JSON = "combined_addresses.json"
+# The map (index.html) loads addresses.json and map_data/ from MAP_DIR, the repository root
+MAP_DIR = os.getenv("MAP_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+MAP_JSON = "addresses.json"
+
+# AddressRecord field -> key in the map JSON (order of the keys in every JSON object)
+JSON_KEYS = {
+    'street_id': 'streetId',
+    'street_name': 'streetName',
+    'sub_house': 'subHouse',
+    'is_available': 'isAvailable',
+    'full_address': 'fullAddress',
+    'gis_full_name': 'gisFullName',
+    'provider': 'provider',
+    'house': 'house',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+}
 
 def combine_data():
     """
-    Combine data from Telecom and Beeline into a single CSV and JSON file
+    Combine data from Telecom and Beeline into a single CSV; returns the number
+    of combined rows (0 when there is nothing to combine)
     """
     # Load Telecom data
     try:
         telecom_df = pd.read_csv(TELECOM_CSV)
-        print(f"Loaded {len(telecom_df)} records from Telecom")
+        logger.info(f"Loaded {len(telecom_df)} records from Telecom")
         
         # Add provider column if not exists
         if 'provider' not in telecom_df.columns:
             telecom_df['provider'] = 'telecom'
     except Exception as e:
-        print(f"Error loading Telecom data: {e}")
+        logger.error(f"Error loading Telecom data: {e}")
         telecom_df = pd.DataFrame()
     
     # Load Beeline data
     try:
         beeline_df = pd.read_csv(BEELINE_CSV)
-        print(f"Loaded {len(beeline_df)} records from Beeline")
+        logger.info(f"Loaded {len(beeline_df)} records from Beeline")
         
         # Ensure provider column exists
         if 'provider' not in beeline_df.columns:
             beeline_df['provider'] = 'beeline'
     except Exception as e:
-        print(f"Error loading Beeline data: {e}")
+        logger.error(f"Error loading Beeline data: {e}")
         beeline_df = pd.DataFrame()
     
     # Combine datasets
@@ -75,33 +104,39 @@ def combine_data():
         combined_df = combined_df.drop(['lat_rounded', 'lon_rounded'], axis=1)
         
     elif not telecom_df.empty:
-        print("Only Telecom data available")
+        logger.info("Only Telecom data available")
         combined_df = telecom_df
         if 'provider' not in combined_df.columns:
             combined_df['provider'] = 'telecom'
     elif not beeline_df.empty:
-        print("Only Beeline data available")
+        logger.info("Only Beeline data available")
         combined_df = beeline_df
         if 'provider' not in combined_df.columns:
             combined_df['provider'] = 'beeline'
     else:
-        print("No data available to combine")
-        return
+        logger.warning("No data available to combine")
+        return 0
     
     # Save combined data to CSV
     combined_df.to_csv(COMBINED_CSV, index=False)
-    print(f"Saved {len(combined_df)} records to {COMBINED_CSV}")
-    
-    # Convert to JSON for the map
-    convert_to_json(COMBINED_CSV, COMBINED_JSON)
+    logger.info(f"Saved {len(combined_df)} records to {COMBINED_CSV}")
+    return len(combined_df)
 
-def convert_to_json(csv_file, json_file):
+def house_value(house):
+    """House number as int when possible ("57" -> 57, "32/2" stays a string)"""
+    try:
+        return int(float(house))
+    except (ValueError, TypeError):
+        return house if house else ''
+
+def convert_to_json(csv_file, json_file, map_dir=MAP_DIR):
     """
-    Convert CSV file to JSON format for the FTTH map application
+    Convert CSV file to JSON format for the FTTH map application and publish it
+    to map_dir (addresses.json plus the map_data/ patches the map reads)
     """
-    data = []
+    data = RecordTable(AddressRecord)
     
-    with open(csv_file, 'r', encoding='utf-8') as csvfile:
+    with metrics.stage("convert_to_json") as stage, open(csv_file, 'r', encoding='utf-8') as csvfile:
         # Read CSV data
         reader = csv.DictReader(csvfile)
         
@@ -109,39 +144,60 @@ def convert_to_json(csv_file, json_file):
         for row in reader:
             try:
                 # Extract the necessary fields
-                processed_row = {
-                    'streetId': int(float(row['street_id'])) if row['street_id'] and row['street_id'] != 'None' else None,
-                    'streetName': row['street_name'],
-                    'subHouse': row['sub_house'] if 'sub_house' in row and row['sub_house'] else '',
-                    'isAvailable': int(float(row['is_available'])) if row['is_available'] and row['is_available'] != 'None' else 0,
-                    'fullAddress': row['full_address'] if 'full_address' in row else '',
-                    'gisFullName': row['gis_full_name'] if 'gis_full_name' in row and row['gis_full_name'] != 'None' else '',
-                    'provider': row['provider'] if 'provider' in row else 'telecom'
-                }
-                
-                # Handle house number - convert to int when possible
-                try:
-                    processed_row['house'] = int(float(row['house']))
-                except (ValueError, TypeError):
-                    processed_row['house'] = row['house'] if row['house'] else ''
+                processed_row = AddressRecord(
+                    street_id=int(float(row['street_id'])) if row['street_id'] and row['street_id'] != 'None' else None,
+                    street_name=row['street_name'],
+                    sub_house=row['sub_house'] if 'sub_house' in row and row['sub_house'] else '',
+                    is_available=int(float(row['is_available'])) if row['is_available'] and row['is_available'] != 'None' else 0,
+                    full_address=row['full_address'] if 'full_address' in row else '',
+                    gis_full_name=row['gis_full_name'] if 'gis_full_name' in row and row['gis_full_name'] != 'None' else '',
+                    provider=row['provider'] if 'provider' in row else 'telecom',
+                    house=row['house'] if row['house'] else ''
+                )
                 
                 # Only add points with valid coordinates
                 if (row['latitude'] and row['latitude'] != 'None' and 
                     row['longitude'] and row['longitude'] != 'None'):
-                    processed_row['latitude'] = float(row['latitude'])
-                    processed_row['longitude'] = float(row['longitude'])
+                    processed_row.latitude = float(row['latitude'])
+                    processed_row.longitude = float(row['longitude'])
                     data.append(processed_row)
+                stage.add_rows()
             except (ValueError, KeyError) as e:
-                print(f"Error processing row: {row}")
-                print(f"Error message: {e}")
+                metrics.incr("errors")
+                logger.warning(f"Error processing row: {row} ({e})")
                 continue
     
-    # Write JSON file
-    with open(json_file, 'w', encoding='utf-8') as jsonfile:
-        json.dump(data, jsonfile, ensure_ascii=False, indent=2)
+    # Write JSON file (streamed row by row from the table); every point carries a stable
+    # address id so the map can apply the versioned patches published with it
+    with metrics.stage("write_json") as stage:
+        ids = [address_id(provider, address) for provider, address
+               in zip(data.values('provider'), data.values('full_address'))]
+        items = ({'id': point_id, **item} for point_id, item
+                 in zip(ids, data.json_items(JSON_KEYS, convert={'house': house_value})))
+        patches = PatchWriter(os.path.join(map_dir, PATCH_DIR), SNAPSHOT_FILE)
+        write_json_array(json_file, patches.track(items))
+        # The data file goes first: a manifest never announces a version the map can't load yet
+        map_json = os.path.join(map_dir, MAP_JSON)
+        shutil.copyfile(json_file, f"{map_json}.tmp")
+        os.replace(f"{map_json}.tmp", map_json)
+        version = patches.commit()
+        stage.add_rows(len(data))
     
-    print(f"Conversion complete! Processed {len(data)} valid data points.")
-    print(f"JSON data saved to {json_file}")
+    logger.info(f"Conversion complete! Processed {len(data)} valid data points.")
+    logger.info(f"JSON data saved to {json_file} and published to {map_json} (map data version {version})")
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("combine_data") as stage:
+            combined = combine_data()
+            stage.add_rows(combined)
+        # Convert to JSON for the map
+        if combined:
+            convert_to_json(COMBINED_CSV, COMBINED_JSON)
+    finally:
+        metrics.write_report()
 
 if __name__ == "__main__":
-    combine_data()
\ No newline at end of file
+    main()
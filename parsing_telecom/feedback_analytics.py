@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+
+logger = logging.getLogger("feedback_analytics")
+metrics = RunMetrics("feedback_analytics")
+
+# Configuration
+FEEDBACK_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset_feedback.csv")
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "feedback_analytics")
+CHUNK_ROWS = 20_000
+N_WORKERS = int(os.getenv("FEEDBACK_WORKERS", os.cpu_count() or 1))
+MAX_PENDING_CHUNKS = 2 * N_WORKERS  # chunks in flight; bounds memory on large inputs
+MIN_TOKEN_LENGTH = 3
+MIN_STEM_LENGTH = 4
+TOP_TERMS = 30
+
+SECTIONS = ("pros", "cons", "comment")
+SECTION_HEADERS = {
+    "Достоинства": "pros",
+    "Недостатки": "cons",
+    "Комментарий": "comment",
+}
+SECTION_RE = re.compile(r"(Достоинства|Недостатки|Комментарий)\s*:")
+TOKEN_RE = re.compile(r"[a-zа-я0-9]+")
+
+STOPWORDS = frozenset("""
+и в во не что он на я с со как а то все всё она так его но да ты к у же вы за бы по только ее её мне было
+вот от меня еще ещё нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь
+опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб
+без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один
+почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после над
+больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед иногда
+лучше чуть том нельзя такой им более всегда конечно всю между это очень просто весь который которые также
+""".split())
+
+# Longest endings first; a light stemmer so "батарея", "батареи", "батарею" share one term
+SUFFIXES = tuple(sorted("""
+иями ями ами ого его ему ому ыми ими ией иях ях ах ой ей ий ый ая яя ое ее ие ые ую юю ом ем ам ям
+ов ев ию ья ье ьи ью ия ии иться ться ется ются ит ят ет ут ют ишь ешь ил ыл ла ли ло но ть ти
+а я о е и ы у ю ь
+""".split(), key=len, reverse=True))
+_STEMS = {}  # token -> stem, shared by every tokenize() call in the process
+
+
+def split_sections(comment):
+    """Split a review into its Достоинства / Недостатки / Комментарий parts"""
+    result = dict.fromkeys(SECTIONS, "")
+    if not isinstance(comment, str):
+        return result
+    parts = SECTION_RE.split(comment)
+    # Text before the first header is a free-form comment
+    result["comment"] = parts[0].strip()
+    for header, text in zip(parts[1::2], parts[2::2]):
+        section = SECTION_HEADERS[header]
+        text = " ".join(text.split())
+        if text:
+            result[section] = f"{result[section]} {text}".strip()
+    return result
+
+
+def stem(token):
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """Lowercased, stemmed tokens of Russian/Latin text without stopwords"""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if len(token) < MIN_TOKEN_LENGTH or token in STOPWORDS or token.isdigit():
+            continue
+        stemmed = _STEMS.get(token)
+        if stemmed is None:
+            stemmed = _STEMS[token] = stem(token)
+        tokens.append(stemmed)
+    return tokens
+
+
+def read_feedback(path=FEEDBACK_CSV, chunksize=CHUNK_ROWS):
+    """Stream reviews in chunks with parsed dates and integer star ratings (<NA> if missing)"""
+    for chunk in pd.read_csv(path, encoding="utf-8-sig", dtype={"comment": "string"}, chunksize=chunksize):
+        yield pd.DataFrame({
+            "date": pd.to_datetime(chunk["date"], format="%d.%m.%Y", errors="coerce"),
+            "star_count": pd.to_numeric(chunk["star_count"], errors="coerce").astype("Int8"),
+            "comment": chunk["comment"].fillna(""),
+        })
+
+
+def _count_chunk(comments):
+    """
+    Worker: term counts of every (review, section) of one chunk as CSR arrays
+    over a chunk-local vocabulary. Rows are ordered review-major, section-minor.
+    """
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    data = []
+    for comment in comments:
+        sections = split_sections(comment)
+        for section in SECTIONS:
+            counts = {}
+            for token in tokenize(sections[section]):
+                term = vocabulary.setdefault(token, len(vocabulary))
+                counts[term] = counts.get(term, 0) + 1
+            indices.extend(counts)
+            data.extend(counts.values())
+            indptr.append(len(indices))
+    return (
+        list(vocabulary),
+        np.array(indptr, dtype=np.int64),
+        np.array(indices, dtype=np.int32),
+        np.array(data, dtype=np.int32),
+    )
+
+
+class TermMatrix:
+    """
+    Sparse term counts of every review section in CSR form (indptr / indices /
+    data) with one row per (review, section), plus per-row review metadata.
+    Built from chunks counted in worker processes; the vocabulary is merged in
+    the parent by remapping each chunk's local term ids.
+    """
+
+    def __init__(self):
+        self.vocabulary = []
+        self.term_ids = {}
+        self._indptr = [np.zeros(1, dtype=np.int64)]
+        self._indices = []
+        self._data = []
+        self._dates = []
+        self._stars = []
+        self.n_reviews = 0
+
+    def add_chunk(self, reviews, counted):
+        local_vocabulary, indptr, indices, data = counted
+        remap = np.empty(len(local_vocabulary), dtype=np.int32)
+        for i, term in enumerate(local_vocabulary):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                term_id = self.term_ids[term] = len(self.vocabulary)
+                self.vocabulary.append(term)
+            remap[i] = term_id
+        self._indptr.append(indptr[1:] + self._indptr[-1][-1])
+        self._indices.append(remap[indices])
+        self._data.append(data)
+        self._dates.append(reviews["date"].to_numpy())
+        # Missing ratings become NaN so they drop out of star filters and averages
+        self._stars.append(reviews["star_count"].to_numpy(dtype=np.float32, na_value=np.nan))
+        self.n_reviews += len(reviews)
+
+    def finalize(self):
+        """Concatenate the chunks into the final arrays"""
+        self.indptr = np.concatenate(self._indptr)
+        self.indices = np.concatenate(self._indices) if self._indices else np.zeros(0, dtype=np.int32)
+        self.data = np.concatenate(self._data) if self._data else np.zeros(0, dtype=np.int32)
+        self.dates = np.concatenate(self._dates) if self._dates else np.zeros(0, dtype="datetime64[ns]")
+        self.stars = np.concatenate(self._stars) if self._stars else np.zeros(0, dtype=np.float32)
+        self.vocabulary = np.array(self.vocabulary)
+        del self._indptr, self._indices, self._data, self._dates, self._stars
+        return self
+
+    @property
+    def shape(self):
+        return len(self.indptr) - 1, len(self.vocabulary)
+
+    def row_lengths(self):
+        return np.diff(self.indptr)
+
+    def section_rows(self, section=None):
+        """Row numbers of one section (or all rows)"""
+        n_rows = self.shape[0]
+        if section is None:
+            return np.arange(n_rows)
+        return np.arange(SECTIONS.index(section), n_rows, len(SECTIONS))
+
+    def document_frequency(self):
+        return np.bincount(self.indices, minlength=len(self.vocabulary))
+
+    def tfidf(self):
+        """L2-normalized TF-IDF values aligned with self.indices (smoothed idf)"""
+        n_docs = int((self.row_lengths() > 0).sum())
+        idf = np.log((1 + n_docs) / (1 + self.document_frequency())) + 1
+        values = self.data * idf[self.indices]
+        row_of = np.repeat(np.arange(self.shape[0]), self.row_lengths())
+        norms = np.sqrt(np.bincount(row_of, weights=values ** 2, minlength=self.shape[0]))
+        return values / np.where(norms > 0, norms, 1)[row_of]
+
+    def _row_mask(self, section=None, min_stars=None, max_stars=None):
+        mask = np.zeros(self.shape[0], dtype=bool)
+        mask[self.section_rows(section)] = True
+        stars = np.repeat(self.stars, len(SECTIONS))
+        if min_stars is not None:
+            mask &= stars >= min_stars
+        if max_stars is not None:
+            mask &= stars <= max_stars
+        return mask
+
+    def top_terms(self, n=TOP_TERMS, section=None, min_stars=None, max_stars=None, weighting="tfidf"):
+        """Terms with the highest summed TF-IDF (or raw count) over the selected rows"""
+        values = self.tfidf() if weighting == "tfidf" else self.data.astype(float)
+        selected = np.repeat(self._row_mask(section, min_stars, max_stars), self.row_lengths())
+        scores = np.bincount(self.indices[selected], weights=values[selected], minlength=len(self.vocabulary))
+        documents = np.bincount(self.indices[selected], minlength=len(self.vocabulary))
+        top = np.argsort(-scores, kind="stable")[:n]
+        top = top[scores[top] > 0]
+        return pd.DataFrame({"term": self.vocabulary[top], "score": np.round(scores[top], 4), "documents": documents[top]})
+
+    def rating_by_topic(self, topics, section=None):
+        """
+        Review count, mean rating and star histogram of the reviews mentioning each
+        topic. A topic is a list of stems; a vocabulary term matches a stem it starts with.
+        """
+        selected = np.repeat(self._row_mask(section), self.row_lengths())
+        row_of = np.repeat(np.arange(self.shape[0]), self.row_lengths())
+        rows = []
+        for topic, stems in topics.items():
+            term_mask = np.zeros(len(self.vocabulary), dtype=bool)
+            for prefix in stems:
+                term_mask |= np.char.startswith(self.vocabulary, stem(prefix))
+            hit = selected & term_mask[self.indices]
+            reviews = np.unique(row_of[hit] // len(SECTIONS))
+            stars = self.stars[reviews]
+            stars = stars[~np.isnan(stars)].astype(np.int64)
+            row = {"topic": topic, "reviews": len(reviews), "mean_stars": round(float(stars.mean()), 3) if len(stars) else np.nan}
+            histogram = np.bincount(stars, minlength=6)
+            for star in range(1, 6):
+                row[f"stars_{star}"] = int(histogram[star])
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def save(self, output_dir=OUTPUT_DIR):
+        os.makedirs(output_dir, exist_ok=True)
+        np.savez(os.path.join(output_dir, "term_counts.npz"), indptr=self.indptr, indices=self.indices, data=self.data,
+                 stars=self.stars, dates=self.dates.astype("datetime64[D]").astype(np.int32))
+        with open(os.path.join(output_dir, "vocabulary.json"), "w", encoding="utf-8") as f:
+            json.dump({"sections": SECTIONS, "terms": self.vocabulary.tolist()}, f, ensure_ascii=False)
+
+
+# Topics for rating_by_topic(); stems are matched as term prefixes
+TOPICS = {
+    "battery": ["батаре", "аккумулятор", "заряд"],
+    "camera": ["камер", "фото", "снимк", "съемк"],
+    "screen": ["экран", "дисплей"],
+    "performance": ["процессор", "быстр", "тормоз", "лаг", "производительн"],
+    "price": ["цен", "дорог", "дешев", "стоимост"],
+    "delivery": ["доставк", "курьер", "магазин"],
+    "sound": ["звук", "динамик", "микрофон"],
+    "build": ["корпус", "сборк", "царапин", "стекл"],
+}
+
+
+def build_matrix(path=FEEDBACK_CSV, chunksize=CHUNK_ROWS, workers=N_WORKERS):
+    """
+    Stream the CSV and count terms chunk by chunk in a process pool. At most
+    MAX_PENDING_CHUNKS raw chunks are in flight, so memory is bounded by the
+    sparse result rather than the input size.
+    """
+    matrix = TermMatrix()
+    if workers <= 1:
+        for reviews in read_feedback(path, chunksize):
+            matrix.add_chunk(reviews, _count_chunk(reviews["comment"].tolist()))
+        return matrix.finalize()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for reviews in read_feedback(path, chunksize):
+            pending.append((reviews, pool.submit(_count_chunk, reviews["comment"].tolist())))
+            # Chunks are merged in input order so row numbers follow the file
+            while len(pending) >= MAX_PENDING_CHUNKS:
+                done, future = pending.pop(0)
+                matrix.add_chunk(done, future.result())
+        for done, future in pending:
+            matrix.add_chunk(done, future.result())
+    return matrix.finalize()
+
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("count_terms") as stage:
+            matrix = build_matrix()
+            stage.add_rows(matrix.n_reviews)
+        logger.info(f"{matrix.n_reviews} reviews, {len(matrix.vocabulary)} terms, {len(matrix.indices)} non-zeros")
+        with metrics.stage("save") as stage:
+            matrix.save()
+            for section in SECTIONS:
+                top = matrix.top_terms(section=section)
+                top.to_csv(os.path.join(OUTPUT_DIR, f"top_terms_{section}.csv"), index=False)
+                stage.add_rows(len(top))
+            topics = matrix.rating_by_topic(TOPICS)
+            topics.to_csv(os.path.join(OUTPUT_DIR, "rating_by_topic.csv"), index=False)
+            logger.info(f"Rating by topic:\n{topics.to_string(index=False)}")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
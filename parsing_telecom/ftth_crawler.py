@@ -0,0 +1,423 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import requests
+
+TELECOM_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TELECOM_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "parsing_beeline"))
+from run_metrics import RunMetrics, setup_logging
+from address_records import ADDRESS_CSV_CONVERTERS, AddressRecord, RecordTable
+from location_tree import LOCATIONS_CSV, TREE_FILE
+from street_matcher import ARCHIVE_RE, SETTLEMENT_LEVELS, load_telecom_streets
+
+logger = logging.getLogger("telecom_ftth")
+metrics = RunMetrics("telecom_ftth")
+
+# Telecom.kz technical-check endpoints, copied from the requests the technical-check page makes
+# (browser dev tools). Required: there is no default, a wrong path would only produce 404s.
+#   TELECOM_HOUSES_URL        houses of a street, with a {street_id} placeholder
+#   TELECOM_AVAILABILITY_URL  technical check of a house, with a {house_id} placeholder
+HOUSES_URL = os.getenv("TELECOM_HOUSES_URL")
+AVAILABILITY_URL = os.getenv("TELECOM_AVAILABILITY_URL")
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "application/json, text/plain, */*",
+    "Referer": "https://telecom.kz/ru/technical-check",
+    "Origin": "https://telecom.kz",
+}
+
+# Configuration
+MAX_WORKERS = int(os.getenv("TELECOM_WORKERS", "8"))
+MAX_REQUESTS_PER_SECOND = float(os.getenv("TELECOM_RPS", "5"))  # shared by all workers
+MAX_RETRIES = 3
+INITIAL_DELAY = 1
+REQUEST_TIMEOUT = 30
+BATCH_STREETS = 50  # streets per output batch file
+PARTIAL_DIR = os.path.join(TELECOM_DIR, "ftth_results_partial")
+DONE_FILE = os.path.join(PARTIAL_DIR, "done_streets.txt")  # "street_id,failed checks" per finished street
+ATTEMPTS_FILE = os.path.join(PARTIAL_DIR, "incomplete_streets.txt")  # one line per run that left a street incomplete
+MAX_STREET_ATTEMPTS = 3  # after this many incomplete runs a street is marked done with its failure count
+RAW_CSV = os.path.join(TELECOM_DIR, "ftth_results.csv")
+OUTPUT_CSV = os.path.join(ROOT_DIR, "parsing_beeline", "ftth_results_with_coordinates.csv")  # read by combine_data
+GEOCODE = True  # Geocode the houses with the Beeline 2GIS pipeline (needs GIS_API_KEY)
+
+# Pinned response schema of the two endpoints; fixtures/technical_check.json holds sample responses
+# with the values the parsers must return (python ftth_crawler.py check-fixture).
+#   houses        [{"id": 5012, "name": "145к5"}, ...]  - the {id, name} list every locations endpoint returns;
+#                 the name is the full house number, корпус included
+#   availability  {"technologies": [{"name": "GPON"}, ...]}
+# Only FTTH / GPON counts as available: ADSL or FTTB houses are 0.
+FTTH_TECHNOLOGIES = ("ftth", "gpon")
+FIXTURE_FILE = os.path.join(TELECOM_DIR, "fixtures", "technical_check.json")
+
+
+class FetchError(RuntimeError):
+    """A Telecom request that failed after all retries, or returned an unexpected response"""
+
+
+class RateLimiter:
+    """Spaces requests from all threads at least 1 / rate seconds apart"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+_local = threading.local()
+
+
+def _session():
+    """One requests.Session (connection pool) per worker thread"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+        session.headers.update(HEADERS)
+    return session
+
+
+def fetch_json(url, params=None, max_retries=MAX_RETRIES, initial_delay=INITIAL_DELAY):
+    """
+    GET a Telecom endpoint through the shared rate limiter, backing off on 429 / 5xx.
+    Returns None for an empty body and raises FetchError for any other status
+    (404 included), so a failed request is never mistaken for "no data".
+    """
+    delay = initial_delay
+    for attempt in range(max_retries + 1):
+        _limiter.wait()
+        try:
+            metrics.incr("requests")
+            with metrics.timed("telecom_request"):
+                response = _session().get(url, params=params, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+        else:
+            if response.status_code == 200:
+                if not response.content:
+                    return None
+                try:
+                    return response.json()
+                except ValueError as e:
+                    metrics.incr("errors")
+                    raise FetchError(f"{url}: invalid JSON ({e})") from e
+            status = response.status_code
+            if status == 429:
+                metrics.incr("rate_limited")
+        if attempt < max_retries and (status == 429 or not isinstance(status, int) or status >= 500):
+            metrics.incr("retries")
+            wait_time = delay + random.uniform(0, 1)
+            logger.debug(f"{url}: {status}, retry {attempt + 1}/{max_retries} in {wait_time:.1f}s")
+            time.sleep(wait_time)
+            delay *= 2
+            continue
+        metrics.incr("errors")
+        raise FetchError(f"{url}: {status}")
+
+
+def parse_houses(data):
+    """
+    (house_id, house, sub_house) for every house of a street response (None: no
+    houses). Anything but the pinned [{"id", "name"}] list raises ValueError.
+    sub_house is always '': the корпус is part of the house name.
+    """
+    if data is None:
+        return []
+    if not isinstance(data, list):
+        raise ValueError(f"houses response is a {type(data).__name__}, expected a list")
+    houses = []
+    for item in data:
+        if not isinstance(item, dict) or item.get("id") is None or not str(item.get("name") or "").strip():
+            raise ValueError(f"house entry without id / name: {item!r:.100}")
+        houses.append((item["id"], str(item["name"]).strip(), ""))
+    return houses
+
+
+def parse_availability(data):
+    """
+    1 if the technical check lists FTTH / GPON among the house's technologies,
+    0 if it lists other technologies only. Anything but the pinned
+    {"technologies": [{"name"}]} object raises ValueError, so the house is not
+    recorded as 0.
+    """
+    technologies = data.get("technologies") if isinstance(data, dict) else None
+    if not isinstance(technologies, list):
+        raise ValueError(f"availability response has no technologies list: {data!r:.100}")
+    names = []
+    for tech in technologies:
+        if not isinstance(tech, dict) or not isinstance(tech.get("name"), str):
+            raise ValueError(f"technology entry without a name: {tech!r:.100}")
+        names.append(tech["name"].lower())
+    return int(any(name in FTTH_TECHNOLOGIES for name in names))
+
+
+def check_fixture(path=FIXTURE_FILE):
+    """Run both parsers on the sample responses in the fixture; raises ValueError on a mismatch"""
+    with open(path, encoding="utf-8") as f:
+        fixture = json.load(f)
+    houses = [list(house) for house in parse_houses(fixture["houses"]["response"])]
+    if houses != fixture["houses"]["expected"]:
+        raise ValueError(f"parse_houses returned {houses}, expected {fixture['houses']['expected']}")
+    for case in fixture["availability"]:
+        result = parse_availability(case["response"])
+        if result != case["expected"]:
+            raise ValueError(f"parse_availability returned {result} for {case['response']}, expected {case['expected']}")
+    for case in fixture.get("rejected", []):
+        parser = parse_houses if case["endpoint"] == "houses" else parse_availability
+        try:
+            parser(case["response"])
+        except ValueError:
+            continue
+        raise ValueError(f"{parser.__name__} accepted {case['response']}")
+    logger.info(f"{path}: both parsers match the pinned schema")
+
+
+def city_prefix(town_name):
+    """'г.Караганда' -> 'Караганда г., ' (the format the Beeline addresses use)"""
+    town_name = town_name.strip()
+    if town_name.startswith("г."):
+        return f"{town_name[2:].strip()} г., "
+    return f"{town_name}, "
+
+
+def load_streets(tree_file=TREE_FILE, locations_csv=LOCATIONS_CSV):
+    """
+    Street nodes of the Telecom location tree with their Telecom id and
+    settlement (the nearest town, district or region, so streets right under
+    'г.Алматы' get it too). Archived streets ('99АРХИВ_...') are left out.
+    """
+    streets = load_telecom_streets(tree_file=tree_file, locations_csv=locations_csv)
+    archived = streets["name"].str.lower().str.contains(ARCHIVE_RE, regex=True)
+    if archived.any():
+        logger.info(f"Skipping {int(archived.sum())} archived streets")
+    streets = streets[~archived]
+    town = streets[SETTLEMENT_LEVELS[0]]
+    for level in SETTLEMENT_LEVELS[1:]:
+        town = town.where(town != "", streets[level])
+    return pd.DataFrame({
+        "street_id": streets["street_id"].to_numpy(),
+        "street_name": streets["name"].to_numpy(),
+        "town": town.to_numpy(),
+    })
+
+
+def check_street(street):
+    """
+    Houses of one street with their FTTH availability, as AddressRecords, plus
+    the number of houses whose check failed. Those are left out (not written as
+    unavailable) and keep the street from being marked done, so the next run
+    checks it again (up to MAX_STREET_ATTEMPTS runs). A failed houses request raises.
+    """
+    try:
+        houses = parse_houses(fetch_json(HOUSES_URL.format(street_id=street["street_id"])))
+    except ValueError as e:
+        metrics.incr("errors")
+        raise FetchError(f"street {street['street_id']}: {e}") from e
+    records = []
+    failed = 0
+    for house_id, house, sub_house in houses:
+        try:
+            availability = fetch_json(AVAILABILITY_URL.format(house_id=house_id))
+            if availability is None:
+                raise ValueError("empty or missing technical check")
+            is_available = parse_availability(availability)
+        except (FetchError, ValueError) as e:
+            metrics.incr("failed_checks")
+            logger.debug(f"House {house_id} skipped: {e}")
+            failed += 1
+            continue
+        records.append(AddressRecord(
+            street_id=street["street_id"],
+            street_name=street["street_name"],
+            house=house,
+            sub_house=sub_house,
+            is_available=is_available,
+            full_address=f"{city_prefix(street['town'])}{street['street_name']}, {house}{sub_house}",
+            provider="telecom",
+        ))
+    return records, failed
+
+
+def _read_street_ids(path):
+    """First field of every line as int (done lines carry ',<failed checks>' after it)"""
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [int(line.split(",")[0]) for line in f if line.strip()]
+
+
+def _write_batch(batch, done, incomplete):
+    """
+    Write one batch file, then record the streets: done ones as "street_id,failed"
+    (failed > 0 once a street used up its MAX_STREET_ATTEMPTS) and one attempt
+    per incomplete one. The rows go first, so a
+    crash never loses them; merge_batches drops the rows written twice.
+    """
+    existing = [f for f in os.listdir(PARTIAL_DIR) if f.startswith("batch_") and f.endswith(".csv")]
+    path = os.path.join(PARTIAL_DIR, f"batch_{len(existing):05d}.csv")
+    batch.to_frame().to_csv(f"{path}.tmp", index=False)
+    os.replace(f"{path}.tmp", path)
+    with open(DONE_FILE, "a", encoding="utf-8") as f:
+        f.writelines(f"{street_id},{failed}\n" for street_id, failed in done)
+    with open(ATTEMPTS_FILE, "a", encoding="utf-8") as f:
+        f.writelines(f"{street_id}\n" for street_id in incomplete)
+
+
+def crawl(streets, workers=MAX_WORKERS, batch_streets=BATCH_STREETS, max_attempts=MAX_STREET_ATTEMPTS):
+    """
+    Check every street not finished by an earlier run. Streets run concurrently
+    in a thread pool (requests are spaced by the shared rate limiter) and
+    finished streets are flushed to a batch file every batch_streets streets.
+    A street that still has failed house checks after max_attempts runs is
+    marked done with its failure count instead of being re-crawled forever;
+    a street whose house list fails to load is retried without a limit.
+    """
+    os.makedirs(PARTIAL_DIR, exist_ok=True)
+    done = set(_read_street_ids(DONE_FILE))
+    attempts = pd.Series(_read_street_ids(ATTEMPTS_FILE), dtype=np.int64).value_counts().to_dict()
+    pending = streets[~streets["street_id"].isin(done)]
+    logger.info(f"{len(streets)} streets, {len(done)} already done, {len(pending)} to check")
+
+    batch = RecordTable(AddressRecord)
+    batch_done, batch_incomplete = [], []
+    batch_streets_seen = 0
+    incomplete = gave_up = 0
+    with metrics.stage("crawl") as stage, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(check_street, street): street["street_id"] for street in pending.to_dict("records")}
+        for n, future in enumerate(as_completed(futures), 1):
+            street_id = futures[future]
+            last_attempt = attempts.get(street_id, 0) + 1 >= max_attempts
+            try:
+                records, failed = future.result()
+            except Exception as e:
+                metrics.incr("failed_streets")
+                logger.error(f"Street {street_id} failed: {e}")
+                continue  # house list not loaded: not an attempt, the next run retries it
+            batch.extend(records)
+            batch_streets_seen += 1
+            if not failed:
+                batch_done.append((street_id, 0))
+            elif last_attempt:
+                gave_up += 1
+                metrics.incr("abandoned_streets")
+                logger.warning(f"Street {street_id}: still failing after {max_attempts} runs, marked done (failed={failed})")
+                batch_done.append((street_id, failed))
+            else:
+                incomplete += 1
+                logger.warning(f"Street {street_id}: {failed} house checks failed, it will be retried")
+                batch_incomplete.append(street_id)
+            stage.add_rows(len(records))
+            if batch_streets_seen >= batch_streets:
+                _write_batch(batch, batch_done, batch_incomplete)
+                batch, batch_done, batch_incomplete, batch_streets_seen = RecordTable(AddressRecord), [], [], 0
+            if n % 100 == 0:
+                logger.info(f"Checked {n}/{len(pending)} streets")
+        if batch_streets_seen:
+            _write_batch(batch, batch_done, batch_incomplete)
+    if incomplete:
+        logger.warning(f"{incomplete} streets had failures and are not marked done, the next run retries them")
+    if gave_up:
+        logger.warning(f"{gave_up} streets were given up on; their failure counts are in {DONE_FILE}")
+
+
+def merge_batches():
+    """All batch files as one frame in the Beeline result schema (a re-checked house keeps its latest row)"""
+    files = sorted(f for f in os.listdir(PARTIAL_DIR) if f.startswith("batch_") and f.endswith(".csv"))
+    frames = [pd.read_csv(os.path.join(PARTIAL_DIR, f), dtype={"house": "string"}, converters=ADDRESS_CSV_CONVERTERS) for f in files]
+    if not frames:
+        return pd.DataFrame(columns=list(AddressRecord.SCHEMA))
+    return pd.concat(frames, ignore_index=True).drop_duplicates(["street_id", "house", "sub_house"], keep="last")
+
+
+def geocode_results(df):
+    """
+    Coordinates for the crawled houses through the Beeline planner and 2GIS client.
+    Addresses already geocoded in a previous OUTPUT_CSV are reused.
+    """
+    from beeline_geocoding_script import extract_geocode_data, rate_limited_geocode
+    from geocode_planner import GeocodePlanner, plan_geocoding
+
+    # Requests go into this crawler's metrics; towns all over the country are geocoded,
+    # so the Almaty bounding box is not used to rank the results
+    lookup = partial(rate_limited_geocode, run_metrics=metrics)
+    extract = partial(extract_geocode_data, bbox=None)
+
+    # Plan on the "<city> г., <street>" prefix so parents are grouped per city street
+    prefix = df["full_address"].str.rsplit(", ", n=1).str[0]
+    plan = plan_geocoding(
+        df.assign(street_name=prefix),
+        lambda street, house, sub_house=None: f"{street}, {house}{sub_house or ''}",
+    )
+    plan["street_name"] = df["street_name"]
+
+    planner = GeocodePlanner(lookup, extract, metrics)
+    if os.path.exists(OUTPUT_CSV):
+        planner.seed(RecordTable.from_frame(AddressRecord, pd.read_csv(OUTPUT_CSV, converters=ADDRESS_CSV_CONVERTERS)))
+
+    results = RecordTable(AddressRecord, capacity=max(len(plan), 1))
+    with metrics.stage("geocode") as stage:
+        for _, row in plan.iterrows():
+            record = AddressRecord.from_dict(row)
+            data = planner.resolve(row)
+            if data:
+                record.gis_full_name = data.get("gis_full_name")
+                record.latitude = data.get("latitude")
+                record.longitude = data.get("longitude")
+            else:
+                metrics.incr("not_geocoded")
+            results.append(record)
+            stage.add_rows()
+    return results.to_frame()
+
+
+def main():
+    setup_logging()
+    if len(sys.argv) > 1 and sys.argv[1] == "check-fixture":
+        check_fixture()
+        return
+    if not HOUSES_URL or not AVAILABILITY_URL:
+        logger.error("Set TELECOM_HOUSES_URL and TELECOM_AVAILABILITY_URL to the technical-check endpoints")
+        return
+    metrics.start()
+    try:
+        with metrics.stage("load_streets") as stage:
+            streets = load_streets()
+            stage.add_rows(len(streets))
+        crawl(streets)
+        with metrics.stage("merge") as stage:
+            results = merge_batches()
+            results.to_csv(RAW_CSV, index=False)
+            stage.add_rows(len(results))
+        logger.info(f"{len(results)} houses ({int(results['is_available'].sum())} with FTTH) saved to {RAW_CSV}")
+        if GEOCODE and os.getenv("GIS_API_KEY"):
+            results = geocode_results(results)
+        elif GEOCODE:
+            logger.warning("GIS_API_KEY is not set, saving the houses without coordinates")
+        with metrics.stage("save") as stage:
+            results.to_csv(OUTPUT_CSV, index=False)
+            stage.add_rows(len(results))
+        logger.info(f"Saved {len(results)} Telecom addresses to {OUTPUT_CSV}")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from address_records import LocationRecord
+
+logger = logging.getLogger("location_tree")
+metrics = RunMetrics("location_tree")
+
+# Configuration
+LOCATIONS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telecom_locations.csv")
+TREE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "telecom_locations.tree")
+TYPES = ("region", "district", "town", "street")
+PATH_SEPARATOR = " > "
+ADDRESS_SEPARATOR = ", "
+
+# Coordinates are float32 (about 1 m at these longitudes), which is plenty for the map
+# File layout: MAGIC, one int64 byte length per section, then the sections in this order (8-byte aligned)
+MAGIC = b"LOCTREE1"
+SECTIONS = (
+    ("ids", np.int32),
+    ("parent", np.int32),
+    ("types", np.int8),
+    ("name_codes", np.int32),
+    ("original_ids", np.int32),
+    ("coord_x", np.float32),
+    ("coord_y", np.float32),
+    ("subtree_end", np.int32),
+    ("child_ptr", np.int32),
+    ("child_idx", np.int32),
+    ("name_offsets", np.int64),
+    ("name_blob", np.uint8),
+)
+
+
+def _preorder(parent):
+    """Depth-first preorder of the nodes (children in input order)"""
+    n = len(parent)
+    child_ptr, child_idx = _children(parent)
+    order = np.empty(n, dtype=np.int64)
+    roots = np.flatnonzero(parent < 0)
+    stack = list(roots[::-1])
+    k = 0
+    while stack:
+        node = stack.pop()
+        order[k] = node
+        k += 1
+        stack.extend(child_idx[child_ptr[node]:child_ptr[node + 1]][::-1].tolist())
+    if k != n:
+        raise ValueError(f"{n - k} locations are not reachable from a region (dangling parent_id or a cycle)")
+    return order
+
+
+def _children(parent):
+    """CSR children arrays: children of i are child_idx[child_ptr[i]:child_ptr[i + 1]]"""
+    n = len(parent)
+    has_parent = parent >= 0
+    child_idx = np.flatnonzero(has_parent)
+    child_idx = child_idx[np.argsort(parent[has_parent], kind="stable")].astype(np.int32)
+    counts = np.bincount(parent[has_parent], minlength=n)
+    child_ptr = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(counts, out=child_ptr[1:])
+    return child_ptr, child_idx
+
+
+class LocationTree:
+    """
+    The Telecom location hierarchy as flat arrays.
+
+    Nodes are stored in depth-first preorder, so a node's subtree is the
+    contiguous index range [i, subtree_end[i]). parent holds the parent index
+    (-1 for regions), child_ptr / child_idx the children in CSR form, and
+    names are interned into one UTF-8 blob addressed by name_offsets. Paths
+    and full addresses are never stored; path() / full_address() build them
+    from the ancestors on demand.
+    """
+
+    def __init__(self, arrays, source=None):
+        for name, _ in SECTIONS:
+            setattr(self, name, arrays[name])
+        self.source = source
+        self._names = {}
+        self._id_order = np.argsort(self.ids, kind="stable")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, parent_ids, types, names, original_ids=None, coord_x=None, coord_y=None):
+        """Build from parallel columns (parent_ids refer to ids; missing parent = region)"""
+        ids = np.asarray(ids, dtype=np.int64)
+        n = len(ids)
+        parent_ids = pd.to_numeric(pd.Series(parent_ids), errors="coerce").to_numpy(dtype=np.float64)
+
+        # parent id -> parent index
+        id_order = np.argsort(ids, kind="stable")
+        has_parent = ~np.isnan(parent_ids)
+        parent = np.full(n, -1, dtype=np.int64)
+        wanted = parent_ids[has_parent].astype(np.int64)
+        pos = np.minimum(np.searchsorted(ids, wanted, sorter=id_order), n - 1)
+        found = ids[id_order[pos]] == wanted
+        if not found.all():
+            raise ValueError(f"{int((~found).sum())} locations have an unknown parent_id")
+        parent[has_parent] = id_order[pos]
+
+        # Reorder everything into preorder and remap parent indices
+        order = _preorder(parent)
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n)
+        parent = np.where(parent[order] >= 0, rank[np.maximum(parent[order], 0)], -1).astype(np.int32)
+
+        type_codes, type_names = pd.factorize(pd.Series(types, dtype=object))
+        type_lookup = np.array([TYPES.index(t) if t in TYPES else -1 for t in type_names], dtype=np.int8)
+        name_codes, name_values = pd.factorize(pd.Series(names, dtype=object).fillna(""))
+        encoded = [str(value).encode("utf-8") for value in name_values]
+        name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=name_offsets[1:])
+
+        # Subtree end of i = i + size of its subtree; sizes accumulate bottom-up in reverse preorder
+        sizes = np.ones(n, dtype=np.int64)
+        for i in range(n - 1, 0, -1):
+            if parent[i] >= 0:
+                sizes[parent[i]] += sizes[i]
+        child_ptr, child_idx = _children(parent)
+
+        def column(values, dtype, fill):
+            if values is None:
+                return np.full(n, fill, dtype=dtype)
+            values = pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=np.float64)[order]
+            return np.where(np.isnan(values), fill, values).astype(dtype)
+
+        arrays = {
+            "ids": ids[order].astype(np.int32),
+            "parent": parent,
+            "types": type_lookup[type_codes[order]],
+            "name_codes": name_codes[order].astype(np.int32),
+            "original_ids": column(original_ids, np.int32, -1),
+            "coord_x": column(coord_x, np.float32, np.nan),
+            "coord_y": column(coord_y, np.float32, np.nan),
+            "subtree_end": (np.arange(n) + sizes).astype(np.int32),
+            "child_ptr": child_ptr,
+            "child_idx": child_idx,
+            "name_offsets": name_offsets,
+            "name_blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        }
+        return cls(arrays)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Build from the flat telecom_locations.csv columns"""
+        return cls.build(
+            df["id"], df["parent_id"], df["type"], df["name"],
+            df.get("original_id"), df.get("coordX"), df.get("coordY"),
+        )
+
+    @classmethod
+    def from_records(cls, records):
+        """Build from LocationRecords (or a RecordTable of them)"""
+        if hasattr(records, "to_frame"):
+            return cls.from_frame(records.to_frame())
+        return cls.from_frame(pd.DataFrame([record.as_dict() for record in records], columns=list(LocationRecord.SCHEMA)))
+
+    # Lookups
+
+    def index_of(self, location_id):
+        """Node index of a location id (KeyError if unknown)"""
+        pos = np.searchsorted(self.ids, location_id, sorter=self._id_order)
+        if pos >= len(self.ids) or self.ids[self._id_order[pos]] != location_id:
+            raise KeyError(location_id)
+        return int(self._id_order[pos])
+
+    def name(self, i):
+        code = int(self.name_codes[i])
+        value = self._names.get(code)
+        if value is None:
+            start, end = self.name_offsets[code], self.name_offsets[code + 1]
+            value = self._names[code] = self.name_blob[start:end].tobytes().decode("utf-8")
+        return value
+
+    def type(self, i):
+        code = int(self.types[i])
+        return TYPES[code] if code >= 0 else None
+
+    def ancestors(self, i, include_self=False):
+        """Indices from the region down to the parent of i (or to i itself)"""
+        chain = [i] if include_self else []
+        node = int(self.parent[i])
+        while node >= 0:
+            chain.append(node)
+            node = int(self.parent[node])
+        return chain[::-1]
+
+    def path(self, i, separator=PATH_SEPARATOR):
+        return separator.join(self.name(node) for node in self.ancestors(i, include_self=True))
+
+    def full_address(self, i):
+        return self.path(i, ADDRESS_SEPARATOR)
+
+    def children(self, i):
+        return self.child_idx[self.child_ptr[i]:self.child_ptr[i + 1]]
+
+    def subtree(self, i):
+        """Index range of i and all its descendants (preorder makes it contiguous)"""
+        return np.arange(i, self.subtree_end[i])
+
+    def subtree_size(self, i):
+        return int(self.subtree_end[i] - i)
+
+    def depth(self):
+        """Depth of every node (regions are 0), computed in one preorder pass"""
+        depth = np.zeros(len(self), dtype=np.int32)
+        for i in range(1, len(self)):
+            if self.parent[i] >= 0:
+                depth[i] = depth[self.parent[i]] + 1
+        return depth
+
+    def find(self, name, type=None):
+        """Indices of the nodes with this exact name (optionally of one type)"""
+        encoded = name.encode("utf-8")
+        lengths = np.diff(self.name_offsets)
+        for code in np.flatnonzero(lengths == len(encoded)):
+            start = self.name_offsets[code]
+            if self.name_blob[start:start + len(encoded)].tobytes() == encoded:
+                nodes = np.flatnonzero(self.name_codes == code)
+                if type is not None:
+                    nodes = nodes[self.types[nodes] == TYPES.index(type)]
+                return nodes
+        return np.zeros(0, dtype=np.int64)
+
+    def record(self, i):
+        parent = int(self.parent[i])
+        x, y = round(float(self.coord_x[i]), 6), round(float(self.coord_y[i]), 6)
+        return LocationRecord(
+            id=int(self.ids[i]),
+            parent_id=int(self.ids[parent]) if parent >= 0 else None,
+            type=self.type(i),
+            name=self.name(i),
+            original_id=int(self.original_ids[i]) if self.original_ids[i] >= 0 else None,
+            full_address=self.full_address(i),
+            coordX=None if np.isnan(x) else x,
+            coordY=None if np.isnan(y) else y,
+        )
+
+    def iter_subtree(self, i):
+        """LocationRecords of the subtree of i, materialized one at a time"""
+        for node in range(i, int(self.subtree_end[i])):
+            yield self.record(node)
+
+    # Exports of the old text formats, built from the arrays
+
+    def _paths(self, separator):
+        paths = [None] * len(self)
+        for i in range(len(self)):
+            parent = self.parent[i]
+            # Parents precede children in preorder, so their path is already built
+            paths[i] = self.name(i) if parent < 0 else f"{paths[parent]}{separator}{self.name(i)}"
+        return paths
+
+    def _parent_ids(self):
+        parent = np.asarray(self.parent)
+        return pd.arrays.IntegerArray(self.ids[np.maximum(parent, 0)].astype(np.int64), parent < 0)
+
+    def to_frame(self):
+        """The flat telecom_locations.csv table"""
+        return pd.DataFrame({
+            "id": np.asarray(self.ids),
+            "parent_id": self._parent_ids(),
+            "type": [self.type(i) for i in range(len(self))],
+            "name": [self.name(i) for i in range(len(self))],
+            "original_id": pd.arrays.IntegerArray(np.asarray(self.original_ids, dtype=np.int64), np.asarray(self.original_ids) < 0),
+            "full_address": self._paths(ADDRESS_SEPARATOR),
+            "coordX": np.asarray(self.coord_x, dtype=np.float64).round(6),
+            "coordY": np.asarray(self.coord_y, dtype=np.float64).round(6),
+        })
+
+    def hierarchy_frame(self):
+        """The telecom_locations_hierarchical.csv table (nodes in preorder with their path)"""
+        return pd.DataFrame({
+            "id": np.asarray(self.ids),
+            "original_id": np.asarray(self.original_ids),
+            "name": [self.name(i) for i in range(len(self))],
+            "path": self._paths(PATH_SEPARATOR),
+            "type": [self.type(i) for i in range(len(self))],
+            "parent_id": self._parent_ids(),
+        })
+
+    def tree_frame(self, indent="  "):
+        """The telecom_locations_tree.csv table (names indented by depth)"""
+        names = [self.name(i) for i in range(len(self))]
+        return pd.DataFrame({
+            "id": np.asarray(self.ids),
+            "parent_id": self._parent_ids(),
+            "type": [self.type(i) for i in range(len(self))],
+            "name": names,
+            "tree": [indent * depth + name for depth, name in zip(self.depth().tolist(), names)],
+            "path": self._paths(PATH_SEPARATOR),
+        })
+
+    # Binary file
+
+    def save(self, path=TREE_FILE):
+        arrays = [np.ascontiguousarray(getattr(self, name), dtype=dtype) for name, dtype in SECTIONS]
+        lengths = np.array([array.nbytes for array in arrays], dtype=np.int64)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(lengths.tobytes())
+            for array in arrays:
+                f.write(array.tobytes())
+                f.write(b"\0" * (-array.nbytes % 8))
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    @classmethod
+    def load(cls, path=TREE_FILE):
+        """Memory-map a saved tree; the arrays are read-only views into the file"""
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        if data[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError(f"{path} is not a location tree file")
+        offset = len(MAGIC) + 8 * len(SECTIONS)
+        lengths = np.frombuffer(data[len(MAGIC):offset].tobytes(), dtype=np.int64)
+        arrays = {}
+        for (name, dtype), nbytes in zip(SECTIONS, lengths):
+            arrays[name] = data[offset:offset + nbytes].view(dtype)
+            offset += int(nbytes) + (-int(nbytes) % 8)
+        return cls(arrays, source=path)
+
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("build") as stage:
+            locations = pd.read_csv(LOCATIONS_CSV)
+            tree = LocationTree.from_frame(locations)
+            stage.add_rows(len(tree))
+        with metrics.stage("save") as stage:
+            size = tree.save()
+            stage.add_rows(len(tree))
+        text_files = [f for f in os.listdir(os.path.dirname(TREE_FILE)) if f.startswith("telecom_locations") and f.endswith((".csv", ".json"))]
+        text_size = sum(os.path.getsize(os.path.join(os.path.dirname(TREE_FILE), f)) for f in text_files)
+        logger.info(f"{len(tree)} locations: {size / 1024:.0f} KiB tree file vs {text_size / 1024:.0f} KiB in {len(text_files)} text files")
+
+        # Subtree query: every street of the largest region
+        tree = LocationTree.load()
+        regions = np.flatnonzero(np.asarray(tree.parent) < 0)
+        region = max(regions, key=tree.subtree_size)
+        started = time.perf_counter()
+        nodes = tree.subtree(region)
+        streets = nodes[np.asarray(tree.types)[nodes] == TYPES.index("street")]
+        metrics.observe("subtree_query", time.perf_counter() - started)
+        logger.info(f"{tree.name(region)}: {len(streets)} streets in a {tree.subtree_size(region)}-node subtree")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
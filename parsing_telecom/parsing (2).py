@@ -2,9 +2,17 @@ import requests
 import json
 import os
 import time
+import logging
+import sys
 import pandas as pd
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+
+logger = logging.getLogger("telecom_locations_tree")
+metrics = RunMetrics("telecom_locations_tree")
+
 # Load environment variables from .env file (optional)
 load_dotenv()
 
@@ -21,20 +29,26 @@ def fetch_json(url, params=None):
             "Referer": "https://telecom.kz/ru/technical-check",
             "Origin": "https://telecom.kz"
         }
-        response = requests.get(url, params=params, headers=headers)
+        metrics.incr("requests")
+        with metrics.timed("telecom_request"):
+            response = requests.get(url, params=params, headers=headers)
+        if response.status_code == 429:
+            metrics.incr("rate_limited")
         response.raise_for_status()  # Raise exception for 4XX/5XX responses
         
         if response.content:
             return response.json()
         else:
-            print(f"Empty response from {url}")
+            logger.warning(f"Empty response from {url}")
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from {url}: {e}")
+        metrics.incr("errors")
+        logger.error(f"Error fetching data from {url}: {e}")
         return None
     except json.JSONDecodeError as e:
-        print(f"JSON decode error from {url}: {e}")
-        print(f"Response content: {response.content[:100]}")  # Print first 100 chars of response
+        metrics.incr("errors")
+        logger.error(f"JSON decode error from {url}: {e}")
+        logger.debug(f"Response content: {response.content[:100]}")  # First 100 chars of response
         return None
 
 def main():
@@ -45,19 +59,19 @@ def main():
     location_id = 1
     
     # Step 1: Fetch all regions
-    print("Fetching regions...")
+    logger.info("Fetching regions...")
     regions = fetch_json(REGIONS_URL)
     if not regions:
-        print("Failed to fetch regions")
+        logger.error("Failed to fetch regions")
         return
     
-    print(f"Found {len(regions)} regions")
+    logger.info(f"Found {len(regions)} regions")
     
     # Process each region
     for region in regions:
         region_id = region["id"]
         region_name = region["name"]
-        print(f"Processing region: {region_name} (ID: {region_id})")
+        logger.info(f"Processing region: {region_name} (ID: {region_id})")
         
         # Create region entry
         region_entry = {
@@ -73,20 +87,20 @@ def main():
         
         # Step 2: Get districts for this region
         districts_url = f"{TELECOM_BASE_URL}/locations/geo-state/{region_id}/geo-state-district"
-        print(f"  Fetching districts from: {districts_url}")
+        logger.debug(f"  Fetching districts from: {districts_url}")
         districts = fetch_json(districts_url)
         
         if not districts or len(districts) == 0:
-            print(f"  No districts found for region {region_name}")
+            logger.debug(f"  No districts found for region {region_name}")
             continue
         
-        print(f"  Found {len(districts)} districts")
+        logger.debug(f"  Found {len(districts)} districts")
         
         # Process each district
         for district in districts:
             district_id = district["id"]
             district_name = district["name"]
-            print(f"  Processing district: {district_name} (ID: {district_id})")
+            logger.debug(f"  Processing district: {district_name} (ID: {district_id})")
             
             # Create district entry
             district_entry = {
@@ -103,20 +117,20 @@ def main():
             # Step 3: Get towns for this district
             towns_url = f"{TELECOM_BASE_URL}/locations/town-states"
             towns_params = {"geoStateDistrictId": district_id}
-            print(f"    Fetching towns with params: {towns_params}")
+            logger.debug(f"    Fetching towns with params: {towns_params}")
             towns = fetch_json(towns_url, towns_params)
             
             if not towns or len(towns) == 0:
-                print(f"    No towns found for district {district_name}")
+                logger.debug(f"    No towns found for district {district_name}")
                 continue
             
-            print(f"    Found {len(towns)} towns")
+            logger.debug(f"    Found {len(towns)} towns")
             
             # Process each town
             for town in towns:
                 town_id = town["id"]
                 town_name = town["name"]
-                print(f"    Processing town: {town_name} (ID: {town_id})")
+                logger.debug(f"    Processing town: {town_name} (ID: {town_id})")
                 
                 # Create town entry
                 town_entry = {
@@ -132,14 +146,14 @@ def main():
                 
                 # Step 4: Get streets for this town
                 streets_url = f"{TELECOM_BASE_URL}/locations/town-states/{town_id}/streets"
-                print(f"      Fetching streets from: {streets_url}")
+                logger.debug(f"      Fetching streets from: {streets_url}")
                 streets = fetch_json(streets_url)
                 
                 if not streets or len(streets) == 0:
-                    print(f"      No streets found for town {town_name}")
+                    logger.debug(f"      No streets found for town {town_name}")
                     continue
                 
-                print(f"      Found {len(streets)} streets")
+                logger.debug(f"      Found {len(streets)} streets")
                 
                 # Process each street
                 for street in streets:
@@ -166,10 +180,10 @@ def main():
         # Add a small delay between region requests
         time.sleep(0.5)
     
-    print(f"Collected {len(all_locations)} locations.")
+    logger.info(f"Collected {len(all_locations)} locations.")
     
     # Save results to CSV
-    print("Saving data to files...")
+    logger.info("Saving data to files...")
     
     # Convert to DataFrame and save as CSV
     df = pd.DataFrame(all_locations)
@@ -214,9 +228,15 @@ def main():
     tree_df = pd.DataFrame(tree_data)
     tree_df.to_csv("telecom_locations_tree.csv", index=False, encoding="utf-8")
     
-    print(f"Saved {len(all_locations)} locations to:")
-    print("- telecom_locations.csv")
-    print("- telecom_locations_tree.csv")
+    logger.info(f"Saved {len(all_locations)} locations to:")
+    logger.info("- telecom_locations.csv")
+    logger.info("- telecom_locations_tree.csv")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("crawl"):
+            main()
+    finally:
+        metrics.write_report()
\ No newline at end of file
@@ -2,9 +2,19 @@ import requests
 import json
 import os
 import time
+import logging
+import sys
 import pandas as pd
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from address_records import LocationRecord, RecordTable
+from location_tree import TREE_FILE, LocationTree
+
+logger = logging.getLogger("telecom_locations")
+metrics = RunMetrics("telecom_locations")
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -12,6 +22,9 @@ load_dotenv()
 API_KEY = os.getenv("API_KEY")
 GEOCODE_API_URL = os.getenv("GEOCODE_API_URL", "https://geocode-api.example.com")
 
+# Output files (the binary tree goes to location_tree.TREE_FILE, where every reader looks for it)
+WRITE_TEXT_EXPORTS = os.getenv("TELECOM_TEXT_EXPORTS", "1") != "0"  # JSON / CSV copies of the tree
+
 # Telecom.kz API endpoints
 TELECOM_BASE_URL = "https://telecom.kz/ru/api/v1.0"
 REGIONS_URL = f"{TELECOM_BASE_URL}/locations/geo-states"
@@ -26,20 +39,26 @@ def fetch_json(url, params=None):
             "Referer": "https://telecom.kz/ru/technical-check",
             "Origin": "https://telecom.kz"
         }
-        response = requests.get(url, params=params, headers=headers)
+        metrics.incr("requests")
+        with metrics.timed("telecom_request"):
+            response = requests.get(url, params=params, headers=headers)
+        if response.status_code == 429:
+            metrics.incr("rate_limited")
         response.raise_for_status()  # Raise exception for 4XX/5XX responses
         
         if response.content:
             return response.json()
         else:
-            print(f"Empty response from {url}")
+            logger.warning(f"Empty response from {url}")
             return None
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching data from {url}: {e}")
+        metrics.incr("errors")
+        logger.error(f"Error fetching data from {url}: {e}")
         return None
     except json.JSONDecodeError as e:
-        print(f"JSON decode error from {url}: {e}")
-        print(f"Response content: {response.content[:100]}")  # Print first 100 chars of response
+        metrics.incr("errors")
+        logger.error(f"JSON decode error from {url}: {e}")
+        logger.debug(f"Response content: {response.content[:100]}")  # First 100 chars of response
         return None
 
 def get_coordinates(address):
@@ -51,75 +70,83 @@ def get_coordinates(address):
             "fields": "items.point",
             "key": API_KEY
         }
-        response = requests.get(url, params=params)
+        metrics.incr("requests")
+        with metrics.timed("geocode_request"):
+            response = requests.get(url, params=params)
+        if response.status_code == 429:
+            metrics.incr("rate_limited")
         response.raise_for_status()
         data = response.json()
         return data
     except requests.exceptions.RequestException as e:
-        print(f"Error getting coordinates for {address}: {e}")
+        metrics.incr("errors")
+        # Request exceptions embed the URL with the API key, so only log the status
+        status = e.response.status_code if getattr(e, 'response', None) is not None else type(e).__name__
+        logger.error(f"Error getting coordinates for {address}: {status}")
         return None
 
-def main():
-    # Create a list to store all location data
-    all_locations = []
+def crawl_locations():
+    """Walk regions -> districts -> towns -> streets and return flat location entries"""
+    # Store all location data column-wise (names and addresses interned once)
+    all_locations = RecordTable(LocationRecord)
     
     # Track IDs for hierarchical structure
     location_id = 1
     
     # Step 1: Fetch all regions
-    print("Fetching regions...")
+    logger.info("Fetching regions...")
     regions = fetch_json(REGIONS_URL)
     if not regions:
-        print("Failed to fetch regions")
-        return
+        logger.error("Failed to fetch regions")
+        return all_locations
     
-    print(f"Found {len(regions)} regions")
+    logger.info(f"Found {len(regions)} regions")
     
     # Process each region
     for region in regions:
         region_id = region["id"]
         region_name = region["name"]
-        print(f"Processing region: {region_name} (ID: {region_id})")
+        logger.info(f"Processing region: {region_name} (ID: {region_id})")
         
         # Create region entry
-        region_entry = {
-            "id": location_id,
-            "parent_id": None,
-            "type": "region",
-            "name": region_name,
-            "original_id": region_id,
-            "full_address": region_name
-        }
+        region_entry = LocationRecord(
+            id=location_id,
+            parent_id=None,
+            type="region",
+            name=region_name,
+            original_id=region_id,
+            full_address=region_name
+        )
         all_locations.append(region_entry)
         region_location_id = location_id
         location_id += 1
         
         # Step 2: Get districts for this region
         districts_url = f"{TELECOM_BASE_URL}/locations/geo-state/{region_id}/geo-state-district"
-        print(f"  Fetching districts from: {districts_url}")
+        logger.debug(f"  Fetching districts from: {districts_url}")
         districts = fetch_json(districts_url)
         
         if not districts or len(districts) == 0:
-            print(f"  No districts found for region {region_name}")
+            logger.info(f"  No districts found for region {region_name}")
             continue
         
-        print(f"  Found {len(districts)} districts")
+        logger.info(f"  Found {len(districts)} districts")
         
         # Process each district
         for district in districts:
             district_id = district["id"]
             district_name = district["name"]
-            print(f"  Processing district: {district_name} (ID: {district_id})")
+            logger.debug(f"  Processing district: {district_name} (ID: {district_id})")
             
             # Create district entry
-            district_entry = {
-                "id": location_id,
-                "parent_id": region_location_id,
-                "type": "district", 
-                "name": district_name,
-                "original_id": district_id,
-                "full_address": f"{region_name}, {district_name}"
-            }
+            district_entry = LocationRecord(
+                id=location_id,
+                parent_id=region_location_id,
+                type="district",
+                name=district_name,
+                original_id=district_id,
+                full_address=f"{region_name}, {district_name}"
+            )
             all_locations.append(district_entry)
             district_location_id = location_id
             location_id += 1
@@ -127,44 +154,44 @@ def main():
             # Step 3: Get towns for this district
             towns_url = f"{TELECOM_BASE_URL}/locations/town-states"
             towns_params = {"geoStateDistrictId": district_id}
-            print(f"    Fetching towns with params: {towns_params}")
+            logger.debug(f"    Fetching towns with params: {towns_params}")
             towns = fetch_json(towns_url, towns_params)
             
             if not towns or len(towns) == 0:
-                print(f"    No towns found for district {district_name}")
+                logger.debug(f"    No towns found for district {district_name}")
                 continue
             
-            print(f"    Found {len(towns)} towns")
+            logger.debug(f"    Found {len(towns)} towns")
             
             # Process each town
             for town in towns:
                 town_id = town["id"]
                 town_name = town["name"]
-                print(f"    Processing town: {town_name} (ID: {town_id})")
+                logger.debug(f"    Processing town: {town_name} (ID: {town_id})")
                 
                 # Create town entry
-                town_entry = {
-                    "id": location_id,
-                    "parent_id": district_location_id,
-                    "type": "town",
-                    "name": town_name,
-                    "original_id": town_id,
-                    "full_address": f"{region_name}, {district_name}, {town_name}"
-                }
+                town_entry = LocationRecord(
+                    id=location_id,
+                    parent_id=district_location_id,
+                    type="town",
+                    name=town_name,
+                    original_id=town_id,
+                    full_address=f"{region_name}, {district_name}, {town_name}"
+                )
                 all_locations.append(town_entry)
                 town_location_id = location_id
                 location_id += 1
                 
                 # Step 4: Get streets for this town
                 streets_url = f"{TELECOM_BASE_URL}/locations/town-states/{town_id}/streets"
-                print(f"      Fetching streets from: {streets_url}")
+                logger.debug(f"      Fetching streets from: {streets_url}")
                 streets = fetch_json(streets_url)
                 
                 if not streets or len(streets) == 0:
-                    print(f"      No streets found for town {town_name}")
+                    logger.debug(f"      No streets found for town {town_name}")
                     continue
                 
-                print(f"      Found {len(streets)} streets")
+                logger.debug(f"      Found {len(streets)} streets")
                 
                 # Process each street
                 for street in streets:
@@ -172,14 +199,14 @@ def main():
                     street_name = street.get("name", "")
                     if street_name:
                         # Create street entry
-                        street_entry = {
-                            "id": location_id,
-                            "parent_id": town_location_id,
-                            "type": "street",
-                            "name": street_name,
-                            "original_id": street_id,
-                            "full_address": f"{region_name}, {district_name}, {town_name}, {street_name}"
-                        }
+                        street_entry = LocationRecord(
+                            id=location_id,
+                            parent_id=town_location_id,
+                            type="street",
+                            name=street_name,
+                            original_id=street_id,
+                            full_address=f"{region_name}, {district_name}, {town_name}, {street_name}"
+                        )
                         all_locations.append(street_entry)
                         location_id += 1
                 
@@ -192,116 +219,77 @@ def main():
         # Add a small delay between region requests
         time.sleep(0.5)
     
-    print(f"Collected {len(all_locations)} locations.")
-    
-    # Optional: Get coordinates for locations
-    if API_KEY and GEOCODE_API_URL != "https://geocode-api.example.com":
-        print("Getting coordinates...")
-        for i, location in enumerate(all_locations):
-            if i % 10 == 0:
-                print(f"Processing coordinates for location {i+1}/{len(all_locations)}")
-                
-            coords = get_coordinates(location["full_address"])
-            if coords and "items" in coords and len(coords["items"]) > 0:
-                point = coords["items"][0].get("point", {})
-                location["coordX"] = point.get("lon")
-                location["coordY"] = point.get("lat")
-            else:
-                location["coordX"] = None
-                location["coordY"] = None
+    logger.info(f"Collected {len(all_locations)} locations.")
+    return all_locations
+
+def add_coordinates(all_locations):
+    """Geocode every location in place (coordX/coordY); returns how many were looked up"""
+    if not API_KEY or GEOCODE_API_URL == "https://geocode-api.example.com":
+        logger.info("Geocoding skipped: no API key or geocoding endpoint configured")
+        return 0
+    logger.info("Getting coordinates...")
+    coord_x = all_locations.column("coordX")
+    coord_y = all_locations.column("coordY")
+    for i, full_address in enumerate(all_locations.values("full_address")):
+        if i % 100 == 0:
+            logger.info(f"Processing coordinates for location {i+1}/{len(all_locations)}")
             
-            # Add a small delay between geocoding requests
-            time.sleep(0.3)
+        coords = get_coordinates(full_address)
+        if coords and "items" in coords and len(coords["items"]) > 0:
+            point = coords["items"][0].get("point", {})
+            coord_x[i] = point.get("lon") if point.get("lon") is not None else float("nan")
+            coord_y[i] = point.get("lat") if point.get("lat") is not None else float("nan")
+        
+        # Add a small delay between geocoding requests
+        time.sleep(0.3)
+    return len(all_locations)
+
+def save_locations(all_locations, tree_file=TREE_FILE):
+    """Save locations as the binary location tree, plus JSON, flat CSV and hierarchical CSV"""
+    logger.info("Saving data to files...")
     
-    # Save results to JSON and CSV files
-    print("Saving data to files...")
+    # Compact array-backed tree (paths are rebuilt from it on demand)
+    tree = LocationTree.from_records(all_locations)
+    tree_size = tree.save(tree_file)
+    logger.info(f"Saved {len(tree)} locations to {tree_file} ({tree_size / 1024:.0f} KiB)")
+    if not WRITE_TEXT_EXPORTS:
+        return
     
     # Save as JSON
-    with open("telecom_locations.json", "w", encoding="utf-8") as f:
-        json.dump(all_locations, f, ensure_ascii=False, indent=2)
+    all_locations.write_json("telecom_locations.json")
     
     # Convert to DataFrame and save as CSV
-    df = pd.DataFrame(all_locations)
+    df = all_locations.to_frame()
     df.to_csv("telecom_locations.csv", index=False, encoding="utf-8")
     
-    # Create a hierarchical representation
-    # Prepare data in a format that shows the hierarchy clearly
-    hierarchy_data = []
-    
-    # First, organize by parent-child relationships
-    locations_by_id = {loc["id"]: loc for loc in all_locations}
-    children_by_parent = {}
-    
-    for loc in all_locations:
-        parent_id = loc["parent_id"]
-        if parent_id not in children_by_parent:
-            children_by_parent[parent_id] = []
-        children_by_parent[parent_id].append(loc)
-    
-    # Create a hierarchical CSV with path information
-    hierarchy_rows = []
-    
-    # Start with root items (regions)
-    root_items = children_by_parent.get(None, [])
-    
-    for region in root_items:
-        region_row = {
-            "id": region["id"],
-            "original_id": region["original_id"],
-            "name": region["name"],
-            "path": region["name"],
-            "type": region["type"],
-            "parent_id": region["parent_id"]
-        }
-        hierarchy_rows.append(region_row)
-        
-        # Add districts
-        districts = children_by_parent.get(region["id"], [])
-        for district in districts:
-            district_row = {
-                "id": district["id"],
-                "original_id": district["original_id"],
-                "name": district["name"],
-                "path": f"{region['name']} > {district['name']}",
-                "type": district["type"],
-                "parent_id": district["parent_id"]
-            }
-            hierarchy_rows.append(district_row)
-            
-            # Add towns
-            towns = children_by_parent.get(district["id"], [])
-            for town in towns:
-                town_row = {
-                    "id": town["id"],
-                    "original_id": town["original_id"],
-                    "name": town["name"],
-                    "path": f"{region['name']} > {district['name']} > {town['name']}",
-                    "type": town["type"],
-                    "parent_id": town["parent_id"]
-                }
-                hierarchy_rows.append(town_row)
-                
-                # Add streets
-                streets = children_by_parent.get(town["id"], [])
-                for street in streets:
-                    street_row = {
-                        "id": street["id"],
-                        "original_id": street["original_id"],
-                        "name": street["name"],
-                        "path": f"{region['name']} > {district['name']} > {town['name']} > {street['name']}",
-                        "type": street["type"],
-                        "parent_id": street["parent_id"]
-                    }
-                    hierarchy_rows.append(street_row)
-    
-    # Save hierarchical data
-    hierarchy_df = pd.DataFrame(hierarchy_rows)
+    # Hierarchical CSV with path information, materialized from the tree
+    hierarchy_df = tree.hierarchy_frame()
     hierarchy_df.to_csv("telecom_locations_hierarchical.csv", index=False, encoding="utf-8")
     
-    print(f"Saved {len(all_locations)} locations to:")
-    print("- telecom_locations.json")
-    print("- telecom_locations.csv")
-    print("- telecom_locations_hierarchical.csv")
+    logger.info(f"Saved {len(all_locations)} locations to:")
+    logger.info("- telecom_locations.json")
+    logger.info("- telecom_locations.csv")
+    logger.info("- telecom_locations_hierarchical.csv")
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("crawl") as stage:
+            all_locations = crawl_locations()
+            stage.add_rows(len(all_locations))
+        if not all_locations:
+            return
+        
+        # Optional: Get coordinates for locations
+        with metrics.stage("geocode") as stage:
+            stage.add_rows(add_coordinates(all_locations))
+        
+        with metrics.stage("save") as stage:
+            save_locations(all_locations)
+            stage.add_rows(len(all_locations))
+    finally:
+        metrics.write_report()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,189 @@
+import io
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_metrics import RunMetrics, setup_logging
+from feedback_analytics import FEEDBACK_CSV
+
+logger = logging.getLogger("rating_rollups")
+metrics = RunMetrics("rating_rollups")
+
+# Configuration
+STORE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rating_rollups.npz")
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rating_rollups")
+GRAINS = ("daily", "weekly", "monthly")
+MAX_STARS = 5
+
+
+def period_keys(days, grain):
+    """Integer period key of every epoch day: the day, the Monday of its week, or the month since 1970-01"""
+    days = np.asarray(days, dtype=np.int64)
+    if grain == "daily":
+        return days
+    if grain == "weekly":
+        return days - (days + 3) % 7  # 1970-01-01 was a Thursday
+    if grain == "monthly":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    raise ValueError(f"Unknown grain: {grain}")
+
+
+def period_labels(keys, grain):
+    keys = np.asarray(keys, dtype=np.int64)
+    if grain == "monthly":
+        return keys.astype("datetime64[M]").astype("datetime64[D]")
+    return keys.astype("datetime64[D]")
+
+
+def parse_dates(values):
+    """dd.mm.yyyy strings to epoch days (-1 for unparseable dates)"""
+    parsed = pd.to_datetime(pd.Series(values, dtype="string"), format="%d.%m.%Y", errors="coerce")
+    days = parsed.to_numpy(dtype="datetime64[D]").astype(np.int64)
+    return np.where(parsed.isna().to_numpy(), -1, days)
+
+
+class RatingRollups:
+    """
+    Star-rating histograms per day, week and month.
+
+    Every grain is a sorted array of period keys with a (periods x 6) count
+    matrix (column 0 holds reviews without a valid rating); count, sum and mean
+    are derived from the histogram. update() merges the histogram of a batch
+    into the stored arrays, so appending reviews never touches the old rows,
+    and the byte offset of the source CSV is kept to read only what was appended.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Drop every rollup and start reading the source from the beginning"""
+        self.keys = {grain: np.zeros(0, dtype=np.int64) for grain in GRAINS}
+        self.histograms = {grain: np.zeros((0, MAX_STARS + 1), dtype=np.int64) for grain in GRAINS}
+        self.source_offset = 0
+        self.rows = 0
+        self.skipped = 0
+
+    def update(self, days, stars):
+        """Add reviews given as epoch days and star ratings; returns the rows added"""
+        days = np.asarray(days, dtype=np.int64)
+        stars = np.asarray(stars, dtype=np.int64)
+        valid = days >= 0
+        self.skipped += int((~valid).sum())
+        days, stars = days[valid], np.where((stars >= 1) & (stars <= MAX_STARS), stars, 0)[valid]
+        for grain in GRAINS:
+            batch_keys, inverse = np.unique(period_keys(days, grain), return_inverse=True)
+            batch = np.bincount(inverse * (MAX_STARS + 1) + stars, minlength=len(batch_keys) * (MAX_STARS + 1))
+            batch = batch.reshape(len(batch_keys), MAX_STARS + 1)
+
+            merged_keys = np.union1d(self.keys[grain], batch_keys)
+            merged = np.zeros((len(merged_keys), MAX_STARS + 1), dtype=np.int64)
+            merged[np.searchsorted(merged_keys, self.keys[grain])] = self.histograms[grain]
+            merged[np.searchsorted(merged_keys, batch_keys)] += batch
+            self.keys[grain], self.histograms[grain] = merged_keys, merged
+        self.rows += len(days)
+        return len(days)
+
+    def update_frame(self, reviews):
+        """Add a frame with the raw `date` (dd.mm.yyyy) and `star_count` columns"""
+        stars = pd.to_numeric(reviews["star_count"], errors="coerce").fillna(0).to_numpy()
+        return self.update(parse_dates(reviews["date"]), stars.astype(np.int64))
+
+    def update_from_csv(self, path=FEEDBACK_CSV):
+        """
+        Add the reviews appended to the CSV since the last call. Only the bytes
+        after the stored offset are parsed, up to the last complete record: a
+        line still being written is picked up by the next call. A file that
+        shrank was rewritten, so the rollups are rebuilt from scratch.
+        """
+        size = os.path.getsize(path)
+        if size < self.source_offset:
+            logger.info(f"{path} is smaller than the processed offset, rebuilding rollups")
+            self.reset()
+        if size == self.source_offset:
+            return 0
+
+        with open(path, "rb") as f:
+            f.seek(self.source_offset)
+            raw = f.read(size - self.source_offset)
+        # End of the last complete record: a newline outside quotes (comments may span lines)
+        data = np.frombuffer(raw, dtype=np.uint8)
+        outside_quotes = np.cumsum(data == ord('"')) % 2 == 0
+        record_ends = np.flatnonzero((data == ord("\n")) & outside_quotes)
+        if not len(record_ends):
+            return 0
+        raw = raw[:record_ends[-1] + 1]
+        text = raw.decode("utf-8-sig" if self.source_offset == 0 else "utf-8")
+        header = 0 if self.source_offset == 0 else None
+        reviews = pd.read_csv(io.StringIO(text), header=header, names=["date", "star_count", "comment"],
+                              usecols=["date", "star_count"], dtype={"date": "string"})
+        added = self.update_frame(reviews)
+        self.source_offset += len(raw)
+        return added
+
+    def series(self, grain="weekly"):
+        """Precomputed time series of one grain: count, sum, mean and star histogram per period"""
+        histogram = self.histograms[grain]
+        rated = histogram[:, 1:]
+        count = histogram.sum(axis=1)
+        total = rated @ np.arange(1, MAX_STARS + 1)
+        n_rated = rated.sum(axis=1)
+        result = pd.DataFrame({
+            "period": period_labels(self.keys[grain], grain),
+            "count": count,
+            "sum": total,
+            "mean_stars": np.round(total / np.where(n_rated > 0, n_rated, 1), 4),
+        })
+        for star in range(1, MAX_STARS + 1):
+            result[f"stars_{star}"] = histogram[:, star]
+        result["share_1_star"] = np.round(histogram[:, 1] / np.where(n_rated > 0, n_rated, 1), 4)
+        return result
+
+    def save(self, path=STORE_FILE):
+        arrays = {}
+        for grain in GRAINS:
+            arrays[f"{grain}_keys"] = self.keys[grain]
+            arrays[f"{grain}_histogram"] = self.histograms[grain]
+        state = np.array([self.source_offset, self.rows, self.skipped], dtype=np.int64)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, state=state, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=STORE_FILE):
+        rollups = cls()
+        if not os.path.exists(path):
+            return rollups
+        with np.load(path) as data:
+            for grain in GRAINS:
+                rollups.keys[grain] = data[f"{grain}_keys"]
+                rollups.histograms[grain] = data[f"{grain}_histogram"]
+            rollups.source_offset, rollups.rows, rollups.skipped = (int(value) for value in data["state"])
+        return rollups
+
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("update") as stage:
+            rollups = RatingRollups.load()
+            added = rollups.update_from_csv()
+            stage.add_rows(added)
+        logger.info(f"Added {added} reviews ({rollups.rows} total, {rollups.skipped} without a valid date)")
+        with metrics.stage("save") as stage:
+            rollups.save()
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            for grain in GRAINS:
+                series = rollups.series(grain)
+                series.to_csv(os.path.join(OUTPUT_DIR, f"rating_{grain}.csv"), index=False)
+                stage.add_rows(len(series))
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+import logging
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+from run_metrics import RunMetrics, setup_logging
+from location_tree import LOCATIONS_CSV, TREE_FILE, TYPES, LocationTree
+
+logger = logging.getLogger("spatial_join")
+metrics = RunMetrics("spatial_join")
+
+# Configuration
+INPUT_CSV = os.path.join(ROOT_DIR, "parsing_beeline", "combined_ftth_results.csv")
+OUTPUT_DIR = "coverage_by_location"
+JOIN_TYPES = ("town", "street")  # node types a house can be assigned to (the ones that get geocoded)
+ROLLUP_TYPES = ("district", "town")
+PROVIDERS = ("beeline", "telecom")
+CELL_KM = 0.5  # grid cell size; a few nodes per cell in a city
+MAX_DISTANCE_KM = 5.0  # houses farther than this from every node stay unassigned
+QUERY_BATCH = 50_000  # houses per vectorized query (bounds the candidate arrays)
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180
+CELL_OFFSET = 1 << 20  # cell rows/cols are shifted by this so the packed key stays non-negative
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between arrays of points"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _ring_offsets(ring):
+    """(row, col) offsets of the cells at Chebyshev distance `ring`"""
+    if ring == 0:
+        return np.zeros((1, 2), dtype=np.int64)
+    side = np.arange(-ring, ring + 1)
+    edge = np.full(len(side), ring)
+    inner = side[1:-1]
+    return np.concatenate([
+        np.column_stack([-edge, side]), np.column_stack([edge, side]),
+        np.column_stack([inner, -edge[1:-1]]), np.column_stack([inner, edge[1:-1]]),
+    ]).astype(np.int64)
+
+
+class GridIndex:
+    """
+    Uniform lat/lon grid over a set of points for batched nearest-neighbour queries.
+
+    Cells are at least CELL_KM wide everywhere in the indexed latitude range
+    (the longitude step is sized for the highest latitude), so after searching
+    the rings 0..r around a query every unsearched point is more than
+    r * ring_km(query) away; that is cell_km unless the query lies further
+    from the equator than every point, where the cells get narrower. Occupied
+    cells are kept as sorted packed keys with CSR offsets into the point order;
+    nothing is allocated for empty cells.
+    """
+
+    def __init__(self, latitude, longitude, cell_km=CELL_KM):
+        self.latitude = np.asarray(latitude, dtype=np.float64)
+        self.longitude = np.asarray(longitude, dtype=np.float64)
+        if not len(self.latitude):
+            raise ValueError("Cannot build a grid index without points")
+        self.cell_km = cell_km
+        self.max_lat = min(float(np.abs(self.latitude).max()), 85.0)
+        self.cell_lat = cell_km / KM_PER_DEGREE
+        self.cell_lon = cell_km / (KM_PER_DEGREE * np.cos(np.radians(self.max_lat)))
+
+        keys = self._keys(*self._cells(self.latitude, self.longitude))
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, starts, counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.cell_start = starts.astype(np.int64)
+        self.cell_count = counts.astype(np.int64)
+
+    def __len__(self):
+        return len(self.latitude)
+
+    def _cells(self, latitude, longitude):
+        rows = np.floor(np.asarray(latitude) / self.cell_lat).astype(np.int64)
+        cols = np.floor(np.asarray(longitude) / self.cell_lon).astype(np.int64)
+        return rows, cols
+
+    @staticmethod
+    def _keys(rows, cols):
+        return (rows + CELL_OFFSET) * (2 * CELL_OFFSET) + (cols + CELL_OFFSET)
+
+    def _search(self, lat, lon, rows, cols, queries, offsets, best, best_idx):
+        """Compare the queries with every point in the cells at the given offsets"""
+        n_offsets = len(offsets)
+        q = np.repeat(queries, n_offsets)
+        keys = self._keys(np.repeat(rows[queries], n_offsets) + np.tile(offsets[:, 0], len(queries)),
+                          np.repeat(cols[queries], n_offsets) + np.tile(offsets[:, 1], len(queries)))
+        pos = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        hit = self.cell_keys[pos] == keys
+        q, pos = q[hit], pos[hit]
+        if not len(q):
+            return
+
+        # Expand (query, cell) pairs to (query, point) pairs
+        counts = self.cell_count[pos]
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        q = np.repeat(q, counts)
+        points = self.order[np.repeat(self.cell_start[pos], counts) + within]
+        distance = haversine_km(lat[q], lon[q], self.latitude[points], self.longitude[points])
+
+        # Closest candidate per query
+        order = np.lexsort((distance, q))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = q[order][1:] != q[order][:-1]
+        q, points, distance = q[order][first], points[order][first], distance[order][first]
+        better = distance < best[q]
+        best[q[better]] = distance[better]
+        best_idx[q[better]] = points[better]
+
+    def ring_km(self, latitude):
+        """Width in km each searched ring is guaranteed to add around queries at these latitudes"""
+        lat = np.minimum(np.maximum(np.abs(latitude), self.max_lat), 85.0)
+        return np.minimum(self.cell_km, self.cell_lon * KM_PER_DEGREE * np.cos(np.radians(lat)))
+
+    def nearest(self, latitude, longitude, max_km=MAX_DISTANCE_KM):
+        """Index of the nearest point and its distance in km for every query (-1 / NaN beyond max_km)"""
+        lat = np.asarray(latitude, dtype=np.float64)
+        lon = np.asarray(longitude, dtype=np.float64)
+        best = np.full(len(lat), np.inf)
+        best_idx = np.full(len(lat), -1, dtype=np.int64)
+        rows, cols = self._cells(np.nan_to_num(lat), np.nan_to_num(lon))
+        # A query north (or south) of every point sees narrower cells: its rings are sized for its own latitude
+        ring_km = self.ring_km(np.nan_to_num(lat))
+        max_ring = int(np.ceil(max_km / ring_km.min())) + 1 if len(lat) else 0
+
+        for start in range(0, len(lat), QUERY_BATCH):
+            pending = np.arange(start, min(start + QUERY_BATCH, len(lat)))
+            pending = pending[np.isfinite(lat[pending]) & np.isfinite(lon[pending])]
+            for ring in range(max_ring + 1):
+                self._search(lat, lon, rows, cols, pending, _ring_offsets(ring), best, best_idx)
+                # Done once the best match is closer than anything outside the searched rings
+                pending = pending[best[pending] > ring * ring_km[pending]]
+                if not len(pending):
+                    break
+
+        too_far = best > max_km
+        best_idx[too_far] = -1
+        best[too_far] = np.nan
+        return best_idx, best
+
+
+class HierarchyJoin:
+    """
+    Assigns houses to the nearest geocoded node of the location tree and
+    resolves each node's district / town ancestors, so house rows can be
+    rolled up per level with bincounts.
+
+    Nodes sharing a coordinate (a geocoder falling back to the town centre)
+    are indexed once, keeping the deepest of them.
+    """
+
+    def __init__(self, tree, join_types=JOIN_TYPES, cell_km=CELL_KM):
+        self.tree = tree
+        types = np.asarray(tree.types)
+        x = np.asarray(tree.coord_x, dtype=np.float64)
+        y = np.asarray(tree.coord_y, dtype=np.float64)
+        candidates = np.flatnonzero(np.isin(types, [TYPES.index(t) for t in join_types]) & np.isfinite(x) & np.isfinite(y))
+        if not len(candidates):
+            raise ValueError(f"No {'/'.join(join_types)} node has coordinates; run the geocoding pass first")
+
+        depth = tree.depth()
+        candidates = candidates[np.argsort(-depth[candidates], kind="stable")]
+        _, first = np.unique(np.column_stack([y[candidates], x[candidates]]), axis=0, return_index=True)
+        self.nodes = candidates[np.sort(first)]
+        self.index = GridIndex(y[self.nodes], x[self.nodes], cell_km)
+        self.ancestors = self._ancestor_table(depth)
+        logger.info(f"Indexed {len(self.nodes)} of {len(candidates)} geocoded nodes")
+
+    def _ancestor_table(self, depth):
+        """Ancestor index of every node for each type (-1 when the node is above that level)"""
+        parent = np.asarray(self.tree.parent, dtype=np.int64)
+        types = np.asarray(self.tree.types)
+        table = np.full((len(TYPES), len(parent)), -1, dtype=np.int64)
+        # Level by level from the regions down: inherit the parent's ancestors, then add yourself
+        for level in range(int(depth.max()) + 1 if len(depth) else 0):
+            nodes = np.flatnonzero(depth == level)
+            has_parent = parent[nodes] >= 0
+            table[:, nodes[has_parent]] = table[:, parent[nodes[has_parent]]]
+            table[types[nodes], nodes] = nodes
+        return table
+
+    def assign(self, latitude, longitude, max_km=MAX_DISTANCE_KM):
+        """Tree index of the assigned node (-1 if none within max_km) and the distance in metres"""
+        nearest, distance = self.index.nearest(latitude, longitude, max_km)
+        nodes = np.where(nearest >= 0, self.nodes[np.maximum(nearest, 0)], -1)
+        return nodes, np.round(distance * 1000, 1)
+
+    def ancestor(self, nodes, type):
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return np.where(nodes >= 0, self.ancestors[TYPES.index(type)][np.maximum(nodes, 0)], -1)
+
+    def join(self, houses, max_km=MAX_DISTANCE_KM):
+        """houses with node_id / node_type / distance_m and <level>_id / <level> columns per ROLLUP_TYPES"""
+        nodes, distance = self.assign(houses["latitude"], houses["longitude"], max_km)
+        result = houses.copy()
+        ids = np.asarray(self.tree.ids, dtype=np.int64)
+        result["node_id"] = pd.arrays.IntegerArray(ids[np.maximum(nodes, 0)], nodes < 0)
+        result["node_type"] = [self.tree.type(node) if node >= 0 else None for node in nodes.tolist()]
+        result["distance_m"] = distance
+        for level in ROLLUP_TYPES:
+            level_nodes = self.ancestor(nodes, level)
+            result[f"{level}_id"] = pd.arrays.IntegerArray(ids[np.maximum(level_nodes, 0)], level_nodes < 0)
+            names = {node: self.tree.name(node) for node in np.unique(level_nodes[level_nodes >= 0]).tolist()}
+            result[level] = [names.get(node) for node in level_nodes.tolist()]
+        return result
+
+    def rollup(self, joined, level):
+        """Coverage counts per node of one level (only nodes with at least one house)"""
+        level_ids = joined[f"{level}_id"]
+        matched = level_ids.notna().to_numpy()
+        codes, uniques = pd.factorize(level_ids[matched])
+        n = len(uniques)
+        available = pd.to_numeric(joined["is_available"], errors="coerce").fillna(0).to_numpy()[matched] == 1
+        providers = joined["provider"].fillna("telecom").astype(str).to_numpy()[matched]
+
+        def count(mask):
+            return np.bincount(codes, weights=np.asarray(mask, dtype=float), minlength=n).astype(np.int64)
+
+        result = pd.DataFrame({
+            "id": np.asarray(uniques, dtype=np.int64),
+            "houses": np.bincount(codes, minlength=n),
+            "available": count(available),
+        })
+        result["unavailable"] = result["houses"] - result["available"]
+        result["available_share"] = np.round(result["available"] / result["houses"], 4)
+        for name in PROVIDERS:
+            result[name] = count(providers == name)
+            result[f"{name}_available"] = count((providers == name) & available)
+        distance = joined["distance_m"].to_numpy()[matched]
+        result["median_distance_m"] = pd.Series(distance).groupby(codes).median().reindex(range(n)).round(1).to_numpy()
+
+        nodes = [self.tree.index_of(location_id) for location_id in result["id"].tolist()]
+        result.insert(1, "name", [self.tree.name(node) for node in nodes])
+        result.insert(2, "path", [self.tree.path(node) for node in nodes])
+        return result.sort_values("houses", ascending=False, ignore_index=True)
+
+
+def load_tree():
+    if os.path.exists(TREE_FILE):
+        return LocationTree.load(TREE_FILE)
+    return LocationTree.from_frame(pd.read_csv(LOCATIONS_CSV))
+
+
+def load_houses(csv_file=INPUT_CSV):
+    """Geocoded houses of the combined CSV (rows without coordinates are dropped)"""
+    houses = pd.read_csv(csv_file)
+    houses["latitude"] = pd.to_numeric(houses["latitude"], errors="coerce")
+    houses["longitude"] = pd.to_numeric(houses["longitude"], errors="coerce")
+    return houses.dropna(subset=["latitude", "longitude"]).reset_index(drop=True)
+
+
+def main():
+    setup_logging()
+    metrics.start()
+    try:
+        with metrics.stage("load") as stage:
+            tree = load_tree()
+            houses = load_houses()
+            stage.add_rows(len(houses))
+        with metrics.stage("index") as stage:
+            join = HierarchyJoin(tree)
+            stage.add_rows(len(join.nodes))
+        with metrics.stage("join") as stage:
+            joined = join.join(houses)
+            stage.add_rows(len(joined))
+        unassigned = int(joined["node_id"].isna().sum())
+        metrics.incr("unassigned", unassigned)
+        logger.info(f"Assigned {len(joined) - unassigned} of {len(joined)} houses "
+                    f"(median distance {joined['distance_m'].median():.0f} m)")
+
+        with metrics.stage("write") as stage:
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            joined.to_csv(os.path.join(OUTPUT_DIR, "houses_by_location.csv"), index=False)
+            stage.add_rows(len(joined))
+            for level in ROLLUP_TYPES:
+                rollup = join.rollup(joined, level)
+                rollup.to_csv(os.path.join(OUTPUT_DIR, f"coverage_by_{level}.csv"), index=False)
+                stage.add_rows(len(rollup))
+                logger.info(f"{len(rollup)} {level}s with coverage written to {OUTPUT_DIR}")
+    finally:
+        metrics.write_report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Configuration (can be overridden through environment variables)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+TRACE_MEMORY = os.getenv("METRICS_TRACEMALLOC", "0") != "0"
+REPORT_PATH = os.getenv("METRICS_REPORT")  # .json or .prom, defaults to <run_name>_run_report.json
+
+# Counters that are always present in the report, even if they stayed at zero
+DEFAULT_COUNTERS = ("requests", "retries", "rate_limited", "cache_hits", "errors")
+
+
+def setup_logging(level=None):
+    """Configure root logging once for a script run"""
+    level = (level or LOG_LEVEL).upper()
+    logging.basicConfig(level=getattr(logging, level, logging.INFO), format=LOG_FORMAT, stream=sys.stdout)
+    # urllib3 logs every connection at DEBUG, which is just noise for us
+    logging.getLogger("urllib3").setLevel(logging.WARNING)
+
+
+def percentile(values, q):
+    """Nearest-rank style percentile with linear interpolation (q in 0..100)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+class StageTimer:
+    """Wall-clock timer for one pipeline stage, with an optional row count"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.seconds = 0.0
+        self._started = None
+
+    def add_rows(self, n=1):
+        self.rows += n
+
+    def as_dict(self):
+        return {
+            "seconds": round(self.seconds, 4),
+            "rows": self.rows,
+            "rows_per_sec": round(self.rows / self.seconds, 2) if self.seconds > 0 and self.rows else None,
+        }
+
+
+class RunMetrics:
+    """
+    Collects counters, per-stage timings, request latencies and memory usage
+    for one script run, and writes them as a machine-readable report at the end
+    """
+
+    def __init__(self, run_name):
+        self.run_name = run_name
+        self.counters = {name: 0 for name in DEFAULT_COUNTERS}
+        self.stages = {}
+        self.latencies = {}
+        self.started_at = None
+        self._t0 = None
+        self._owns_tracemalloc = False
+
+    def start(self):
+        """Start the run clock and memory tracing"""
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        if TRACE_MEMORY and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        return self
+
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        """Record one latency sample (in seconds) for the named operation"""
+        self.latencies.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        """Time a stage; the yielded timer can count rows via add_rows()"""
+        timer = self.stages.get(name)
+        if timer is None:
+            timer = self.stages[name] = StageTimer(name)
+        started = time.perf_counter()
+        try:
+            yield timer
+        finally:
+            timer.seconds += time.perf_counter() - started
+
+    @contextmanager
+    def timed(self, name):
+        """Time a single operation and record it as a latency sample"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def memory(self):
+        result = {"tracemalloc_peak_bytes": None, "max_rss_bytes": None}
+        if tracemalloc.is_tracing():
+            result["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        if resource is not None:
+            # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            result["max_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+        return result
+
+    def report(self):
+        """Build the run report as a plain dict"""
+        elapsed = time.perf_counter() - self._t0 if self._t0 is not None else 0.0
+        latency = {}
+        for name, samples in self.latencies.items():
+            latency[name] = {
+                "count": len(samples),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "max_ms": round(max(samples) * 1000, 2),
+            }
+        return {
+            "run": self.run_name,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "elapsed_seconds": round(elapsed, 3),
+            "counters": dict(self.counters),
+            "stages": {name: timer.as_dict() for name, timer in self.stages.items()},
+            "latency": latency,
+            "memory": self.memory(),
+        }
+
+    def to_prometheus(self, report=None):
+        """Render the report in the Prometheus textfile exposition format"""
+        report = report or self.report()
+        label = f'run="{self.run_name}"'
+        lines = [
+            f"parsing_run_elapsed_seconds{{{label}}} {report['elapsed_seconds']}",
+        ]
+        for name, value in report["counters"].items():
+            lines.append(f'parsing_run_counter_total{{{label},counter="{name}"}} {value}')
+        for name, stage in report["stages"].items():
+            lines.append(f'parsing_run_stage_seconds{{{label},stage="{name}"}} {stage["seconds"]}')
+            lines.append(f'parsing_run_stage_rows{{{label},stage="{name}"}} {stage["rows"]}')
+        for name, stats in report["latency"].items():
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms")):
+                seconds = stats[key] / 1000
+                lines.append(f'parsing_run_latency_seconds{{{label},op="{name}",quantile="{quantile}"}} {seconds}')
+            lines.append(f'parsing_run_latency_seconds_count{{{label},op="{name}"}} {stats["count"]}')
+        for name, value in report["memory"].items():
+            if value is not None:
+                lines.append(f'parsing_run_memory_{name}{{{label}}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path=None):
+        """Write the report to JSON, or to a Prometheus textfile if the path ends with .prom"""
+        path = path or REPORT_PATH or f"{self.run_name}_run_report.json"
+        report = self.report()
+        if path.endswith(".prom"):
+            content = self.to_prometheus(report)
+        else:
+            content = json.dumps(report, ensure_ascii=False, indent=2)
+        # Write atomically so a textfile collector never sees a half-written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+        log = logging.getLogger(self.run_name)
+        for name, stage in report["stages"].items():
+            rate = f", {stage['rows_per_sec']} rows/sec" if stage["rows_per_sec"] else ""
+            log.info(f"Stage {name}: {stage['seconds']:.2f}s, {stage['rows']} rows{rate}")
+        log.info(f"Counters: {report['counters']}")
+        log.info(f"Run report saved to {path}")
+
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+            self._owns_tracemalloc = False
+        return report
@@ -0,0 +1,377 @@
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "parsing_beeline"))
+sys.path.insert(0, os.path.join(ROOT_DIR, "parsing_telecom"))
+from run_metrics import setup_logging
+
+logger = logging.getLogger("scaling_benchmark")
+
+# Configuration (can be overridden through environment variables)
+SIZES = [int(size) for size in os.getenv("BENCHMARK_SIZES", "10000,100000,1000000,10000000").split(",")]
+STAGES = ("prepare_beeline_data", "combine_data", "convert_to_json", "telecom_export")
+REPEAT = int(os.getenv("BENCHMARK_REPEAT", "1"))  # best of N runs per stage and size
+SEED = 42
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmark_results")
+HISTORY_FILE = os.path.join(RESULTS_DIR, "history.json")
+BASELINE_FILE = os.path.join(RESULTS_DIR, "baseline.json")
+SAVE_BASELINE = os.getenv("BENCHMARK_SAVE_BASELINE", "0") != "0"
+TIME_TOLERANCE = 0.25  # slower than the baseline by more than this share is a regression...
+MIN_DELTA_SECONDS = 0.1  # ...if it is also at least this much slower
+MEMORY_TOLERANCE = 0.25
+MIN_DELTA_MIB = 16
+HOUSES_PER_STREET = 40
+STREETS_PER_TOWN = 50
+TOWNS_PER_DISTRICT = 10
+DISTRICTS_PER_REGION = 8
+DUPLICATE_SHARE = 0.2  # Telecom points sharing coordinates with a Beeline point (removed by combine_data)
+
+STREET_TYPES = [("улица", "ул."), ("микрорайон", "мкр."), ("проспект", "пр."), ("переулок", "пер.")]
+STREET_WORDS = np.array(["Абая", "Сейфуллина", "Жандосова", "Толе би", "Райымбека", "Сатпаева", "Гагарина",
+                         "Байтурсынова", "Достык", "Алатау", "Жибек жолы", "Тимирязева", "Розыбакиева", "Навои"])
+
+
+# Synthetic data (seeded; the same size always gives the same files)
+
+def synthetic_streets(n, seed=SEED):
+    """Rows shaped like beeline_streets_city_1.csv"""
+    rng = np.random.default_rng(seed)
+    street_ids = np.arange(1, n + 1)
+    type_codes = rng.integers(0, len(STREET_TYPES), n)
+    names = pd.Series(STREET_WORDS[rng.integers(0, len(STREET_WORDS), n)]) + " " + pd.Series(street_ids).astype(str)
+    return pd.DataFrame({
+        "id": street_ids + 100,
+        "created_at": "2024-10-22T05:50:25.006590Z",
+        "updated_at": "2024-10-22T05:50:25.006120Z",
+        "street_id": street_ids,
+        "city_id": 1,
+        "street_kladr": 200000000000 + street_ids,
+        "street_type_id": type_codes + 1,
+        "street_type_full": [STREET_TYPES[code][0] for code in type_codes],
+        "street_type_short": [STREET_TYPES[code][1] for code in type_codes],
+        "name": names,
+    })
+
+
+def synthetic_houses(n, n_streets, seed=SEED):
+    """Rows shaped like beeline_houses_city_1.csv"""
+    rng = np.random.default_rng(seed + 1)
+    numbers = rng.integers(1, 300, n).astype(str)
+    has_building = rng.random(n) < 0.1
+    return pd.DataFrame({
+        "house_id": np.arange(1, n + 1),
+        "street_id": rng.integers(1, n_streets + 1, n),
+        "city_id": 1,
+        "house_kladr": 200000000000 + np.arange(1, n + 1),
+        "house": np.where(rng.random(n) < 0.15, np.char.add(np.char.add(numbers, "/"), rng.integers(1, 9, n).astype(str)), numbers),
+        "building": np.where(has_building, np.char.add("к", rng.integers(1, 5, n).astype(str)), ""),
+        "avail_status": rng.integers(0, 2, n),
+        "ip_tv_is_available": rng.integers(0, 2, n),
+        "ksk_id": rng.integers(1, 5000, n),
+        "mpkp": "1, 2,",
+        "sector_id": rng.integers(1, 400, n),
+        "subsector_id": rng.integers(1, 2000, n),
+        "technology": np.where(rng.random(n) < 0.8, "fttb", "gpon"),
+    })
+
+
+def synthetic_geocoded(n, provider, seed=SEED, shared=None):
+    """Geocoded addresses in the combined CSV schema; `shared` coordinates are reused for part of the rows"""
+    rng = np.random.default_rng(seed + (2 if provider == "beeline" else 3))
+    streets = pd.Series(STREET_WORDS[rng.integers(0, len(STREET_WORDS), n)]) + " " + pd.Series(rng.integers(1, max(2, n // HOUSES_PER_STREET), n)).astype(str)
+    houses = pd.Series(rng.integers(1, 300, n)).astype(str)
+    latitude = np.round(43.05 + rng.random(n) * 0.4, 6)
+    longitude = np.round(76.65 + rng.random(n) * 0.55, 6)
+    if shared is not None:
+        reuse = np.flatnonzero(rng.random(n) < DUPLICATE_SHARE)
+        source = rng.integers(0, len(shared), len(reuse))
+        latitude[reuse] = shared["latitude"].to_numpy()[source]
+        longitude[reuse] = shared["longitude"].to_numpy()[source]
+    return pd.DataFrame({
+        "street_id": rng.integers(1, max(2, n // HOUSES_PER_STREET), n),
+        "street_name": "улица " + streets,
+        "house": houses,
+        "sub_house": np.where(rng.random(n) < 0.1, "к1", ""),
+        "is_available": rng.integers(0, 2, n),
+        "full_address": "Алматы г., улица " + streets + ", " + houses,
+        "latitude": latitude,
+        "longitude": longitude,
+        "gis_full_name": "Алматы, " + streets + ", " + houses,
+        "provider": provider,
+    })
+
+
+def synthetic_locations(n, seed=SEED):
+    """A region > district > town > street hierarchy of about n nodes, in the telecom_locations.csv schema"""
+    rng = np.random.default_rng(seed + 4)
+    per_region = DISTRICTS_PER_REGION * (1 + TOWNS_PER_DISTRICT * (1 + STREETS_PER_TOWN)) + 1
+    n_regions = max(1, n // per_region)
+    n_districts = n_regions * DISTRICTS_PER_REGION
+    n_towns = n_districts * TOWNS_PER_DISTRICT
+    n_streets = max(0, n - n_regions - n_districts - n_towns)
+
+    counts = [n_regions, n_districts, n_towns, n_streets]
+    starts = np.cumsum([1] + counts[:-1])
+    ids = [np.arange(start, start + count) for start, count in zip(starts, counts)]
+    parents = [
+        np.full(n_regions, np.nan),
+        ids[0][np.arange(n_districts) // DISTRICTS_PER_REGION],
+        ids[1][np.arange(n_towns) // TOWNS_PER_DISTRICT],
+        ids[2][rng.integers(0, n_towns, n_streets)],
+    ]
+    names = [
+        pd.Series(ids[0]).map(lambda i: f"Область {i}"),
+        pd.Series(ids[1]).map(lambda i: f"Район {i}"),
+        pd.Series(ids[2]).map(lambda i: f"г.Город {i}"),
+        pd.Series(STREET_WORDS[rng.integers(0, len(STREET_WORDS), n_streets)]).str.upper() + " " + pd.Series(ids[3]).astype(str),
+    ]
+    locations = pd.DataFrame({
+        "id": np.concatenate(ids),
+        "parent_id": np.concatenate(parents),
+        "type": np.repeat(["region", "district", "town", "street"], counts),
+        "name": pd.concat(names, ignore_index=True),
+        "original_id": np.concatenate(ids) + 1000,
+        "full_address": "",  # rebuilt from the tree on export
+        "coordX": np.nan,
+        "coordY": np.nan,
+    })
+    return locations
+
+
+def write_inputs(rows, workdir):
+    """Write every stage's input files for one size into workdir"""
+    n_streets = max(1, rows // HOUSES_PER_STREET)
+    synthetic_streets(n_streets).to_csv(os.path.join(workdir, "beeline_streets_city_1.csv"), index=False)
+    synthetic_houses(rows, n_streets).to_csv(os.path.join(workdir, "beeline_houses_city_1.csv"), index=False)
+    beeline = synthetic_geocoded(rows // 2, "beeline")
+    beeline.to_csv(os.path.join(workdir, "beeline_ftth_with_coordinates.csv"), index=False)
+    synthetic_geocoded(rows - rows // 2, "telecom", shared=beeline).to_csv(
+        os.path.join(workdir, "ftth_results_with_coordinates.csv"), index=False)
+    synthetic_locations(rows).to_csv(os.path.join(workdir, "telecom_locations_input.csv"), index=False)
+
+
+# Stage runner (one fresh process per measurement, so peak RSS belongs to that stage)
+
+def _max_rss_mib():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (max_rss if sys.platform == "darwin" else max_rss * 1024) / 2**20
+
+
+def _stage_call(stage):
+    """Callable running one stage; inputs are loaded here so they are not part of the timing"""
+    if stage == "prepare_beeline_data":
+        from beeline_geocoding_script import prepare_beeline_data
+        return prepare_beeline_data
+    if stage == "combine_data":
+        from test_app import combine_data
+        return combine_data
+    if stage == "convert_to_json":
+        from test_app import COMBINED_CSV, COMBINED_JSON, convert_to_json
+        _reset_map_data()
+        return lambda: convert_to_json(COMBINED_CSV, COMBINED_JSON)
+    if stage == "telecom_export":
+        from address_records import LocationRecord, RecordTable
+        import parsing
+        locations = RecordTable.from_frame(LocationRecord, pd.read_csv("telecom_locations_input.csv"))
+        # The tree goes into the scratch dir, not next to the repository's location_tree.TREE_FILE
+        return lambda: parsing.save_locations(locations, tree_file="telecom_locations.tree")
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _reset_map_data():
+    """
+    Drop what an earlier convert_to_json run published into the scratch dir, so
+    every measured run starts from no snapshot and writes the same first version
+    """
+    from map_patches import PATCH_DIR, SNAPSHOT_FILE
+    from test_app import MAP_DIR, MAP_JSON
+    shutil.rmtree(os.path.join(MAP_DIR, PATCH_DIR), ignore_errors=True)
+    for path in (SNAPSHOT_FILE, os.path.join(MAP_DIR, MAP_JSON)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _run_stage(stage, workdir, queue):
+    try:
+        setup_logging("WARNING")
+        os.chdir(workdir)
+        os.environ["MAP_DIR"] = workdir  # publish the map data into the scratch dir, not the repo
+        call = _stage_call(stage)
+        rss_before = _max_rss_mib()
+        started = time.perf_counter()
+        call()
+        seconds = time.perf_counter() - started
+        rss_after = _max_rss_mib()
+        queue.put({"seconds": seconds, "peak_rss_mib": None if rss_after is None else rss_after - rss_before})
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def measure(stage, rows, workdir, repeat=REPEAT):
+    """Best-of-`repeat` seconds and the largest peak RSS growth of one stage"""
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(repeat):
+        queue = context.Queue()
+        process = context.Process(target=_run_stage, args=(stage, workdir, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        if "error" in result:
+            raise RuntimeError(f"{stage} at {rows} rows failed: {result['error']}")
+        runs.append(result)
+    seconds = min(run["seconds"] for run in runs)
+    memory = [run["peak_rss_mib"] for run in runs if run["peak_rss_mib"] is not None]
+    return {
+        "stage": stage,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mib": round(max(memory), 1) if memory else None,
+    }
+
+
+def run_suite(sizes=SIZES, stages=STAGES):
+    results = []
+    for rows in sizes:
+        workdir = tempfile.mkdtemp(prefix=f"benchmark_{rows}_")
+        try:
+            started = time.perf_counter()
+            # Generated in a child too: a child inherits the peak RSS of the process that starts it
+            process = multiprocessing.get_context("spawn").Process(target=write_inputs, args=(rows, workdir))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f"Generating {rows} synthetic rows failed")
+            logger.info(f"{rows} rows: synthetic inputs written in {time.perf_counter() - started:.1f}s")
+            # Stages run in pipeline order: convert_to_json reads what combine_data wrote
+            for stage in stages:
+                result = measure(stage, rows, workdir)
+                results.append(result)
+                logger.info(f"{stage} @ {rows}: {result['seconds']:.3f}s, peak RSS +{result['peak_rss_mib']} MiB")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+# History and regression comparison
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_record(results):
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+
+
+def _read_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def append_history(record, path=HISTORY_FILE):
+    history = _read_json(path, [])
+    history.append(record)
+    _write_json(path, history)
+
+
+def compare(results, baseline):
+    """
+    Per (stage, rows) ratios against the baseline run. A stage regressed when
+    it is both relatively (TIME_TOLERANCE / MEMORY_TOLERANCE) and absolutely
+    (MIN_DELTA_SECONDS / MIN_DELTA_MIB) worse, so noise on tiny stages is ignored.
+    """
+    base = {(result["stage"], result["rows"]): result for result in baseline["results"]}
+    rows = []
+    for result in results:
+        old = base.get((result["stage"], result["rows"]))
+        if old is None:
+            continue
+        time_ratio = result["seconds"] / old["seconds"] if old["seconds"] > 0 else None
+        slower = (time_ratio is not None and time_ratio > 1 + TIME_TOLERANCE
+                  and result["seconds"] - old["seconds"] >= MIN_DELTA_SECONDS)
+        memory_ratio, larger = None, False
+        if result["peak_rss_mib"] is not None and old["peak_rss_mib"]:
+            memory_ratio = result["peak_rss_mib"] / old["peak_rss_mib"]
+            larger = (memory_ratio > 1 + MEMORY_TOLERANCE
+                      and result["peak_rss_mib"] - old["peak_rss_mib"] >= MIN_DELTA_MIB)
+        rows.append({
+            "stage": result["stage"],
+            "rows": result["rows"],
+            "seconds": result["seconds"],
+            "baseline_seconds": old["seconds"],
+            "time_ratio": None if time_ratio is None else round(time_ratio, 3),
+            "peak_rss_mib": result["peak_rss_mib"],
+            "baseline_peak_rss_mib": old["peak_rss_mib"],
+            "memory_ratio": None if memory_ratio is None else round(memory_ratio, 3),
+            "regression": slower or larger,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    setup_logging()
+    record = run_record(run_suite())
+    append_history(record)
+    logger.info(f"Run appended to {HISTORY_FILE}")
+
+    baseline = _read_json(BASELINE_FILE, None)
+    regressions = 0
+    if baseline is not None:
+        comparison = compare(record["results"], baseline)
+        if not comparison.empty:
+            logger.info(f"Compared with baseline {baseline.get('commit')} ({baseline['timestamp']}):\n{comparison.to_string(index=False)}")
+            regressions = int(comparison["regression"].sum())
+            if regressions:
+                logger.warning(f"{regressions} stage/size combinations regressed against the baseline")
+    if SAVE_BASELINE or baseline is None:
+        _write_json(BASELINE_FILE, record)
+        logger.info(f"Saved this run as the baseline in {BASELINE_FILE}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()